@@ -9,15 +9,19 @@ Simply input the ticker symbol of your desired company and hit the 'Generate Ins
 """)
         
 
-from src.income_statement import income_statement
-from src.balance_sheet import balance_sheet
-from src.cash_flow import cash_flow
+from src.income_statement import income_statement_report
+from src.balance_sheet import balance_sheet_report
+from src.cash_flow import cash_flow_report
 from src.news_sentiment import top_news
 from src.company_overview import company_overview
-from src.utils import round_numeric, format_currency, create_donut_chart, create_bar_chart
+from src.utils import round_numeric, format_currency, create_donut_chart, create_bar_chart, quarterly_table, InsightPlaceholders, QuotaStatus, show_telemetry, statements_insights
+from src.peers import describe
 from src.pdf_gen import gen_pdf
 from src.fields2 import inc_stat, inc_stat_attributes, bal_sheet, balance_sheet_attributes, cashflow, cashflow_attributes
 from src.ticker_search import get_companies , get_ticker
+from src.statements import StatementBundle
+from src.av_async import prefetch
+from src.telemetry import tracked_run
 
 st.sidebar.info("""
 You can get your API keys here: [OpenAI](https://openai.com/blog/openai-api), [AlphaVantage](https://www.alphavantage.co/support/#api-key), 
@@ -25,7 +29,8 @@ You can get your API keys here: [OpenAI](https://openai.com/blog/openai-api), [A
 
 # st.write(st.session_state.company_overview)
 
-OPENAI_API_KEY = st.sidebar.text_input("Enter OpenAI API key", type="password")
+# the local stand-in backend (LLM_BACKEND=stub) needs no key
+OPENAI_API_KEY = st.sidebar.text_input("Enter OpenAI API key", type="password") or ("stub" if os.environ.get("LLM_BACKEND") == "stub" else "")
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
 AV_API_KEY = st.sidebar.text_input("Enter Alpha Vantage API key", type="password")
@@ -112,76 +117,82 @@ else:
         if "all_outputs" not in st.session_state:
             st.session_state.all_outputs = None
 
+        if "telemetry" not in st.session_state:
+            st.session_state.telemetry = None
+
         if ticker:
             if st.button("Generate Insights"):
 
-                with st.status("**Generating Insights...**"):
+                # every completion of this run, per insight, see src/telemetry.py
+                with tracked_run(f"finance_metrics {ticker}") as run, st.status("**Generating Insights...**"):
+
+                    quota = QuotaStatus()
+                    bundle = StatementBundle(ticker, on_eta=quota)
 
+                    functions = set()
+                    if not st.session_state.company_overview:
+                        functions.add("OVERVIEW")
+                    elif st.session_state.company_overview.get("Symbol") == ticker:
+                        # the peer ranks read sector and industry from the overview shown already
+                        bundle.put("OVERVIEW", st.session_state.company_overview)
+                    if any(income_statement_feature_list):
+                        functions.add("INCOME_STATEMENT")
+                    if any(balance_sheet_feature_list):
+                        functions.update(("BALANCE_SHEET", "INCOME_STATEMENT"))
+                    if any(cash_flow_feature_list):
+                        functions.update(("CASH_FLOW", "INCOME_STATEMENT", "BALANCE_SHEET"))
+                    if not st.session_state.news:
+                        functions.add("NEWS_SENTIMENT")
+                    prefetch(bundle, tuple(functions))
 
                     if not st.session_state.company_overview:
                         st.write("Getting company overview...")
-                        st.session_state.company_overview = company_overview(ticker)
+                        st.session_state.company_overview = company_overview(ticker, bundle)
 
                         if "Error" in st.session_state.company_overview:
                             st.error(st.session_state.company_overview["Error"])
                         
                     
-                    if any(income_statement_feature_list):
-                        st.write("Generating income statement insights...")
-                        for i, insight in enumerate(inc_stat_attributes):
+                    # the reports are read first, the insights of all of them are generated in one batch
+                    statements = [
+                        ("income_statement", income_statement_report, income_statement_feature_list, inc_stat_attributes),
+                        ("balance_sheet", balance_sheet_report, balance_sheet_feature_list, balance_sheet_attributes),
+                        ("cash_flow", cash_flow_report, cash_flow_feature_list, cashflow_attributes),
+                    ]
+                    responses, requests = {}, {}
+                    for name, report, feature_list, attributes in statements:
+                        if not any(feature_list):
+                            continue
+                        for i, insight in enumerate(attributes):
                             if st.session_state[insight]:
-                                   income_statement_feature_list[i] = False 
-
-                        response = income_statement(ticker, income_statement_feature_list)
-
-                        st.session_state.income_statement = response
-
-                        if "Error" in st.session_state.income_statement:
-                            st.error(st.session_state.income_statement["Error"])
-
-                        print(response)
-                        for key, value in response["insights"].items():
-                            st.session_state[key] = value
-                    
-                    
-                    if any(balance_sheet_feature_list):
-                        st.write("Generating balance sheet insights...")
-                        for i, insight in enumerate(balance_sheet_attributes):
-                            if st.session_state[insight]:
-                                   balance_sheet_feature_list[i] = False
-
-                        response = balance_sheet(ticker, balance_sheet_feature_list)
-
-                        st.session_state.balance_sheet = response
-
-                        if "Error" in st.session_state.balance_sheet:
-                            st.error(st.session_state.balance_sheet["Error"])
-
-                        for key, value in response["insights"].items():
+                                feature_list[i] = False
+                        responses[name], request = report(ticker, feature_list, bundle)
+                        if request is not None:
+                            requests[name] = request
+
+                    if requests:
+                        st.write("Generating insights...")
+                        placeholders = InsightPlaceholders([field for name, _, feature_list, attributes in statements if name in requests
+                                                            for field, include in zip(attributes, feature_list) if include])
+                        for name, ins in statements_insights(requests, placeholders).items():
+                            responses[name]["insights"] = ins
+                        placeholders.clear()
+
+                    for name, response in responses.items():
+                        st.session_state[name] = response
+
+                        if "Error" in response:
+                            st.error(response["Error"])
+
+                        for key, value in response.get("insights", {}).items():
                             st.session_state[key] = value
-                    
-                    
-                    if any(cash_flow_feature_list):
-                        st.write("Generating cash flow insights...")
-                        for i, insight in enumerate(cashflow_attributes):
-                            if st.session_state[insight]:
-                                   cash_flow_feature_list[i] = False
-
-
-                        response = cash_flow(ticker, cash_flow_feature_list)
 
-                        st.session_state.cash_flow = response
-
-                        if "Error" in st.session_state.cash_flow:
-                            st.error(st.session_state.cash_flow["Error"])
-                        
-
-                        for key, value in response["insights"].items():
-                            st.session_state[key] = value
+                    st.session_state.telemetry = (run.summary(), run.by_field())
 
                     if not st.session_state.news:
                         st.write('Getting latest news...')
-                        st.session_state.news = top_news(ticker, 10)
+                        st.session_state.news = top_news(ticker, 10, bundle)
+                    quota.clear()
 
                     if st.session_state.company_overview and st.session_state.income_statement and st.session_state.balance_sheet and st.session_state.cash_flow and st.session_state.news:
                         st.session_state.all_outputs = True
@@ -189,6 +200,9 @@ else:
                     if st.session_state.company_overview == None:
                         st.error(f"No Data available")
 
+        if st.session_state.telemetry:
+            show_telemetry(*st.session_state.telemetry)
+
         if st.session_state.all_outputs:
             st.toast("Insights successfully Generated!")
             if st.button("Generate PDF"):
@@ -278,6 +292,13 @@ else:
                         col1.metric("Cost Efficiency", round_numeric(st.session_state.income_statement["metrics"]["cost_efficiency"], 2))
                         col2.metric("SG&A Efficiency", round_numeric(st.session_state.income_statement["metrics"]["sg_and_a_efficiency"], 2))
                         col3.metric("Interest Coverage Ratio", round_numeric(st.session_state.income_statement["metrics"]["interest_coverage_ratio"], 2))
+
+                    for metric, rank in st.session_state.income_statement.get("peer_percentiles", {}).items():
+                        st.caption(f"{metric.replace('_', ' ').capitalize()}: {describe(rank)} ({rank['peers']} peers)")
+
+                    if st.session_state.income_statement.get("quarterly_metrics"):
+                        with st.expander("Quarterly metrics (trailing twelve months)"):
+                            st.dataframe(quarterly_table(st.session_state.income_statement["quarterly_metrics"]))
                 
                     
                     st.write("## Insights")
@@ -355,6 +376,13 @@ else:
                     col1.metric("Asset Turnover", round_numeric(st.session_state.balance_sheet['metrics']['asset_turnover'], 2))
                     col2.metric("Equity Multiplier", round_numeric(st.session_state.balance_sheet['metrics']['equity_multiplier'], 2))
 
+                for metric, rank in st.session_state.balance_sheet.get("peer_percentiles", {}).items():
+                    st.caption(f"{metric.replace('_', ' ').capitalize()}: {describe(rank)} ({rank['peers']} peers)")
+
+                if st.session_state.balance_sheet.get("quarterly_metrics"):
+                    with st.expander("Quarterly metrics (trailing twelve months)"):
+                        st.dataframe(quarterly_table(st.session_state.balance_sheet["quarterly_metrics"]))
+
 
 
                 st.write("## Insights")
@@ -421,6 +449,13 @@ else:
                     col1.metric("Cash Flow to Debt Ratio", round_numeric(st.session_state.cash_flow['metrics']['cash_flow_to_debt_ratio'], 2))
                     
                     col2.metric("Free Cash Flow", format_currency(st.session_state.cash_flow['metrics']['free_cash_flow']))
+
+                for metric, rank in st.session_state.cash_flow.get("peer_percentiles", {}).items():
+                    st.caption(f"{metric.replace('_', ' ').capitalize()}: {describe(rank)} ({rank['peers']} peers)")
+
+                if st.session_state.cash_flow.get("quarterly_metrics"):
+                    with st.expander("Quarterly metrics (trailing twelve months)"):
+                        st.dataframe(quarterly_table(st.session_state.cash_flow["quarterly_metrics"]))
                     
 
                 if operational_cash_efficiency:
@@ -6,10 +6,15 @@ from llama_index.vector_stores import FaissVectorStore
 from llama_index.tools import QueryEngineTool, ToolMetadata
 from llama_index.query_engine import SubQuestionQueryEngine
 from llama_index.embeddings import OpenAIEmbedding
+from llama_index.response_synthesizers import get_response_synthesizer
 from llama_index.schema import Document
 from llama_index.node_parser import UnstructuredElementNodeParser
 
-from src.utils import get_model, process_pdf2, generate_pydantic_model
+from src.utils import get_model, get_service_context, process_pdf2, generate_pydantic_model, InsightPlaceholders, show_telemetry
+from src.llm_executor import run_ordered, stream_ordered
+from src.semantic_cache import cached_query, stream_query, document_hash, get_semantic_cache
+from src.prompt_registry import get_prompts
+from src.telemetry import tracked_run
 from src.pydantic_models import FiscalYearHighlights, StrategyOutlookFutureDirection, RiskManagement, CorporateGovernanceSocialResponsibility, InnovationRnD
 # from src.fields import (
 #     fiscal_year_fields, fiscal_year_attributes, 
@@ -46,7 +51,8 @@ def process_pdf(pdf):
     for page in file.pages:
         document_list.append(Document(text=str(page.extract_text())))
 
-    node_paser = UnstructuredElementNodeParser()
+    # table summaries use the configured backend instead of llama_index's default OpenAI client
+    node_paser = UnstructuredElementNodeParser(llm=get_service_context("openai").llm)
     nodes = node_paser.get_nodes_from_documents(document_list, show_progress=True)
     
     return nodes
@@ -54,7 +60,6 @@ def process_pdf(pdf):
 
 def get_vector_index(nodes, vector_store):
     print(nodes)
-    llm = get_model("openai")
     if vector_store == "faiss":
         d = 1536
         faiss_index = faiss.IndexFlatL2(d)
@@ -62,7 +67,7 @@ def get_vector_index(nodes, vector_store):
         storage_context = StorageContext.from_defaults(vector_store=vector_store)
         # embed_model = OpenAIEmbedding()
         # service_context = ServiceContext.from_defaults(embed_model=embed_model)
-        service_context = ServiceContext.from_defaults(llm=llm) 
+        service_context = get_service_context("openai")
         index = VectorStoreIndex(nodes, 
             service_context=service_context,
             storage_context=storage_context
@@ -75,24 +80,24 @@ def get_vector_index(nodes, vector_store):
 
 
 
-def generate_insight(engine, insight_name, section_name, output_format):
+def report_prompt(insight_name, section_name, output_format):
 
-    with open("prompts/report.prompt", "r") as f:
-        template = f.read()
+    _, formatted_input = get_prompts().format("report", insight_name=insight_name, section_name=section_name, output_format=output_format)
+    print(formatted_input)
+    return formatted_input
 
-    prompt_template = PromptTemplate(
-        template=template,
-        input_variables=['insight_name', 'section_name', 'output_format']
-    )
 
-    formatted_input = prompt_template.format(insight_name=insight_name, section_name=section_name, output_format=output_format)
-    print(formatted_input)
-    response = engine.query(formatted_input)
-    return response.response
+def generate_insight(engine, insight_name, section_name, output_format, doc_hash=None):
+    # answers already given for this report, or for a near-identical question, are reused
+    return cached_query(engine, doc_hash, report_prompt(insight_name, section_name, output_format), insight=insight_name)
+
+
+def stream_insight(engine, insight_name, section_name, output_format, doc_hash=None):
+    yield from stream_query(engine, doc_hash, report_prompt(insight_name, section_name, output_format), insight=insight_name)
     
 
 
-def report_insights(engine, section_name, fields_to_include, section_num):
+def report_insights(engine, section_name, fields_to_include, section_num, doc_hash=None, on_chunk=None):
 
     fields = None
     attribs = None
@@ -110,19 +115,23 @@ def report_insights(engine, section_name, fields_to_include, section_num):
         fields = innovation
         attribs = innovation_attributes
 
-    ins = {}
-    for i, field in enumerate(attribs):
-        if fields_to_include[i]:
-            response = generate_insight(engine, field, section_name, str({field: fields[field]}))
-            ins[field] = response
+    # queries run concurrently, results keep the attribute order
+    selected = [field for i, field in enumerate(attribs) if fields_to_include[i]]
+    if on_chunk is None:
+        ins = run_ordered([(field, generate_insight, engine, field, section_name, str({field: fields[field]}), doc_hash) for field in selected])
+    else:
+        # on_chunk(field, text so far) renders each answer as it streams in
+        ins = {field: "" for field in selected}
+        for field, chunk in stream_ordered([(field, stream_insight, engine, field, section_name, str({field: fields[field]}), doc_hash) for field in selected]):
+            ins[field] += chunk
+            on_chunk(field, ins[field])
 
     return {
         "insights": ins
     }
 
 def get_query_engine(engine):
-    llm = get_model("openai")
-    service_context = ServiceContext.from_defaults(llm=llm)
+    service_context = get_service_context("openai")
 
     query_engine_tools = [
         QueryEngineTool(
@@ -135,9 +144,11 @@ def get_query_engine(engine):
     ]
 
 
+    # only the final synthesis streams, the sub-question answers are needed whole
     s_engine = SubQuestionQueryEngine.from_defaults(
         query_engine_tools=query_engine_tools,
-        service_context=service_context
+        service_context=service_context,
+        response_synthesizer=get_response_synthesizer(service_context=service_context, streaming=True),
     )
     return s_engine
 
@@ -161,15 +172,22 @@ for insight in innovation_attributes:
 if "end_time" not in st.session_state:
     st.session_state.end_time = None
 
+if "telemetry" not in st.session_state:
+    st.session_state.telemetry = None
+
 
 if "process_doc" not in st.session_state:
         st.session_state.process_doc = False
 
+if "doc_hash" not in st.session_state:
+    st.session_state.doc_hash = None
+
 
 st.sidebar.info("""
 You can get your OpenAI API key [here](https://openai.com/blog/openai-api)
 """)
-OPENAI_API_KEY = st.sidebar.text_input("OpenAI API Key", type="password")
+# the local stand-in backend (LLM_BACKEND=stub) needs no key
+OPENAI_API_KEY = st.sidebar.text_input("OpenAI API Key", type="password") or ("stub" if os.environ.get("LLM_BACKEND") == "stub" else "")
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
 if not OPENAI_API_KEY:
@@ -188,6 +206,7 @@ if OPENAI_API_KEY:
         with st.spinner("Processing Document..."):
             nodes = process_pdf(pdfs)
             st.session_state.index = get_vector_index(nodes, vector_store="faiss")
+            st.session_state.doc_hash = document_hash(pdfs)
             st.session_state.process_doc = True
             
 
@@ -235,7 +254,8 @@ if OPENAI_API_KEY:
                 engine = get_query_engine(st.session_state.index.as_query_engine(similarity_top_k=3))
                 start_time = time.time()
 
-                with st.status("**Analyzing Report...**"):
+                # every completion and embedding of this run, per insight, see src/telemetry.py
+                with tracked_run("annual_report") as run, st.status("**Analyzing Report...**"):
 
 
                     if any(fiscal_year_highlights_list):
@@ -245,7 +265,9 @@ if OPENAI_API_KEY:
                             if st.session_state[insight]:
                                 fiscal_year_highlights_list[i] = False
 
-                        response = report_insights(engine, "Fiscal Year Highlights", fiscal_year_highlights_list, 1)
+                        placeholders = InsightPlaceholders()
+                        response = report_insights(engine, "Fiscal Year Highlights", fiscal_year_highlights_list, 1, st.session_state.doc_hash, placeholders)
+                        placeholders.clear()
 
                         for key, value in response["insights"].items():
                             st.session_state[key] = value
@@ -256,7 +278,9 @@ if OPENAI_API_KEY:
                         for i, insight in enumerate(strat_outlook_attributes):
                             if st.session_state[insight]:
                                 strategy_outlook_future_direction_list[i] = False
-                        response = report_insights(engine, "Strategy Outlook and Future Direction", strategy_outlook_future_direction_list, 2)
+                        placeholders = InsightPlaceholders()
+                        response = report_insights(engine, "Strategy Outlook and Future Direction", strategy_outlook_future_direction_list, 2, st.session_state.doc_hash, placeholders)
+                        placeholders.clear()
 
                         for key, value in response["insights"].items():
                             st.session_state[key] = value
@@ -269,7 +293,9 @@ if OPENAI_API_KEY:
                             if st.session_state[insight]:
                                 risk_management_list[i] = False
                         
-                        response = report_insights(engine, "Risk Management", risk_management_list, 3)
+                        placeholders = InsightPlaceholders()
+                        response = report_insights(engine, "Risk Management", risk_management_list, 3, st.session_state.doc_hash, placeholders)
+                        placeholders.clear()
 
                         for key, value in response["insights"].items():
                             st.session_state[key] = value
@@ -281,13 +307,16 @@ if OPENAI_API_KEY:
                             if st.session_state[insight]:
                                 innovation_and_rd_list[i] = False
 
-                        response = report_insights(engine, "Innovation and R&D", innovation_and_rd_list, 4)
+                        placeholders = InsightPlaceholders()
+                        response = report_insights(engine, "Innovation and R&D", innovation_and_rd_list, 4, st.session_state.doc_hash, placeholders)
+                        placeholders.clear()
                         st.session_state.innovation_and_rd = response
 
                         for key, value in response["insights"].items():
                             st.session_state[key] = value
 
                     st.session_state["end_time"] = "{:.2f}".format((time.time() - start_time))
+                    st.session_state.telemetry = (run.summary(), run.by_field())
 
 
 
@@ -295,6 +324,12 @@ if OPENAI_API_KEY:
             
             if st.session_state.end_time:
                 st.write("Report Analysis Time: ", st.session_state.end_time, "s")
+                cache = get_semantic_cache()
+                if cache is not None:
+                    stats = cache.hit_stats()
+                    st.caption(f"Answer cache: {stats['exact_hits'] + stats['semantic_hits']} hits ({stats['semantic_hits']} similar questions), {stats['misses']} misses")
+                if st.session_state.telemetry:
+                    show_telemetry(*st.session_state.telemetry)
 
 
         # if st.session_state.all_report_outputs:
@@ -0,0 +1,125 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import asyncio
+import threading
+import aiohttp
+
+from src.av_client import MAX_THROTTLE_RETRIES, av_flight, get_base_url, get_client, is_cacheable, record
+from src.av_scheduler import INTERACTIVE, INTERACTIVE_MAX_WAIT, QuotaExhausted, is_throttle
+from src.av_cache import get_cache, request_key
+from src.statements import function_params
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+ALL_FUNCTIONS = ("OVERVIEW", "INCOME_STATEMENT", "BALANCE_SHEET", "CASH_FLOW", "NEWS_SENTIMENT")
+
+
+async def fetch(session, function, symbol, priority=INTERACTIVE, on_eta=None):
+    params = function_params(function, symbol)
+
+    # shares in-flight requests with the blocking client and with other sessions
+    key = request_key(function, params) + (False,)
+    future, leader = av_flight.begin(key)
+    if not leader:
+        return function, await asyncio.wrap_future(future)
+
+    try:
+        data = await _fetch(session, function, params, priority, on_eta)
+    except BaseException as e:
+        av_flight.finish(key, future, error=e)
+        raise
+    av_flight.finish(key, future, data)
+    return function, data
+
+
+async def _fetch(session, function, params, priority, on_eta=None):
+    cache = get_cache()
+    if cache is not None:
+        data = cache.get(function, params)
+        if data is not None:
+            return data
+
+    # same scheduler as the blocking client, so both paths share one quota and one priority queue
+    scheduler = get_client().scheduler
+    max_wait = INTERACTIVE_MAX_WAIT if priority == INTERACTIVE else None
+    query = {"function": function, **params}
+    # aiohttp rejects None values, an unset key is left out as the blocking client does
+    if os.environ.get("AV_API_KEY") is not None:
+        query["apikey"] = os.environ["AV_API_KEY"]
+    for _ in range(MAX_THROTTLE_RETRIES + 1):
+        try:
+            await asyncio.to_thread(scheduler.acquire, priority, max_wait, on_eta)
+        except QuotaExhausted as e:
+            return {"Information": str(e)}
+
+        async with session.get(get_base_url(), params=query) as response:
+            if response.status != 200:
+                text = await response.text()
+                logger.error(f"Error: {response.status} - {text}")
+                return {"Error Message": f"{response.status} - {text}"}
+            data = await response.json(content_type=None)
+
+        if not is_throttle(data):
+            break
+        scheduler.report_throttle(data)
+
+    if is_cacheable(data):
+        record(function, params, data)
+        if cache is not None:
+            cache.set(function, params, data)
+    return data
+
+
+async def fetch_as_completed(symbol, functions=ALL_FUNCTIONS, priority=INTERACTIVE, on_eta=None):
+    # yields (function, data) in the order the responses arrive
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=len(functions))) as session:
+        tasks = [asyncio.create_task(fetch(session, function, symbol, priority, on_eta)) for function in functions]
+        for task in asyncio.as_completed(tasks):
+            try:
+                yield await task
+            except Exception as e:
+                logger.error(f"Fetch failed for {symbol}: {e}")
+
+
+async def prefetch_async(bundle, functions=ALL_FUNCTIONS):
+    try:
+        async for function, data in fetch_as_completed(bundle.symbol, functions, bundle.priority, bundle.on_eta):
+            bundle.put(function, data)
+    finally:
+        # anything that failed is released so waiting stages get an error instead of hanging
+        for function in functions:
+            if function in bundle.pending:
+                bundle.put(function, {"Error Message": f"Failed to fetch {function} for {bundle.symbol}"})
+
+
+def prefetch(bundle, functions=ALL_FUNCTIONS):
+    # fills the bundle concurrently in a background thread; the statement stages
+    # block on bundle.get() only until their own endpoint has arrived
+    bundle.expect(functions)
+    thread = threading.Thread(target=asyncio.run, args=(prefetch_async(bundle, functions),), daemon=True)
+    thread.start()
+    return thread
+
+
+def fetch_all(symbol, functions=ALL_FUNCTIONS, priority=INTERACTIVE):
+    async def collect():
+        return {function: data async for function, data in fetch_as_completed(symbol, functions, priority)}
+
+    return asyncio.run(collect())
+
+
+if __name__ == "__main__":
+    import time
+    start = time.time()
+    results = fetch_all("IBM")
+    print({function: list(data)[:3] for function, data in results.items()})
+    print(f"Fetched {len(results)} endpoints in {time.time() - start:.2f}s")
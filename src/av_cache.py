@@ -0,0 +1,185 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import json
+import time
+import sqlite3
+from datetime import datetime, timedelta
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CACHE_PATH = str(project_root / "data" / "cache" / "alpha_vantage.sqlite")
+
+STATEMENT_FUNCTIONS = ("INCOME_STATEMENT", "BALANCE_SHEET", "CASH_FLOW")
+REPORT_PERIODS = ("annualReports", "quarterlyReports")
+
+# short TTLs (seconds) for data that changes between filings
+SHORT_TTLS = {
+    "OVERVIEW": 24 * 3600,
+    "NEWS_SENTIMENT": 3600,
+}
+DEFAULT_TTL = 24 * 3600
+# once a new period is due, the latest period is rechecked this often
+LATEST_PERIOD_TTL = 24 * 3600
+
+# days between the end of a period and its filing being available
+QUARTERLY_FILING_LAG = 45
+ANNUAL_FILING_LAG = 90
+
+
+def request_key(function, params):
+    symbol = params.get("symbol") or params.get("tickers") or ""
+    rest = {k: v for k, v in params.items() if k not in ("function", "symbol", "tickers", "apikey")}
+    return function, symbol.upper(), json.dumps(rest, sort_keys=True)
+
+
+def next_period_due(data):
+    # earliest date on which a statement newer than the cached one can show up
+    quarterly = data.get("quarterlyReports") or []
+    annual = data.get("annualReports") or []
+    try:
+        if quarterly:
+            latest = datetime.strptime(quarterly[0]["fiscalDateEnding"], "%Y-%m-%d")
+            return latest + timedelta(days=91 + QUARTERLY_FILING_LAG)
+        if annual:
+            latest = datetime.strptime(annual[0]["fiscalDateEnding"], "%Y-%m-%d")
+            return latest + timedelta(days=365 + ANNUAL_FILING_LAG)
+    except (KeyError, ValueError):
+        pass
+    return None
+
+
+def ttl_for(function, data):
+    if function in STATEMENT_FUNCTIONS:
+        due = next_period_due(data)
+        if due is not None:
+            return max(LATEST_PERIOD_TTL, (due - datetime.now()).total_seconds())
+        return LATEST_PERIOD_TTL
+    return SHORT_TTLS.get(function, DEFAULT_TTL)
+
+
+class ResponseCache:
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    function TEXT NOT NULL,
+                    symbol TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (function, symbol, params)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    function TEXT NOT NULL,
+                    symbol TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    fiscal_date_ending TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (function, symbol, period, fiscal_date_ending)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, function, params):
+        function, symbol, extra = request_key(function, params)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, expires_at FROM responses WHERE function = ? AND symbol = ? AND params = ?",
+                (function, symbol, extra),
+            ).fetchone()
+            if row is None or row[1] < time.time():
+                return None
+
+            data = json.loads(row[0])
+            if function in STATEMENT_FUNCTIONS:
+                for period in REPORT_PERIODS:
+                    rows = conn.execute(
+                        "SELECT payload FROM reports WHERE function = ? AND symbol = ? AND period = ? "
+                        "ORDER BY fiscal_date_ending DESC",
+                        (function, symbol, period),
+                    ).fetchall()
+                    data[period] = [json.loads(r[0]) for r in rows]
+
+        logger.info(f"Cache hit: {function} {symbol}")
+        return data
+
+    def fetched_at(self, function, params):
+        # when the response get() would return was fetched, None if there is none
+        function, symbol, extra = request_key(function, params)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT fetched_at FROM responses WHERE function = ? AND symbol = ? AND params = ? AND expires_at >= ?",
+                (function, symbol, extra, time.time()),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, function, params, data):
+        function, symbol, extra = request_key(function, params)
+        now = time.time()
+        expires_at = now + ttl_for(function, data)
+
+        envelope = data
+        with self._connect() as conn:
+            if function in STATEMENT_FUNCTIONS:
+                envelope = {k: v for k, v in data.items() if k not in REPORT_PERIODS}
+                for period in REPORT_PERIODS:
+                    reports = data.get(period) or []
+                    for i, report in enumerate(reports):
+                        # historical periods are immutable, only the latest one may be restated
+                        verb = "INSERT OR REPLACE" if i == 0 else "INSERT OR IGNORE"
+                        conn.execute(
+                            f"{verb} INTO reports (function, symbol, period, fiscal_date_ending, payload) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (function, symbol, period, report.get("fiscalDateEnding", ""), json.dumps(report)),
+                        )
+
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (function, symbol, params, payload, fetched_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (function, symbol, extra, json.dumps(envelope), now, expires_at),
+            )
+
+    def invalidate(self, function=None, symbol=None):
+        # expires matching responses; stored historical reports are kept
+        clauses, args = [], []
+        if function:
+            clauses.append("function = ?")
+            args.append(function)
+        if symbol:
+            clauses.append("symbol = ?")
+            args.append(symbol.upper())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            conn.execute(f"UPDATE responses SET expires_at = 0{where}", args)
+
+
+_cache = None
+
+
+def get_cache():
+    # AV_CACHE_PATH="" disables the cache
+    global _cache
+    path = os.environ.get("AV_CACHE_PATH", DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+    if _cache is None or _cache.path != path:
+        _cache = ResponseCache(path)
+    return _cache
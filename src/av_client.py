@@ -0,0 +1,185 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.av_cache import get_cache, request_key
+from src.singleflight import SingleFlight
+from src.av_scheduler import QuotaScheduler, QuotaExhausted, INTERACTIVE, INTERACTIVE_MAX_WAIT, is_throttle
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+AV_BASE_URL = "https://www.alphavantage.co/query"
+
+# free tier limits, override with AV_CALLS_PER_MINUTE / AV_CALLS_PER_DAY for premium keys
+DEFAULT_CALLS_PER_MINUTE = 5
+DEFAULT_CALLS_PER_DAY = 500
+# a throttled request is rescheduled for the next window this many times before the error is returned
+MAX_THROTTLE_RETRIES = 3
+
+
+class RateLimiter:
+
+    def __init__(self, calls_per_minute, calls_per_day):
+        self.calls_per_minute = calls_per_minute
+        self.calls_per_day = calls_per_day
+        self.lock = threading.Lock()
+
+        now = time.monotonic()
+        self.minute_tokens = float(calls_per_minute)
+        self.day_tokens = float(calls_per_day)
+        self.updated_at = now
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.minute_tokens = min(self.calls_per_minute, self.minute_tokens + elapsed * self.calls_per_minute / 60)
+        self.day_tokens = min(self.calls_per_day, self.day_tokens + elapsed * self.calls_per_day / 86400)
+
+    def _wait_time(self):
+        wait = 0.0
+        if self.minute_tokens < 1:
+            wait = max(wait, (1 - self.minute_tokens) * 60 / self.calls_per_minute)
+        if self.day_tokens < 1:
+            wait = max(wait, (1 - self.day_tokens) * 86400 / self.calls_per_day)
+        return wait
+
+    def wait_time(self):
+        # how long until a token is available, without taking it
+        with self.lock:
+            self._refill(time.monotonic())
+            return self._wait_time()
+
+    def reserve(self):
+        # takes a token from both buckets and returns how long the caller has to wait before using it
+        with self.lock:
+            self._refill(time.monotonic())
+            wait = self._wait_time()
+            self.minute_tokens -= 1
+            self.day_tokens -= 1
+            return wait
+
+    def drain(self, day=False):
+        # the API says we are out of quota, whatever our own accounting thinks
+        with self.lock:
+            self._refill(time.monotonic())
+            self.minute_tokens = min(self.minute_tokens, 0.0)
+            if day:
+                self.day_tokens = min(self.day_tokens, 0.0)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            logger.info(f"Rate limit reached, waiting {wait:.2f}s")
+            time.sleep(wait)
+
+
+def get_base_url():
+    # point AV_BASE_URL at src/av_stub_server.py for offline runs
+    return os.environ.get("AV_BASE_URL") or AV_BASE_URL
+
+
+def record(function, params, data):
+    # AV_RECORD_DIR saves live responses in the layout src/av_stub_server.py replays
+    record_dir = os.environ.get("AV_RECORD_DIR")
+    if record_dir:
+        from src.av_stub_server import record_response
+        record_response(record_dir, function, params.get("symbol") or params.get("tickers") or "", data)
+
+
+def is_cacheable(data):
+    # throttle notices and error payloads come back with status 200
+    return bool(data) and "Information" not in data and "Error Message" not in data and "Note" not in data
+
+
+class AlphaVantageClient:
+
+    def __init__(self, calls_per_minute=None, calls_per_day=None, pool_size=10):
+        if calls_per_minute is None:
+            calls_per_minute = int(os.environ.get("AV_CALLS_PER_MINUTE", DEFAULT_CALLS_PER_MINUTE))
+        if calls_per_day is None:
+            calls_per_day = int(os.environ.get("AV_CALLS_PER_DAY", DEFAULT_CALLS_PER_DAY))
+
+        self.limiter = RateLimiter(calls_per_minute, calls_per_day)
+        self.scheduler = QuotaScheduler(self.limiter)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def query(self, function, refresh=False, priority=INTERACTIVE, on_eta=None, **params):
+        # identical requests from concurrent sessions are served by a single call;
+        # on_eta(seconds) is called with the estimated wait for quota before the request is sent
+        key = request_key(function, params) + (refresh,)
+        return av_flight.do(key, self._query, function, refresh, priority, params, on_eta)
+
+    def _query(self, function, refresh, priority, params, on_eta=None):
+        cache = get_cache()
+        if cache is not None and not refresh:
+            data = cache.get(function, params)
+            if data is not None:
+                return data
+
+        params = {"function": function, **params}
+        if "apikey" not in params:
+            params["apikey"] = os.environ.get("AV_API_KEY")
+
+        max_wait = INTERACTIVE_MAX_WAIT if priority == INTERACTIVE else None
+        for _ in range(MAX_THROTTLE_RETRIES + 1):
+            try:
+                self.scheduler.acquire(priority, max_wait=max_wait, on_eta=on_eta)
+            except QuotaExhausted as e:
+                return {"Information": str(e)}
+
+            response = self.session.get(get_base_url(), params=params)
+
+            if response.status_code != 200:
+                logger.error(f"Error: {response.status_code} - {response.text}")
+                return {"Error Message": f"{response.status_code} - {response.text}"}
+
+            data = response.json()
+            if not is_throttle(data):
+                break
+            self.scheduler.report_throttle(data)
+
+        # throttle notices and errors are neither cached nor recorded over a good response
+        if is_cacheable(data):
+            record(function, params, data)
+            if cache is not None:
+                cache.set(function, params, data)
+        return data
+
+
+av_flight = SingleFlight()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AlphaVantageClient()
+        return _client
+
+
+def av_query(function, refresh=False, priority=INTERACTIVE, on_eta=None, **params):
+    return get_client().query(function, refresh=refresh, priority=priority, on_eta=on_eta, **params)
+
+
+if __name__ == "__main__":
+    data = av_query("OVERVIEW", symbol="IBM")
+    print(data)
@@ -0,0 +1,99 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import numpy as np
+import pandas as pd
+
+from src.av_schema import statement_fields
+
+
+PERIODS = {"annualReports": "annual", "quarterlyReports": "quarterly"}
+
+# strings Alpha Vantage uses for a value it does not have
+MISSING = ("None", "", "-")
+
+
+class Statement:
+    # one statement payload as float64 columns in av_schema order; rows are annual reports then quarterly ones, newest first
+
+    __slots__ = ("function", "fields", "index", "dates", "currencies", "values", "missing", "annual_count")
+
+    def __init__(self, function, dates, currencies, values, missing, annual_count):
+        self.function = function
+        self.fields = statement_fields[function]
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.dates = dates
+        self.currencies = currencies
+        self.values = values
+        self.missing = missing
+        self.annual_count = annual_count
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self):
+        return self.dates.nbytes + self.values.nbytes + self.missing.nbytes
+
+    def rows(self, period=None):
+        if period == "annual":
+            return slice(0, self.annual_count)
+        if period == "quarterly":
+            return slice(self.annual_count, len(self))
+        return slice(0, len(self))
+
+    def periods(self):
+        return np.array(["annual"] * self.annual_count + ["quarterly"] * (len(self) - self.annual_count))
+
+    def column(self, field, period="annual"):
+        return self.values[self.rows(period), self.index[field]]
+
+    def value(self, field, period="annual", row=0):
+        # None when the report is missing or does not carry the field
+        rows = self.rows(period)
+        i = rows.start + row
+        if i >= rows.stop or self.missing[i, self.index[field]]:
+            return None
+        return float(self.values[i, self.index[field]])
+
+    def history(self, field, period="annual"):
+        # oldest first with None for missing values, as passed to the chart helpers
+        rows = self.rows(period)
+        values = self.values[rows, self.index[field]][::-1]
+        missing = self.missing[rows, self.index[field]][::-1]
+        return [None if m else float(v) for v, m in zip(values, missing)]
+
+    def history_dates(self, period="annual"):
+        return [str(d) for d in self.dates[self.rows(period)][::-1]]
+
+    def frame(self, period=None, fields=None):
+        # float frame indexed by fiscalDateEnding, NaN for missing values
+        columns = [self.index[f] for f in fields] if fields is not None else slice(None)
+        return pd.DataFrame(
+            self.values[self.rows(period), columns],
+            index=pd.DatetimeIndex(self.dates[self.rows(period)], name="fiscalDateEnding"),
+            columns=list(fields) if fields is not None else list(self.fields),
+        )
+
+
+def decode(function, data):
+    # one pass over the payload: strings are converted once and the dicts can be dropped
+    reports = []
+    annual_count = 0
+    for key in PERIODS:
+        period_reports = data.get(key) or []
+        reports.extend(period_reports)
+        if key == "annualReports":
+            annual_count = len(period_reports)
+
+    fields = statement_fields[function]
+    raw = np.array([[report.get(field) for field in fields] for report in reports], dtype=object).reshape(len(reports), len(fields))
+    missing = np.isin(raw, MISSING) | (raw == None)
+    values = np.where(missing, np.nan, raw).astype(np.float64)
+
+    dates = np.array([report.get("fiscalDateEnding") or "NaT" for report in reports], dtype="datetime64[D]")
+    currencies = tuple(sys.intern(report.get("reportedCurrency") or "") for report in reports)
+    return Statement(function, dates, currencies, values, missing, annual_count)
@@ -0,0 +1,103 @@
+import heapq
+import time
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+# lower value is served first
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# interactive callers give up instead of waiting longer than this for quota
+INTERACTIVE_MAX_WAIT = 90
+
+
+class QuotaExhausted(Exception):
+
+    def __init__(self, eta):
+        super().__init__(f"Alpha Vantage quota exhausted, next slot in about {eta:.0f}s")
+        self.eta = eta
+
+
+def is_throttle(data):
+    if not isinstance(data, dict):
+        return False
+    message = data.get("Information") or data.get("Note") or ""
+    message = message.lower()
+    return "rate limit" in message or "call frequency" in message or "requests per" in message
+
+
+def is_daily_limit(data):
+    # the per-minute notice also mentions the daily quota ("5 calls per minute and 500 calls per day"),
+    # so the minute wording is checked first
+    message = (data.get("Information") or data.get("Note") or "").lower()
+    if "per minute" in message or "frequency" in message or "per second" in message:
+        return False
+    return "per day" in message or "daily" in message
+
+
+def seconds_until_tomorrow():
+    now = datetime.now()
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class QuotaScheduler:
+    # hands out rate-limiter tokens in priority order and pauses everyone after a throttle response
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.cond = threading.Condition()
+        self.queue = []
+        self.seq = itertools.count()
+        self.blocked_until = 0.0
+
+    def _eta(self, ticket):
+        ahead = sum(1 for other in self.queue if other < ticket)
+        blocked = max(0.0, self.blocked_until - time.monotonic())
+        return max(blocked, self.limiter.wait_time()) + ahead * 60 / self.limiter.calls_per_minute
+
+    def eta(self, priority=INTERACTIVE):
+        # estimated wait for a request submitted now at this priority
+        with self.cond:
+            return self._eta((priority, float("inf")))
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None, on_eta=None):
+        with self.cond:
+            ticket = (priority, next(self.seq))
+            heapq.heappush(self.queue, ticket)
+            try:
+                eta = self._eta(ticket)
+                if on_eta is not None:
+                    on_eta(eta)
+
+                start = time.monotonic()
+                while True:
+                    if max_wait is not None and time.monotonic() - start + self._eta(ticket) > max_wait:
+                        raise QuotaExhausted(self._eta(ticket))
+                    wait = None
+                    if self.queue[0] == ticket:
+                        wait = max(self.blocked_until - time.monotonic(), self.limiter.wait_time())
+                        if wait <= 0:
+                            self.limiter.reserve()
+                            return
+                    self.cond.wait(timeout=wait)
+            finally:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+                self.cond.notify_all()
+
+    def report_throttle(self, data):
+        daily = is_daily_limit(data)
+        pause = seconds_until_tomorrow() if daily else 60
+        with self.cond:
+            self.limiter.drain(day=daily)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            self.cond.notify_all()
+        logger.info(f"Alpha Vantage throttled, pausing requests for {pause:.0f}s")
@@ -0,0 +1,38 @@
+# report fields returned by the Alpha Vantage fundamental endpoints, in response order
+
+income_statement_fields = [
+    "grossProfit", "totalRevenue", "costOfRevenue", "costofGoodsAndServicesSold", "operatingIncome",
+    "sellingGeneralAndAdministrative", "researchAndDevelopment", "operatingExpenses", "investmentIncomeNet",
+    "netInterestIncome", "interestIncome", "interestExpense", "nonInterestIncome", "otherNonOperatingIncome",
+    "depreciation", "depreciationAndAmortization", "incomeBeforeTax", "incomeTaxExpense", "interestAndDebtExpense",
+    "netIncomeFromContinuingOperations", "comprehensiveIncomeNetOfTax", "ebit", "ebitda", "netIncome",
+]
+
+balance_sheet_fields = [
+    "totalAssets", "totalCurrentAssets", "cashAndCashEquivalentsAtCarryingValue", "cashAndShortTermInvestments",
+    "inventory", "currentNetReceivables", "totalNonCurrentAssets", "propertyPlantEquipment",
+    "accumulatedDepreciationAmortizationPPE", "intangibleAssets", "intangibleAssetsExcludingGoodwill", "goodwill",
+    "investments", "longTermInvestments", "shortTermInvestments", "otherCurrentAssets", "otherNonCurrentAssets",
+    "totalLiabilities", "totalCurrentLiabilities", "currentAccountsPayable", "deferredRevenue", "currentDebt",
+    "shortTermDebt", "totalNonCurrentLiabilities", "capitalLeaseObligations", "longTermDebt", "currentLongTermDebt",
+    "longTermDebtNoncurrent", "shortLongTermDebtTotal", "otherCurrentLiabilities", "otherNonCurrentLiabilities",
+    "totalShareholderEquity", "treasuryStock", "retainedEarnings", "commonStock", "commonStockSharesOutstanding",
+]
+
+cash_flow_fields = [
+    "operatingCashflow", "paymentsForOperatingActivities", "proceedsFromOperatingActivities",
+    "changeInOperatingLiabilities", "changeInOperatingAssets", "depreciationDepletionAndAmortization",
+    "capitalExpenditures", "changeInReceivables", "changeInInventory", "profitLoss", "cashflowFromInvestment",
+    "cashflowFromFinancing", "proceedsFromRepaymentsOfShortTermDebt", "paymentsForRepurchaseOfCommonStock",
+    "paymentsForRepurchaseOfEquity", "paymentsForRepurchaseOfPreferredStock", "dividendPayout",
+    "dividendPayoutCommonStock", "dividendPayoutPreferredStock", "proceedsFromIssuanceOfCommonStock",
+    "proceedsFromIssuanceOfLongTermDebtAndCapitalSecuritiesNet", "proceedsFromIssuanceOfPreferredStock",
+    "proceedsFromRepurchaseOfEquity", "proceedsFromSaleOfTreasuryStock", "changeInCashAndCashEquivalents",
+    "changeInExchangeRate", "netIncome",
+]
+
+statement_fields = {
+    "INCOME_STATEMENT": income_statement_fields,
+    "BALANCE_SHEET": balance_sheet_fields,
+    "CASH_FLOW": cash_flow_fields,
+}
@@ -0,0 +1,247 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from collections import deque
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from src.av_schema import statement_fields
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_REPLAY_DIR = str(project_root / "data" / "replay")
+
+# the notice for calls above the per-minute frequency, injected with --throttle-rate and --calls-per-minute
+THROTTLE_MESSAGE = (
+    "Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute and 500 calls per day. "
+    "Please visit https://www.alphavantage.co/premium/ if you would like to target a higher API call frequency."
+)
+# the notice once the daily quota is used up, see --calls-per-day
+DAILY_LIMIT_MESSAGE = (
+    "Thank you for using Alpha Vantage! Our standard API rate limit is 25 requests per day. "
+    "Please subscribe to any of the premium plans at https://www.alphavantage.co/premium/ "
+    "to instantly remove all daily rate limits."
+)
+
+
+def replay_path(replay_dir, function, symbol):
+    return os.path.join(replay_dir, function, f"{symbol.upper()}.json")
+
+
+def load_recorded(replay_dir, function, symbol):
+    path = replay_path(replay_dir, function, symbol)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def record_response(replay_dir, function, symbol, data):
+    path = replay_path(replay_dir, function, symbol)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def period_ends(as_of, count, months):
+    # fiscal period end dates going backwards from as_of
+    ends = []
+    year, month = as_of.year, as_of.month
+    for _ in range(count):
+        next_month = date(year + month // 12, month % 12 + 1, 1)
+        ends.append(next_month - timedelta(days=1))
+        month -= months
+        while month <= 0:
+            month += 12
+            year -= 1
+    return ends
+
+
+def synthetic_reports(rng, function, ends, scale):
+    reports = []
+    for i, end in enumerate(ends):
+        size = scale * (0.93 ** i) * rng.uniform(0.95, 1.05)
+        report = {"fiscalDateEnding": end.isoformat(), "reportedCurrency": "USD"}
+        for field in statement_fields[function]:
+            # a few fields are missing, like in real filings
+            if rng.random() < 0.03:
+                report[field] = "None"
+            else:
+                report[field] = str(int(size * rng.uniform(0.01, 0.6)))
+        if function == "INCOME_STATEMENT":
+            revenue = int(size)
+            cost = int(revenue * rng.uniform(0.4, 0.8))
+            report.update(totalRevenue=str(revenue), costOfRevenue=str(cost), grossProfit=str(revenue - cost))
+        elif function == "BALANCE_SHEET":
+            current, non_current = int(size * rng.uniform(0.3, 0.8)), int(size * rng.uniform(0.5, 1.5))
+            liabilities = int((current + non_current) * rng.uniform(0.3, 0.8))
+            current_liabilities = int(liabilities * rng.uniform(0.3, 0.6))
+            report.update(
+                totalCurrentAssets=str(current), totalNonCurrentAssets=str(non_current),
+                totalAssets=str(current + non_current), totalLiabilities=str(liabilities),
+                totalCurrentLiabilities=str(current_liabilities),
+                totalNonCurrentLiabilities=str(liabilities - current_liabilities),
+                totalShareholderEquity=str(current + non_current - liabilities),
+            )
+        reports.append(report)
+    return reports
+
+
+def synthetic_response(function, symbol, as_of=date(2023, 12, 31)):
+    # deterministic per (function, symbol), so benchmark runs are reproducible
+    rng = random.Random(zlib.crc32(f"{function}:{symbol}".encode()))
+    scale = 10 ** rng.uniform(8, 11)
+
+    if function == "OVERVIEW":
+        return {
+            "Symbol": symbol, "AssetType": "Common Stock", "Name": f"{symbol} Holdings Inc",
+            "Description": f"Synthetic company used for offline benchmarking ({symbol}).",
+            "CIK": str(rng.randint(100000, 9999999)), "Exchange": rng.choice(["NASDAQ", "NYSE"]),
+            "Currency": "USD", "Country": "USA",
+            "Sector": rng.choice(["TECHNOLOGY", "FINANCE", "MANUFACTURING", "LIFE SCIENCES", "ENERGY & TRANSPORTATION"]),
+            "Industry": rng.choice(["SEMICONDUCTORS", "SERVICES-PREPACKAGED SOFTWARE", "STATE COMMERCIAL BANKS", "PHARMACEUTICAL PREPARATIONS"]),
+            "Address": "1 Main Street, Springfield, USA", "FiscalYearEnd": "December",
+            "LatestQuarter": as_of.isoformat(), "MarketCapitalization": str(int(scale * rng.uniform(1, 8))),
+        }
+
+    if function in statement_fields:
+        return {
+            "symbol": symbol,
+            "annualReports": synthetic_reports(rng, function, period_ends(as_of, 10, 12), scale),
+            "quarterlyReports": synthetic_reports(rng, function, period_ends(as_of, 40, 3), scale / 4),
+        }
+
+    if function == "NEWS_SENTIMENT":
+        feed = []
+        for i in range(20):
+            score = rng.uniform(-0.5, 0.5)
+            feed.append({
+                "title": f"{symbol} headline {i + 1}", "url": f"https://example.com/{symbol.lower()}/{i + 1}",
+                "authors": ["Staff"], "topics": [{"topic": "Earnings"}],
+                "ticker_sentiment": [{"ticker": symbol, "ticker_sentiment_score": f"{score:.6f}", "ticker_sentiment_label": "Neutral"}],
+            })
+        return {"items": str(len(feed)), "feed": feed}
+
+    return {"Error Message": f"Invalid API call. Unsupported function {function}."}
+
+
+class StubState:
+
+    def __init__(self, replay_dir, synthetic, latency_ms, jitter_ms, throttle_rate, calls_per_minute, seed, calls_per_day=0):
+        self.replay_dir = replay_dir
+        self.synthetic = synthetic
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.calls_per_minute = calls_per_minute
+        self.calls_per_day = calls_per_day
+        self.served = 0
+        self.rng = random.Random(seed)
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def delay(self):
+        with self.lock:
+            jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        return max(0, self.latency_ms + jitter) / 1000
+
+    def throttled(self):
+        # the throttle notice to answer with, None to serve the call
+        with self.lock:
+            if self.calls_per_day and self.served >= self.calls_per_day:
+                return DAILY_LIMIT_MESSAGE
+            if self.throttle_rate and self.rng.random() < self.throttle_rate:
+                return THROTTLE_MESSAGE
+            if self.calls_per_minute:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] > 60:
+                    self.calls.popleft()
+                if len(self.calls) >= self.calls_per_minute:
+                    return THROTTLE_MESSAGE
+                self.calls.append(now)
+            self.served += 1
+            return None
+
+    def response(self, function, symbol):
+        data = load_recorded(self.replay_dir, function, symbol)
+        if data is None and self.synthetic:
+            data = synthetic_response(function, symbol)
+        return data if data is not None else {}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        function = query.get("function", "")
+        symbol = query.get("symbol") or query.get("tickers") or ""
+
+        time.sleep(state.delay())
+        throttle = state.throttled()
+        if throttle:
+            data = {"Information": throttle}
+        else:
+            data = state.response(function, symbol)
+
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host="127.0.0.1", port=8765, replay_dir=DEFAULT_REPLAY_DIR, synthetic=True, latency_ms=0, jitter_ms=0,
+          throttle_rate=0.0, calls_per_minute=0, seed=0, calls_per_day=0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.state = StubState(replay_dir, synthetic, latency_ms, jitter_ms, throttle_rate, calls_per_minute, seed, calls_per_day)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Alpha Vantage stand-in serving recorded or synthetic responses.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--replay-dir", default=DEFAULT_REPLAY_DIR, help="responses recorded with AV_RECORD_DIR")
+    parser.add_argument("--no-synthetic", action="store_true", help="return {} for symbols that were not recorded")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls answered with the per-minute 'Information' notice")
+    parser.add_argument("--calls-per-minute", type=int, default=0, help="throttle like the real API above this rate (0 = off)")
+    parser.add_argument("--calls-per-day", type=int, default=0, help="answer every call after this many with the daily limit notice (0 = off)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = serve(args.host, args.port, args.replay_dir, not args.no_synthetic, args.latency_ms, args.jitter_ms,
+                   args.throttle_rate, args.calls_per_minute, args.seed, args.calls_per_day)
+    logger.info(f"Serving Alpha Vantage stand-in on http://{args.host}:{args.port}/query")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
-import requests
 import streamlit as st
 import os
 # from dotenv import dotenv_values
 
 from src.pydantic_models import BalanceSheetInsights
-from src.utils import insights, get_total_revenue, safe_float, generate_pydantic_model
+from src.utils import statement_insights
+from src.statements import StatementBundle
+from src.ratios import bundle_evaluator, report_metrics, quarterly_metrics
+from src.peers import peer_ranks
 from src.fields2 import bal_sheet, balance_sheet_attributes
 
 # config = dotenv_values(".env")
@@ -22,20 +24,19 @@ logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
-def charts(data):
-    report = data['annualReports'][0]
-    asset_composition = {"total_current_assets": report['totalCurrentAssets'],
-        "total_non_current_assets": report['totalNonCurrentAssets']              
+def charts(statement):
+    asset_composition = {"total_current_assets": statement.value('totalCurrentAssets'),
+        "total_non_current_assets": statement.value('totalNonCurrentAssets')              
     }
 
     liabilities_composition = {
-        "total_current_liabilities": report['totalCurrentLiabilities'],
-        "total_non_current_liabilities": report['totalNonCurrentLiabilities']
+        "total_current_liabilities": statement.value('totalCurrentLiabilities'),
+        "total_non_current_liabilities": statement.value('totalNonCurrentLiabilities')
     }
 
     debt_structure = {
-        "short_term_debt": report['shortTermDebt'],
-        "long_term_debt": report['longTermDebt']
+        "short_term_debt": statement.value('shortTermDebt'),
+        "long_term_debt": statement.value('longTermDebt')
     }
 
     return {
@@ -47,90 +48,46 @@ def charts(data):
          
 
 def metrics(data, total_revenue):
+    return report_metrics("BALANCE_SHEET", data, total_revenue=total_revenue)
 
-    # Extracting values from the data
-    totalCurrentAssets = safe_float(data.get("totalCurrentAssets"))
-    totalCurrentLiabilities = safe_float(data.get("totalCurrentLiabilities"))
-    totalLiabilities = safe_float(data.get("totalLiabilities"))
-    totalShareholderEquity = safe_float(data.get("totalShareholderEquity"))
-    totalAssets = safe_float(data.get("totalAssets"))
-    inventory = safe_float(data.get("inventory"))
-
-    # Calculate metrics, but check for N/A values in operands
-    current_ratio = (
-        "N/A"
-        if "N/A" in (totalCurrentAssets, totalCurrentLiabilities)
-        else totalCurrentAssets / totalCurrentLiabilities
-    )
-    debt_to_equity_ratio = (
-        "N/A"
-        if "N/A" in (totalLiabilities, totalShareholderEquity)
-        else totalLiabilities / totalShareholderEquity
-    )
-    quick_ratio = (
-        "N/A"
-        if "N/A" in (totalCurrentAssets, totalCurrentLiabilities, inventory)
-        else (totalCurrentAssets - inventory) / totalCurrentLiabilities
-    )
-    asset_turnover = (
-        "N/A" if "N/A" in (total_revenue, totalAssets) else total_revenue / totalAssets
-    )
-    equity_multiplier = (
-        "N/A"
-        if "N/A" in (totalAssets, totalShareholderEquity)
-        else totalAssets / totalShareholderEquity
-    )
-
-    # Returning the results
-    return {
-        "current_ratio": current_ratio,
-        "debt_to_equity_ratio": debt_to_equity_ratio,
-        "quick_ratio": quick_ratio,
-        "asset_turnover": asset_turnover,
-        "equity_multiplier": equity_multiplier,
-    }
 
+def balance_sheet(symbol, fields_to_include, bundle=None, on_chunk=None):
+    response, request = balance_sheet_report(symbol, fields_to_include, bundle)
+    if request is not None:
+        response["insights"] = statement_insights(*request, on_chunk=on_chunk)
+    return response
 
-def balance_sheet(symbol, fields_to_include):
-    AV_API_KEY = os.environ.get("AV_API_KEY")
-    logger.info(f"AV API Key: {AV_API_KEY}")
-    url = "https://www.alphavantage.co/query"
-    params = {
-        "function": "BALANCE_SHEET",
-        "symbol": symbol,
-        "apikey": AV_API_KEY
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
+
+def balance_sheet_report(symbol, fields_to_include, bundle=None):
+    # the balance sheet counterpart of income_statement_report
+    if bundle is None:
+        bundle = StatementBundle(symbol)
+    data = bundle.balance_sheet()
     if not data:
             print(f"No data found for {symbol}")
-            return None
+            return None, None
     
     if "Error Message" in data:
-        return {"Error": data["Error Message"]}
+        return {"Error": data["Error Message"]}, None
     
-    chart_data = charts(data)
+    statement = bundle.statement("BALANCE_SHEET")
+    chart_data = charts(statement)
 
     report = data["annualReports"][0]
-    total_revenue = get_total_revenue(symbol)
-    met = metrics(report, total_revenue)
+    met = bundle_evaluator(bundle).latest("BALANCE_SHEET")
+    quarterly = quarterly_metrics(bundle, "BALANCE_SHEET")
 
     data_for_insights = {
         "annual_report_data": report,
         "historical_data": chart_data,
     }
 
-    ins = {}
-    for i, field in enumerate(balance_sheet_attributes):
-        if fields_to_include[i]:
-            response = insights(field, "balance sheet", data_for_insights, str({field: bal_sheet[field]}))
-            ins[field] = response
-
     return {
         "metrics": met,
+        "quarterly_metrics": quarterly,
+        "peer_percentiles": peer_ranks(bundle, met),
         "chart_data": chart_data,
-        "insights": ins
-    }
+    }, ("balance sheet", data_for_insights, fields_to_include, balance_sheet_attributes, bal_sheet, BalanceSheetInsights, symbol)
 
 if __name__ == "__main__":
     fields = [True, True, False, False, False]
@@ -0,0 +1,243 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.company_overview import company_overview
+from src.income_statement import income_statement
+from src.balance_sheet import balance_sheet
+from src.cash_flow import cash_flow
+from src.statements import StatementBundle
+from src.av_scheduler import BACKGROUND
+from src.av_async import prefetch
+from src.av_cache import get_cache, STATEMENT_FUNCTIONS
+from src.llm_cache import get_llm_cache
+from src.statement_store import get_store
+from src.peers import get_peer_index
+from src.refresh import latest_period, has_new_period, changed_statements, affected_results
+from src.ticker_search import filter_symbols
+from src.fields2 import inc_stat_attributes, balance_sheet_attributes, cashflow_attributes
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_OUTPUT_DIR = str(project_root / "data" / "batch")
+BATCH_FUNCTIONS = ("OVERVIEW", "INCOME_STATEMENT", "BALANCE_SHEET", "CASH_FLOW")
+RESULTS = ("income_statement", "balance_sheet", "cash_flow")
+
+
+class Checkpoint:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            self.done = set(state.get("done", []))
+            self.failed = state.get("failed", {})
+
+    def mark(self, symbol, error=None):
+        with self.lock:
+            if error is None:
+                self.done.add(symbol)
+                self.failed.pop(symbol, None)
+            else:
+                self.failed[symbol] = error
+            self._save()
+
+    def _save(self):
+        # written to a temp file first so an interrupted run never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": sorted(self.done), "failed": self.failed}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def result_path(output_dir, symbol):
+    return os.path.join(output_dir, "results", f"{symbol}.json")
+
+
+def check(name, value):
+    if value is None:
+        raise ValueError(f"{name} returned no data")
+    if isinstance(value, dict) and "Error" in value:
+        raise ValueError(f"{name}: {value['Error']}")
+    return value
+
+
+def run_statement(name, symbol, bundle):
+    # metrics and chart data only, insights are generated on demand in the app
+    if name == "income_statement":
+        return check(name, income_statement(symbol, [False] * len(inc_stat_attributes), bundle))
+    if name == "balance_sheet":
+        return check(name, balance_sheet(symbol, [False] * len(balance_sheet_attributes), bundle))
+    return check(name, cash_flow(symbol, [False] * len(cashflow_attributes), bundle))
+
+
+def process_symbol(symbol):
+    # background priority, interactive sessions sharing the key are served first
+    bundle = StatementBundle(symbol, priority=BACKGROUND)
+    prefetch(bundle, BATCH_FUNCTIONS)
+
+    result = {"symbol": symbol, "company_overview": check("company_overview", company_overview(symbol, bundle))}
+    for name in RESULTS:
+        result[name] = run_statement(name, symbol, bundle)
+    result["periods"] = {function: latest_period(bundle.get(function)) for function in STATEMENT_FUNCTIONS}
+    store_statements(symbol, bundle, STATEMENT_FUNCTIONS)
+    return result
+
+
+def store_statements(symbol, bundle, functions):
+    # typed copy of every annual and quarterly report for screens, peer stats and bulk reads
+    store = get_store()
+    for function in functions:
+        statement = bundle.statement(function)
+        if statement is not None:
+            store.write(symbol, function, statement)
+
+
+def refresh_symbol(symbol, stored):
+    # refetches statements only when OVERVIEW reports a new quarter or fiscal year,
+    # then recomputes only the results that depend on a changed statement
+    bundle = StatementBundle(symbol, priority=BACKGROUND)
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate("OVERVIEW", symbol)
+
+    overview = check("company_overview", company_overview(symbol, bundle))
+    if not has_new_period(stored.get("company_overview"), overview):
+        return {**stored, "company_overview": overview}, []
+
+    if cache is not None:
+        for function in STATEMENT_FUNCTIONS:
+            cache.invalidate(function, symbol)
+    prefetch(bundle, STATEMENT_FUNCTIONS)
+
+    changed = changed_statements(stored.get("periods", {}), bundle)
+    affected = affected_results(changed)
+    if not affected:
+        # statements not published yet, keep the old overview so the next run checks again
+        return stored, []
+
+    # insights cached for the old filing are not requested again
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        llm_cache.invalidate(symbol)
+
+    result = {**stored, "company_overview": overview}
+    for name in RESULTS:
+        if name in affected:
+            result[name] = run_statement(name, symbol, bundle)
+    result["periods"] = {function: latest_period(bundle.get(function)) for function in STATEMENT_FUNCTIONS}
+    store_statements(symbol, bundle, changed)
+    return result, affected
+
+
+def load_result(output_dir, symbol):
+    path = result_path(output_dir, symbol)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def run_batch(symbols, output_dir=DEFAULT_OUTPUT_DIR, workers=1, retry_failed=False, incremental=False):
+    os.makedirs(os.path.join(output_dir, "results"), exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(output_dir, "checkpoint.json"))
+
+    # in incremental mode symbols finished earlier are refreshed instead of skipped
+    todo = [
+        s for s in symbols
+        if (incremental or s not in checkpoint.done) and (retry_failed or s not in checkpoint.failed)
+    ]
+    skipped = len(symbols) - len(todo)
+    logger.info(f"{len(todo)} symbols to process, {skipped} skipped from checkpoint")
+
+    stats = {"processed": 0, "failed": 0, "refreshed": 0, "unchanged": 0}
+    stats_lock = threading.Lock()
+    peers = get_peer_index()
+
+    def work(symbol):
+        try:
+            stored = load_result(output_dir, symbol) if incremental else None
+            if stored is None:
+                result = process_symbol(symbol)
+                key = "processed"
+            else:
+                result, affected = refresh_symbol(symbol, stored)
+                key = "refreshed" if affected else "unchanged"
+                if affected:
+                    logger.info(f"{symbol} reported a new period, recomputed {', '.join(affected)}")
+            with open(result_path(output_dir, symbol), "w") as f:
+                json.dump(result, f)
+            if key != "unchanged":
+                metrics = {name: value for r in RESULTS for name, value in result[r]["metrics"].items()}
+                peers.update(symbol, result["company_overview"], metrics)
+            checkpoint.mark(symbol)
+        except Exception as e:
+            logger.error(f"{symbol} failed: {e}")
+            checkpoint.mark(symbol, str(e))
+            key = "failed"
+        with stats_lock:
+            stats[key] += 1
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(work, todo))
+    elapsed = time.time() - start
+    peers.save()
+
+    stats["skipped"] = skipped
+    stats["elapsed_seconds"] = round(elapsed, 2)
+    done = stats["processed"] + stats["refreshed"] + stats["unchanged"]
+    stats["symbols_per_minute"] = round(done / elapsed * 60, 2) if elapsed > 0 else 0.0
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute overview, metrics and chart data for a watchlist.")
+    parser.add_argument("--symbols", nargs="+", help="explicit list of ticker symbols")
+    parser.add_argument("--exchange", help="filter symbols.csv by Exchange, e.g. NASDAQ")
+    parser.add_argument("--type", help="filter symbols.csv by Type, e.g. 'Common Stock'")
+    parser.add_argument("--country", help="filter symbols.csv by Country, e.g. USA")
+    parser.add_argument("--limit", type=int, help="only process the first N symbols")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--retry-failed", action="store_true", help="retry symbols that failed in a previous run")
+    parser.add_argument("--incremental", action="store_true", help="refresh stored symbols that reported a new quarter or fiscal year")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.symbols:
+        symbols = args.symbols
+    else:
+        symbols = filter_symbols(exchange=args.exchange, type=args.type, country=args.country)
+    if args.limit:
+        symbols = symbols[:args.limit]
+
+    stats = run_batch(symbols, args.output_dir, args.workers, args.retry_failed, args.incremental)
+    print(
+        f"Processed {stats['processed']} symbols, refreshed {stats['refreshed']}, {stats['unchanged']} unchanged, "
+        f"{stats['failed']} failed, {stats['skipped']} skipped "
+        f"in {stats['elapsed_seconds']}s ({stats['symbols_per_minute']} symbols/min)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import json
+import math
+
+import tiktoken
+
+from src.av_decode import MISSING
+from src.fields2 import insight_inputs
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+# tokens of a whole insight prompt per insight it asks for, template and format instructions
+# included; a batched prompt for n insights gets n times this. Override with INSIGHT_TOKEN_BUDGET
+DEFAULT_TOKEN_BUDGET = 550
+ENCODING_MODEL = "gpt-3.5-turbo"
+
+SCALES = ((1e12, "T"), (1e9, "B"), (1e6, "M"), (1e3, "K"))
+
+_encoding = None
+_encoding_failed = False
+
+
+def count_tokens(text):
+    # tiktoken downloads its vocabulary on first use; if that fails, ~4 characters per token
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.encoding_for_model(ENCODING_MODEL)
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning(f"tiktoken encoding unavailable, estimating prompt tokens: {e}")
+    if _encoding is None:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text))
+
+
+def scaled(value):
+    # 394328000000 or "394328000000" -> "394.3B"; None for missing values, other strings unchanged
+    if value is None or value in MISSING:
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    if not math.isfinite(value):
+        return None
+    for factor, suffix in SCALES:
+        if abs(value) >= factor:
+            return f"{value / factor:.4g}{suffix}"
+    return f"{value:.4g}"
+
+
+def scaled_history(history):
+    # chart data with every number scaled; dates and the shape are kept
+    if isinstance(history, dict):
+        return {key: value if key == "dates" else scaled_history(value) for key, value in history.items()}
+    if isinstance(history, list):
+        return [scaled(value) for value in history]
+    return scaled(history)
+
+
+def drop_oldest(history):
+    # removes the oldest period from dated series; False when there is nothing left to drop
+    dates = history.get("dates") if isinstance(history, dict) else None
+    if not dates or len(dates) <= 1:
+        return False
+    for key, values in history.items():
+        if isinstance(values, list):
+            history[key] = values[1:]
+    return True
+
+
+def compact_inputs(data, insights, budget=None, count=count_tokens, overhead=0):
+    # the statement data an insight prompt needs: only the report fields the insights are written
+    # from, scaled, so that the prompt stays within budget tokens per insight; overhead is what the
+    # rest of the prompt takes. History goes first (oldest periods), then the least important fields
+    if "annual_report_data" not in data:
+        return data
+    budget = (budget or int(os.environ.get("INSIGHT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))) * max(len(insights), 1) - overhead
+    report = data["annual_report_data"]
+    fields = [field for name in insights for field in insight_inputs.get(name, report)]
+
+    values = {}
+    for field in dict.fromkeys(fields):
+        value = scaled(report.get(field))
+        if value is not None and field not in ("fiscalDateEnding", "reportedCurrency"):
+            values[field] = value
+    compact = {
+        "fiscalDateEnding": report.get("fiscalDateEnding"),
+        "reportedCurrency": report.get("reportedCurrency"),
+        "annual_report_data": values,
+        "historical_data": scaled_history(data.get("historical_data") or {}),
+    }
+
+    while count(json.dumps(compact)) > budget:
+        if drop_oldest(compact["historical_data"]):
+            continue
+        if compact["historical_data"]:
+            compact["historical_data"] = {}
+        elif len(values) > 1:
+            values.popitem()
+        else:
+            break
+    return compact
@@ -58,4 +58,25 @@ innovation = {
     "innovation_focus": "Mention of new technologies, patents, or areas of research the company is diving into."
 }
 
-innovation_attributes = ["r_and_d_activities", "innovation_focus"]
\ No newline at end of file
+innovation_attributes = ["r_and_d_activities", "innovation_focus"]
+# report fields each statement insight is written from, most important first; the prompt
+# for an insight only carries these (see src/compaction.py)
+insight_inputs = {
+    "revenue_health": ["totalRevenue", "grossProfit", "costOfRevenue", "operatingIncome", "netIncome"],
+    "operational_efficiency": ["totalRevenue", "operatingExpenses", "operatingIncome", "sellingGeneralAndAdministrative", "costOfRevenue", "costofGoodsAndServicesSold", "grossProfit"],
+    "r_and_d_focus": ["researchAndDevelopment", "totalRevenue", "operatingExpenses", "operatingIncome"],
+    "debt_management": ["interestExpense", "interestAndDebtExpense", "ebit", "ebitda", "netInterestIncome", "interestIncome"],
+    "profit_retention": ["netIncome", "totalRevenue", "incomeBeforeTax", "incomeTaxExpense", "netIncomeFromContinuingOperations", "comprehensiveIncomeNetOfTax"],
+
+    "liquidity_position": ["totalCurrentAssets", "totalCurrentLiabilities", "cashAndCashEquivalentsAtCarryingValue", "cashAndShortTermInvestments", "currentNetReceivables", "inventory", "currentAccountsPayable", "shortTermDebt"],
+    "assets_efficiency": ["totalAssets", "totalCurrentAssets", "totalNonCurrentAssets", "propertyPlantEquipment", "goodwill", "intangibleAssets", "investments"],
+    "capital_structure": ["totalLiabilities", "totalShareholderEquity", "shortTermDebt", "longTermDebt", "retainedEarnings", "treasuryStock", "commonStock"],
+    "inventory_management": ["inventory", "totalCurrentAssets", "currentAccountsPayable", "currentNetReceivables"],
+    "overall_solvency": ["totalAssets", "totalLiabilities", "totalShareholderEquity", "longTermDebt", "totalNonCurrentLiabilities", "cashAndShortTermInvestments"],
+
+    "operational_cash_efficiency": ["operatingCashflow", "netIncome", "depreciationDepletionAndAmortization", "changeInOperatingAssets", "changeInOperatingLiabilities", "changeInReceivables", "changeInInventory"],
+    "investment_capability": ["operatingCashflow", "capitalExpenditures", "cashflowFromInvestment"],
+    "financial_flexibility": ["operatingCashflow", "capitalExpenditures", "cashflowFromFinancing", "dividendPayout", "paymentsForRepurchaseOfCommonStock", "proceedsFromRepaymentsOfShortTermDebt"],
+    "dividend_sustainability": ["netIncome", "dividendPayout", "dividendPayoutCommonStock", "operatingCashflow"],
+    "debt_service_capability": ["operatingCashflow", "proceedsFromRepaymentsOfShortTermDebt", "proceedsFromIssuanceOfLongTermDebtAndCapitalSecuritiesNet", "cashflowFromFinancing"],
+}
@@ -0,0 +1,143 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import time
+import hashlib
+import sqlite3
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CACHE_PATH = str(project_root / "data" / "cache" / "llm.sqlite")
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def model_name(model):
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def completion_key(model, template, formatted_input):
+    # the template is hashed on its own, so editing a prompt file retires everything it produced
+    version = hashlib.sha256(template.encode()).hexdigest()
+    return hashlib.sha256("\0".join([model_name(model), version, formatted_input]).encode()).hexdigest()
+
+
+class CompletionCache:
+    # completions by content hash; the least recently used entries are evicted past max_entries,
+    # and entries are tagged with the symbol so a new filing can drop them explicitly
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    tag TEXT,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS completions_used_at ON completions (used_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS completions_tag ON completions (tag)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE completions SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, key, model, response, tag=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, tag, response, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, tag.upper() if tag else None, response, now, now),
+            )
+            excess = conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY used_at LIMIT ?)",
+                    (excess,),
+                )
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+    def invalidate(self, tag):
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM completions WHERE tag = ?", (tag.upper(),)).rowcount
+        logger.info(f"Dropped {deleted} cached completions for {tag}")
+        return deleted
+
+
+_cache = None
+
+
+def get_llm_cache():
+    # LLM_CACHE_PATH="" disables the cache
+    global _cache
+    path = os.environ.get("LLM_CACHE_PATH", DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+    if _cache is None or _cache.path != path:
+        _cache = CompletionCache(path, int(os.environ.get("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)))
+    return _cache
+
+
+def cached_predict(model, template, formatted_input, tag=None):
+    # model.predict(formatted_input), answered from the cache when the same model has seen the same prompt
+    cache = get_llm_cache()
+    if cache is None:
+        return model.predict(formatted_input)
+    key = completion_key(model, template, formatted_input)
+    response = cache.get(key)
+    if response is not None:
+        logger.info(f"Completion cache hit: {tag or key[:12]}")
+        return response
+    response = model.predict(formatted_input)
+    cache.set(key, model_name(model), response, tag)
+    return response
+
+
+def cached_stream(model, template, formatted_input, tag=None):
+    # cached_predict() in chunks: a cached completion comes back as one chunk, a new one as the model
+    # streams it, and only the complete text is stored
+    cache = get_llm_cache()
+    key = completion_key(model, template, formatted_input) if cache is not None else None
+    response = cache.get(key) if cache is not None else None
+    if response is not None:
+        logger.info(f"Completion cache hit: {tag or key[:12]}")
+        yield response
+        return
+    chunks = []
+    for message in model.stream(formatted_input):
+        chunk = message.content if hasattr(message, "content") else str(message)
+        chunks.append(chunk)
+        yield chunk
+    if cache is not None:
+        cache.set(key, model_name(model), "".join(chunks), tag)
+
+
+def discard(model, template, formatted_input):
+    # e.g. a completion that could not be parsed
+    cache = get_llm_cache()
+    if cache is not None:
+        cache.delete(completion_key(model, template, formatted_input))
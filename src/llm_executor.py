@@ -0,0 +1,116 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import time
+import queue
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from src.av_client import RateLimiter
+from src.telemetry import field_scope
+
+
+# completions in flight per provider across all sessions, override with LLM_CONCURRENCY; enough for
+# every insight of the three statements of a report at once, the rate limiter bounds the request rate
+DEFAULT_CONCURRENCY = 15
+# request rate per provider, override with e.g. OPENAI_CALLS_PER_MINUTE (0 = no limit)
+DEFAULT_CALLS_PER_MINUTE = {"openai": 500}
+
+
+class ProviderExecutor:
+    # bounded thread pool plus a token bucket for one LLM provider
+
+    def __init__(self, provider, max_workers, calls_per_minute):
+        self.provider = provider
+        self.prefix = f"llm-{provider}"
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=self.prefix)
+        self.limiter = RateLimiter(calls_per_minute, calls_per_minute * 24 * 60) if calls_per_minute else None
+
+    def _call(self, fn, args, kwargs, key=None, submitted=None):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        # calls are attributed to their key, with the wait for a worker and the limiter as queue time
+        with field_scope(key, time.perf_counter() - submitted if submitted is not None else None):
+            return fn(*args, **kwargs)
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        # the worker runs in a copy of the caller's context, so telemetry reaches the caller's run
+        context = contextvars.copy_context()
+        return self.pool.submit(context.run, self._call, fn, args, kwargs, key, time.perf_counter())
+
+    def in_worker(self):
+        # a call made from one of our own workers runs inline instead of waiting for a free worker
+        return threading.current_thread().name.startswith(self.prefix)
+
+    def run_ordered(self, calls):
+        # calls: [(key, fn, *args)], all submitted at once; results come back in call order,
+        # the first error is raised after every call has finished
+        if self.in_worker():
+            return {key: self._call(fn, args, {}, key) for key, fn, *args in calls}
+        futures = [(key, self.submit(fn, *args, key=key)) for key, fn, *args in calls]
+        errors = [future.exception() for _, future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return {key: future.result() for key, future in futures}
+
+    def stream_ordered(self, calls):
+        # calls: [(key, generator_fn, *args)], all run at once; yields (key, chunk) in the caller's
+        # thread as chunks arrive, so the caller can render them; the first error is raised at the end
+        if self.in_worker():
+            for key, fn, *args in calls:
+                with field_scope(key):
+                    for chunk in fn(*args):
+                        yield key, chunk
+            return
+
+        chunks = queue.Queue()
+
+        def drain(key, fn, args):
+            try:
+                for chunk in fn(*args):
+                    chunks.put((key, chunk, None))
+            except BaseException as e:
+                chunks.put((key, None, e))
+                return
+            chunks.put((key, None, None))
+
+        for key, fn, *args in calls:
+            self.submit(drain, key, fn, args, key=key)
+        remaining, errors = len(calls), []
+        while remaining:
+            key, chunk, error = chunks.get()
+            if chunk is not None:
+                yield key, chunk
+                continue
+            remaining -= 1
+            if error is not None:
+                errors.append(error)
+        if errors:
+            raise errors[0]
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(provider="openai"):
+    with _executors_lock:
+        if provider not in _executors:
+            max_workers = int(os.environ.get("LLM_CONCURRENCY", DEFAULT_CONCURRENCY))
+            calls_per_minute = int(os.environ.get(f"{provider.upper()}_CALLS_PER_MINUTE", DEFAULT_CALLS_PER_MINUTE.get(provider, 0)))
+            _executors[provider] = ProviderExecutor(provider, max_workers, calls_per_minute)
+        return _executors[provider]
+
+
+def run_ordered(calls, provider="openai"):
+    return get_executor(provider).run_ordered(calls)
+
+
+def stream_ordered(calls, provider="openai"):
+    return get_executor(provider).stream_ordered(calls)
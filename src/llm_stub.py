@@ -0,0 +1,267 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import re
+import json
+import time
+import zlib
+import random
+import threading
+
+import numpy as np
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import AIMessage, AIMessageChunk
+from langchain.schema.output import ChatGeneration, ChatGenerationChunk, ChatResult
+from llama_index.llms import CustomLLM
+from llama_index.llms.base import CompletionResponse, LLMMetadata, llm_completion_callback
+from llama_index.embeddings.base import BaseEmbedding
+
+from src.compaction import count_tokens
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+# deterministic stand-in for the OpenAI models, selected with LLM_BACKEND=stub; a reply and its
+# latency depend only on the prompt, so runs can be compared with each other
+STUB_MODEL = "stub"
+# dimension of the OpenAI embeddings, so the faiss index of the Annual Report page works unchanged
+EMBED_DIM = 1536
+
+WORDS = (
+    "revenue margin growth cash debt liquidity leverage operating capital expenditure dividend "
+    "coverage efficiency trend year increase decrease stable ratio obligations investment returns"
+).split()
+
+
+class StubBackend:
+    # LLM_STUB_LATENCY_MS: median time to first token, LLM_STUB_JITTER: lognormal sigma,
+    # LLM_STUB_TOKENS_PER_SECOND: generation speed (0 = instant), LLM_STUB_WORDS: reply length,
+    # LLM_STUB_RESPONSES: JSON list of {"pattern": regex, "response": template with the regex groups}
+
+    def __init__(self, latency_ms=300.0, jitter=0.3, tokens_per_second=80.0, words=80, responses=()):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.words = words
+        self.responses = [(re.compile(r["pattern"], re.S), r["response"]) for r in responses]
+        self.lock = threading.Lock()
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    @classmethod
+    def from_env(cls):
+        responses = []
+        path = os.environ.get("LLM_STUB_RESPONSES")
+        if path:
+            with open(path, "r") as f:
+                responses = json.load(f)
+        return cls(
+            latency_ms=float(os.environ.get("LLM_STUB_LATENCY_MS", 300)),
+            jitter=float(os.environ.get("LLM_STUB_JITTER", 0.3)),
+            tokens_per_second=float(os.environ.get("LLM_STUB_TOKENS_PER_SECOND", 80)),
+            words=int(os.environ.get("LLM_STUB_WORDS", 80)),
+            responses=responses,
+        )
+
+    def reply(self, prompt):
+        for pattern, response in self.responses:
+            match = pattern.search(prompt)
+            if match:
+                return response.format(*match.groups(), **match.groupdict())
+        if "<User Question>" in prompt and '"sub_question"' in prompt:
+            return sub_questions(prompt)
+        schema = output_schema(prompt)
+        if schema is not None:
+            return json.dumps({name: self.text(prompt, name) for name in schema.get("properties", {})})
+        match = re.search(r"generating (\w+) insight", prompt)
+        return self.text(prompt, match.group(1) if match else "answer")
+
+    def text(self, prompt, topic):
+        rng = random.Random(zlib.crc32(f"{topic}\0{prompt}".encode()))
+        words = [rng.choice(WORDS) for _ in range(self.words)]
+        return f"{topic.replace('_', ' ').capitalize()}: " + " ".join(words) + "."
+
+    def first_token_delay(self, prompt):
+        if self.latency_ms <= 0:
+            return 0.0
+        rng = random.Random(zlib.crc32(prompt.encode()))
+        return self.latency_ms / 1000 * rng.lognormvariate(0, self.jitter)
+
+    def chunks(self, prompt):
+        # the reply in word-sized chunks, paced like a provider stream
+        text = self.reply(prompt)
+        time.sleep(self.first_token_delay(prompt))
+        pieces = re.findall(r"\S+\s*|\s+", text)
+        for piece in pieces:
+            if self.tokens_per_second > 0:
+                time.sleep(1 / self.tokens_per_second)
+            yield piece
+        self.account(prompt, text)
+
+    def complete(self, prompt):
+        text = self.reply(prompt)
+        delay = self.first_token_delay(prompt)
+        if self.tokens_per_second > 0:
+            delay += count_tokens(text) / self.tokens_per_second
+        time.sleep(delay)
+        return text, self.account(prompt, text)
+
+    def account(self, prompt, text):
+        usage = {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(text)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with self.lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += usage["prompt_tokens"]
+            self.usage["completion_tokens"] += usage["completion_tokens"]
+        return usage
+
+
+def output_schema(prompt):
+    # the JSON schema PydanticOutputParser puts in its format instructions
+    match = re.search(r"Here is the output schema:\s*```\s*(\{.*?\})\s*```", prompt, re.S)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def sub_questions(prompt):
+    # one sub-question per question, asked of the first tool, in the format LLMQuestionGenerator parses
+    tail = prompt.rsplit("<Tools>", 1)[-1]
+    tools = re.search(r"```json\s*(\{.*?\})\s*```", tail, re.S)
+    question = re.search(r"<User Question>\s*(.*?)\s*<Output>", tail, re.S)
+    tool = next(iter(json.loads(tools.group(1)))) if tools else "tool"
+    text = question.group(1) if question else ""
+    return "```json\n" + json.dumps([{"sub_question": text, "tool_name": tool}]) + "\n```"
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = StubBackend.from_env()
+        return _backend
+
+
+def stub_usage():
+    backend = get_backend()
+    with backend.lock:
+        return dict(backend.usage)
+
+
+class StubChatModel(BaseChatModel):
+    # langchain side, used by utils.get_model
+
+    model_name: str = STUB_MODEL
+
+    @property
+    def _llm_type(self):
+        return STUB_MODEL
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = get_backend().complete(messages[-1].content)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={"token_usage": usage, "model_name": self.model_name},
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for piece in get_backend().chunks(messages[-1].content):
+            if run_manager is not None:
+                run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+class StubLLM(CustomLLM):
+    # llama_index side, used by the service contexts of the Annual Report page and Retrieve
+
+    @property
+    def metadata(self):
+        return LLMMetadata(model_name=STUB_MODEL, context_window=4096, num_output=512)
+
+    @llm_completion_callback()
+    def complete(self, prompt, **kwargs):
+        text, usage = get_backend().complete(prompt)
+        return CompletionResponse(text=text, raw={"usage": usage})
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, **kwargs):
+        def gen():
+            text = ""
+            for piece in get_backend().chunks(prompt):
+                text += piece
+                yield CompletionResponse(text=text, delta=piece)
+        return gen()
+
+
+def hashed_embedding(text):
+    # bag of words hashed into EMBED_DIM signed buckets: texts sharing words get similar vectors
+    vector = np.zeros(EMBED_DIM, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        h = zlib.crc32(word.encode())
+        vector[h % EMBED_DIM] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class StubEmbedding(BaseEmbedding):
+
+    def _get_query_embedding(self, query):
+        return hashed_embedding(query)
+
+    async def _aget_query_embedding(self, query):
+        return hashed_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return hashed_embedding(text)
+
+
+def main(argv=None):
+    # load test of the Finance Metrics flow against the stand-in; point AV_BASE_URL at src.av_stub_server
+    # and raise AV_CALLS_PER_MINUTE so the free tier limit does not dominate
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    from src.income_statement import income_statement
+    from src.balance_sheet import balance_sheet
+    from src.cash_flow import cash_flow
+    from src.statements import StatementBundle
+    # the models are built from src.llm_stub, not from this module when it runs as __main__
+    from src.llm_stub import stub_usage
+
+    parser = argparse.ArgumentParser(description="Run the statement insight flow for many symbols on the local LLM stand-in.")
+    parser.add_argument("--symbols", nargs="+", default=["AAPL", "MSFT", "TSLA", "NVDA", "AMZN"])
+    parser.add_argument("--workers", type=int, default=4, help="symbols processed at once, like concurrent sessions")
+    args = parser.parse_args(argv)
+    os.environ["LLM_BACKEND"] = "stub"
+
+    def run(symbol):
+        start = time.perf_counter()
+        bundle = StatementBundle(symbol)
+        for fetch in (income_statement, balance_sheet, cash_flow):
+            fetch(symbol, [True] * 5, bundle)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        times = sorted(pool.map(run, args.symbols))
+    wall = time.perf_counter() - start
+    usage = stub_usage()
+    print(f"{len(times)} symbols in {wall:.2f}s, per symbol p50 {times[len(times) // 2]:.2f}s max {times[-1]:.2f}s")
+    print(f"{usage['calls']} completions, {usage['prompt_tokens']} prompt and {usage['completion_tokens']} completion tokens")
+
+
+if __name__ == "__main__":
+    main()
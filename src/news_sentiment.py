@@ -5,11 +5,12 @@ project_root = script_dir.parent
 sys.path.append(str(project_root))
 
 import streamlit as st
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
 
+from src.statements import StatementBundle
+
 # AV_API_KEY = st.secrets["av_api_key"]
 
 AV_API_KEY = os.environ.get("AV_API_KEY")
@@ -29,64 +30,52 @@ def classify_sentiment(mean_score):
     else:
         return "Undefined"
 
-def top_news(symbol, max_feed):
+def top_news(symbol, max_feed, bundle=None):
 
     current_datetime = datetime.now()
     one_year_ago = current_datetime - timedelta(days=365)
     formatted_time_from = one_year_ago.strftime("%Y%m%dT%H%M")
     print("time_from=", formatted_time_from)
 
-    url = "https://www.alphavantage.co/query"
-    params = {
-        "function": "NEWS_SENTIMENT",
-        "tickers": symbol,
-        "apikey": AV_API_KEY,
-        "sort": "RELEVANCE",
-    }
-
-    # Send a GET request to the API
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        if not data:
-            print(f"No data found for {symbol}")
-            print(data)
-            return None
-        news = []
-
-        if "Error Message" in data:
-            return {"Error": data["Error Message"]}
-
-        try:
-            for i in data["feed"][:max_feed]:
-                temp = {}
-                temp["title"] = i["title"]
-                temp["url"] = i["url"]
-                temp["authors"] = i["authors"]
-
-                topics = []
-                for j in i["topics"]:
-                    topics.append(j["topic"])
-                temp["topics"] = topics
-
-                sentiment_score = ""
-                sentiment_label = ""
-                for j in i["ticker_sentiment"]:
-                    if j["ticker"] == symbol:
-                        sentiment_score = j["ticker_sentiment_score"]
-                        sentiment_label = j["ticker_sentiment_label"]
-                        break
-                temp["sentiment_score"] = sentiment_score
-                temp["sentiment_label"] = sentiment_label
-
-                news.append(temp)
-
-        except Exception as e:
-            print(e)
-            return None
-        
-    else:
-        print(f"Error: {response.status_code} - {response.text}")
+    if bundle is None:
+        bundle = StatementBundle(symbol)
+    data = bundle.news()
+    if not data:
+        print(f"No data found for {symbol}")
+        print(data)
+        return None
+    news = []
+
+    if "Error Message" in data:
+        return {"Error": data["Error Message"]}
+
+    try:
+        for i in data["feed"][:max_feed]:
+            temp = {}
+            temp["title"] = i["title"]
+            temp["url"] = i["url"]
+            temp["authors"] = i["authors"]
+
+            topics = []
+            for j in i["topics"]:
+                topics.append(j["topic"])
+            temp["topics"] = topics
+
+            sentiment_score = ""
+            sentiment_label = ""
+            for j in i["ticker_sentiment"]:
+                if j["ticker"] == symbol:
+                    sentiment_score = j["ticker_sentiment_score"]
+                    sentiment_label = j["ticker_sentiment_label"]
+                    break
+            temp["sentiment_score"] = sentiment_score
+            temp["sentiment_label"] = sentiment_label
+
+            news.append(temp)
+
+    except Exception as e:
+        print(e)
+        return None
 
     news = pd.DataFrame(news)
     news["sentiment_score"] = pd.to_numeric(news["sentiment_score"])
@@ -25,6 +25,7 @@ from src.balance_sheet import balance_sheet
 from src.cash_flow import cash_flow
 from src.news_sentiment import top_news
 from src.utils import round_numeric, create_donut_chart, create_bar_chart
+from src.peers import describe
 
 # Get the default styles
 styles = getSampleStyleSheet()
@@ -149,7 +150,7 @@ def pdf_company_overview(data):
     return flowables
 
 
-def pdf_income_statement(metrics, insights, chart_data):
+def pdf_income_statement(metrics, insights, chart_data, peers=None):
     flowables = []
     
     # Section Title
@@ -162,6 +163,8 @@ def pdf_income_statement(metrics, insights, chart_data):
     flowables.append(Paragraph("<b>METRICS</b>", sub_header_style))
     for label, value in metrics.items():
         metric_text = "<b>{}</b>: {}".format(label.replace("_", " ").title(), round_numeric(value))
+        if label in (peers or {}):
+            metric_text += " ({})".format(describe(peers[label]))
         flowables.append(Paragraph(metric_text, data_style))
     
     # Insights
@@ -200,7 +203,7 @@ def pdf_income_statement(metrics, insights, chart_data):
 
     return flowables
 
-def pdf_balance_sheet(metrics, insights, chart_data):
+def pdf_balance_sheet(metrics, insights, chart_data, peers=None):
     flowables = []
     
     # Section Title
@@ -212,6 +215,8 @@ def pdf_balance_sheet(metrics, insights, chart_data):
     flowables.append(Paragraph("<b>METRICS</b>", sub_header_style))
     for label, value in metrics.items():
         metric_text = "<b>{}</b>: {}".format(label.replace("_", " ").title(), round_numeric(value))
+        if label in (peers or {}):
+            metric_text += " ({})".format(describe(peers[label]))
         flowables.append(Paragraph(metric_text, data_style))
     
     # Insights
@@ -236,7 +241,7 @@ def pdf_balance_sheet(metrics, insights, chart_data):
         pass
     try:
         flowables.append(Paragraph("Operational Efficiency", sub_section_header_style))
-        flowables.append(Paragraph(insights.operational_efficiency, data_style))
+        flowables.append(Paragraph(insights.assets_efficiency, data_style))
     except:
         pass
     try:
@@ -263,7 +268,7 @@ def pdf_balance_sheet(metrics, insights, chart_data):
 
     return flowables
 
-def pdf_cash_flow(metrics, insights, chart_data):
+def pdf_cash_flow(metrics, insights, chart_data, peers=None):
     flowables = []
     
     # Section Title
@@ -274,6 +279,8 @@ def pdf_cash_flow(metrics, insights, chart_data):
     flowables.append(Paragraph("<b>METRICS</b>", sub_header_style))
     for label, value in metrics.items():
         metric_text = "<b>{}</b>: {}".format(label.replace("_", " ").title(), round_numeric(value))
+        if label in (peers or {}):
+            metric_text += " ({})".format(describe(peers[label]))
         flowables.append(Paragraph(metric_text, data_style))
 
     # Insights
@@ -376,9 +383,9 @@ def gen_pdf(company_name, overview_data, income_statement_data, balance_sheet_da
 
     all_flowables.extend(cover_page(company_name))
     all_flowables.extend(pdf_company_overview(overview_data))
-    all_flowables.extend(pdf_income_statement(income_statement_data['metrics'], income_statement_data['insights'], income_statement_data['chart_data']))
-    # all_flowables.extend(pdf_balance_sheet(balance_sheet_data['metrics'], balance_sheet_data['insights'], balance_sheet_data['chart_data']))
-    # all_flowables.extend(pdf_cash_flow(cash_flow_data['metrics'], cash_flow_data['insights'], cash_flow_data['chart_data']))
+    all_flowables.extend(pdf_income_statement(income_statement_data['metrics'], income_statement_data['insights'], income_statement_data['chart_data'], income_statement_data.get('peer_percentiles')))
+    # all_flowables.extend(pdf_balance_sheet(balance_sheet_data['metrics'], balance_sheet_data['insights'], balance_sheet_data['chart_data'], balance_sheet_data.get('peer_percentiles')))
+    # all_flowables.extend(pdf_cash_flow(cash_flow_data['metrics'], cash_flow_data['insights'], cash_flow_data['chart_data'], cash_flow_data.get('peer_percentiles')))
     # all_flowables.extend(pdf_news_sentiment(news_data))
     doc.build(all_flowables)
 
@@ -0,0 +1,199 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import json
+import math
+import argparse
+import threading
+
+import numpy as np
+
+from src.statement_store import get_store
+from src.ratios import universe_ratios
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+# industry first; fall back to the sector when the industry has too few stored companies
+LEVELS = ("Industry", "Sector")
+MIN_PEERS = 5
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and math.isfinite(value)
+
+
+def ordinal(n):
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def describe(rank):
+    # "78th percentile of Semiconductors"
+    return f"{ordinal(round(rank['percentile']))} percentile of {rank['group']}"
+
+
+class PeerIndex:
+    # sorted metric values per (level, group, metric), e.g. ("Industry", "SEMICONDUCTORS", "current_ratio"),
+    # so a percentile is two binary searches; members are persisted and the arrays re-sorted on load
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.members = {}
+        self.values = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.members = json.load(f)
+            self._build()
+
+    def _build(self):
+        grouped = {}
+        for member in self.members.values():
+            for key, value in self._keys(member):
+                grouped.setdefault(key, []).append(value)
+        self.values = {key: np.sort(np.array(values, dtype=np.float64)) for key, values in grouped.items()}
+
+    def _keys(self, member):
+        for level in LEVELS:
+            group = member.get(level)
+            if not group or group == "None":
+                continue
+            for name, value in member["metrics"].items():
+                yield (level, group, name), value
+
+    def _remove(self, symbol):
+        member = self.members.pop(symbol, None)
+        if member is None:
+            return
+        for key, value in self._keys(member):
+            values = self.values[key]
+            i = np.searchsorted(values, value)
+            if i < len(values) and values[i] == value:
+                self.values[key] = np.delete(values, i)
+
+    def update(self, symbol, overview, metrics):
+        # replaces one company's values in place, the rest of the index is untouched
+        member = {
+            "Sector": overview.get("Sector"),
+            "Industry": overview.get("Industry"),
+            "metrics": {name: float(value) for name, value in metrics.items() if is_number(value)},
+        }
+        with self.lock:
+            self._remove(symbol)
+            self.members[symbol] = member
+            for key, value in self._keys(member):
+                values = self.values.get(key, np.empty(0))
+                self.values[key] = np.insert(values, np.searchsorted(values, value), value)
+
+    def remove(self, symbol):
+        with self.lock:
+            self._remove(symbol)
+
+    def percentile(self, name, value, level, group):
+        # midpoint rank: ties count half, so the median company sits at the 50th percentile
+        values = self.values.get((level, group, name))
+        if values is None or len(values) == 0 or not is_number(value):
+            return None
+        below = np.searchsorted(values, value, side="left")
+        equal = np.searchsorted(values, value, side="right") - below
+        return 100.0 * (below + equal / 2) / len(values)
+
+    def rank(self, overview, metrics):
+        # {metric: {"percentile", "group", "peers"}} against the narrowest group with enough peers
+        ranks = {}
+        with self.lock:
+            for name, value in metrics.items():
+                for level in LEVELS:
+                    group = overview.get(level)
+                    peers = len(self.values.get((level, group, name), ()))
+                    if peers < MIN_PEERS:
+                        continue
+                    ranks[name] = {"percentile": self.percentile(name, value, level, group), "group": group, "peers": peers}
+                    break
+        return {name: rank for name, rank in ranks.items() if rank["percentile"] is not None}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.members, f)
+            os.replace(tmp_path, self.path)
+
+    def rebuild(self, overviews, store=None):
+        # from scratch: latest annual metrics of every stored symbol, one vectorized pass over the store
+        ratios = universe_ratios(store=store).sort_index()
+        latest = ratios.groupby(level="symbol").tail(1).droplevel("fiscalDateEnding")
+        with self.lock:
+            self.members = {}
+            self.values = {}
+        for symbol, row in latest.iterrows():
+            if symbol in overviews:
+                self.update(symbol, overviews[symbol], row.to_dict())
+
+
+def peer_path():
+    return os.path.join(get_store().path, "peers.json")
+
+
+_index = None
+_index_mtime = None
+
+
+def get_peer_index():
+    # reloaded when the batch job has written a newer index
+    global _index, _index_mtime
+    path = peer_path()
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if _index is None or _index.path != path or mtime != _index_mtime:
+        _index = PeerIndex(path)
+        _index_mtime = mtime
+    return _index
+
+
+def peer_ranks(bundle, metrics):
+    # percentiles of a statement's current metrics within the company's industry or sector; the
+    # overview is only read, and fetched if the bundle has none, when there are peers to rank against
+    index = get_peer_index()
+    if len(index.members) < MIN_PEERS:
+        return {}
+    overview = bundle.overview()
+    if not isinstance(overview, dict) or "Sector" not in overview:
+        return {}
+    return index.rank(overview, metrics)
+
+
+def load_overviews(output_dir):
+    overviews = {}
+    results_dir = os.path.join(output_dir, "results")
+    for name in os.listdir(results_dir) if os.path.isdir(results_dir) else []:
+        with open(os.path.join(results_dir, name), "r") as f:
+            result = json.load(f)
+        overviews[result["symbol"]] = result.get("company_overview") or {}
+    return overviews
+
+
+def main(argv=None):
+    from src.batch import DEFAULT_OUTPUT_DIR
+
+    parser = argparse.ArgumentParser(description="Rebuild the sector and industry peer index from the statement store.")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="batch output with the company overviews")
+    args = parser.parse_args(argv)
+
+    index = PeerIndex(peer_path())
+    index.rebuild(load_overviews(args.output_dir))
+    index.save()
+    groups = {key[:2] for key in index.values}
+    print(f"Indexed {len(index.members)} companies in {len(groups)} sectors and industries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import pandas as pd
+import pyarrow as pa
+
+from src.av_schema import statement_fields
+from src.av_decode import Statement
+from src.statement_store import to_table
+
+
+# flow statements are summed over the trailing four quarters, balances are point-in-time
+FLOW_FUNCTIONS = ("INCOME_STATEMENT", "CASH_FLOW")
+
+# four consecutive quarters span roughly 9 months between the first and the last period end
+TTM_SPAN_DAYS = (240, 300)
+
+
+def quarterly_frame(function, data):
+    # accepts a raw endpoint payload, a decoded statement or a table read from the statement store
+    if isinstance(data, Statement):
+        return data.frame("quarterly").reset_index().sort_values("fiscalDateEnding").reset_index(drop=True)
+    table = data if isinstance(data, pa.Table) else to_table(function, data)
+    df = table.to_pandas()
+    df = df[df["period"] == "quarterly"].copy()
+    df["fiscalDateEnding"] = pd.to_datetime(df["fiscalDateEnding"])
+    by = ["symbol", "fiscalDateEnding"] if "symbol" in df.columns else ["fiscalDateEnding"]
+    return df.sort_values(by).reset_index(drop=True)
+
+
+def ttm_frame(function, data, fields=None):
+    # one row per quarter; any gap in the last four quarters or a missing value gives NaN
+    df = quarterly_frame(function, data)
+    fields = [f for f in (fields or statement_fields[function]) if f in df.columns]
+    keys = [c for c in ("symbol", "fiscalDateEnding") if c in df.columns]
+
+    if function not in FLOW_FUNCTIONS:
+        return df[keys + fields]
+
+    if "symbol" in df.columns:
+        grouped = df.groupby("symbol", sort=False)
+        sums = grouped[fields].rolling(4, min_periods=4).sum().reset_index(level=0, drop=True)
+        span = grouped["fiscalDateEnding"].diff(3)
+    else:
+        sums = df[fields].rolling(4, min_periods=4).sum()
+        span = df["fiscalDateEnding"].diff(3)
+
+    consecutive = span.dt.days.between(*TTM_SPAN_DAYS)
+    return pd.concat([df[keys], sums.sort_index().where(consecutive, axis=0)], axis=1)
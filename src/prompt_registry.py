@@ -0,0 +1,61 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import threading
+from collections import namedtuple
+
+from langchain.prompts import PromptTemplate
+
+
+PROMPTS_DIR = project_root / "prompts"
+
+# variables the code passes to each prompt, checked once when the templates are loaded
+PROMPT_VARIABLES = {
+    "iv2": {"insight_name", "type_of_data", "inputs", "output_format"},
+    "insights": {"type_of_data", "inputs", "output_format"},
+    "report": {"insight_name", "section_name", "output_format"},
+}
+
+# template is the raw text, which the completion cache hashes as the prompt version
+Prompt = namedtuple("Prompt", ["name", "template", "prompt"])
+
+
+class PromptRegistry:
+    # every prompts/*.prompt compiled once per process
+
+    def __init__(self, path=PROMPTS_DIR):
+        self.path = Path(path)
+        self.prompts = {}
+        for file in sorted(self.path.glob("*.prompt")):
+            template = file.read_text()
+            prompt = PromptTemplate.from_template(template)
+            expected = PROMPT_VARIABLES.get(file.stem)
+            if expected is not None and set(prompt.input_variables) != expected:
+                raise ValueError(f"{file.name} takes {sorted(prompt.input_variables)}, expected {sorted(expected)}")
+            self.prompts[file.stem] = Prompt(file.stem, template, prompt)
+        missing = set(PROMPT_VARIABLES) - set(self.prompts)
+        if missing:
+            raise ValueError(f"missing prompts in {self.path}: {sorted(missing)}")
+
+    def get(self, name):
+        return self.prompts[name]
+
+    def format(self, name, **inputs):
+        # (template, formatted prompt)
+        prompt = self.prompts[name]
+        return prompt.template, prompt.prompt.format(**inputs)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_prompts():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PromptRegistry()
+        return _registry
@@ -11,7 +11,7 @@ class IncomeStatementInsights(BaseModel):
 
 class BalanceSheetInsights(BaseModel):
     liquidity_position: str = Field(..., description=f"Must be more than {min_length} words. Insight into the company's ability to meet its short-term obligations using its short-term assets.")
-    operational_efficiency: str = Field(..., description=f"Must be more than {min_length} words. Analysis of how efficiently the company is using its assets to generate sales.")
+    assets_efficiency: str = Field(..., description=f"Must be more than {min_length} words. Analysis of how efficiently the company is using its assets to generate sales.")
     capital_structure: str = Field(..., description=f"Must be more than {min_length} words. Insight into the company's financial leverage and its reliance on external liabilities versus internal equity.")
     inventory_management: str = Field(..., description=f"Must be more than {min_length} words. Analysis of the company's efficiency in managing, selling, and replacing its inventory.")
     overall_solvency: str = Field(..., description=f"Must be more than {min_length} words. Insight into the company's overall ability to meet its long-term debts and obligations.")
@@ -10,7 +10,7 @@ nest_asyncio.apply()
 
 import os
 
-from src.utils import get_model
+from src.utils import get_model, get_service_context
 
 
 class Retrieve():
@@ -18,7 +18,8 @@ class Retrieve():
     def __init__(self, chunks):
         self.chunks = chunks
         self.llm = get_model("openai")
-        self.service_context = ServiceContext.from_defaults(llm=self.llm)
+        # shared by every Retrieve with the same model and key instead of rebuilt per instance
+        self.service_context = get_service_context("openai")
 
     def convert_chunks_to_nodes(self):
         nodes = []
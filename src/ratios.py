@@ -0,0 +1,289 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from src.av_schema import statement_fields
+from src.av_decode import Statement, decode
+from src.statement_store import get_store
+from src.periods import ttm_frame
+
+
+# inputs are report fields qualified by statement ("BALANCE_SHEET.totalAssets") or other metrics
+Metric = namedtuple("Metric", ["name", "inputs", "formula", "statement"])
+
+METRICS = {}
+
+# metrics shown for each statement, in page order
+STATEMENT_METRICS = {"INCOME_STATEMENT": [], "BALANCE_SHEET": [], "CASH_FLOW": []}
+
+KEYS = ["symbol", "fiscalDateEnding"]
+
+
+def metric(name, *inputs, statement=None):
+    # registers formula(*inputs); inputs have to be registered first, so the graph cannot have cycles
+    def register(formula):
+        if name in METRICS:
+            raise ValueError(f"metric {name} is already registered")
+        for input in inputs:
+            if "." in input:
+                function, field = input.split(".", 1)
+                if field not in statement_fields.get(function, ()):
+                    raise ValueError(f"{name}: unknown field {input}")
+            elif input not in METRICS:
+                raise ValueError(f"{name}: unknown metric {input}")
+        METRICS[name] = Metric(name, inputs, formula, statement)
+        if statement is not None:
+            STATEMENT_METRICS[statement].append(name)
+        return formula
+    return register
+
+
+def nan(value):
+    # scalar inputs passed in by callers may still use the "N/A" sentinel
+    if value is None or isinstance(value, str):
+        return np.nan
+    return value
+
+
+def divide(numerator, denominator):
+    # a zero denominator gives NaN instead of inf
+    numerator, denominator = nan(numerator), nan(denominator)
+    if isinstance(denominator, pd.Series):
+        return numerator / denominator.where(denominator != 0)
+    return numerator / denominator if denominator != 0 else numerator * np.nan
+
+
+# shared intermediates
+
+@metric("total_revenue", "INCOME_STATEMENT.totalRevenue")
+def total_revenue(revenue):
+    return revenue
+
+@metric("total_debt", "BALANCE_SHEET.shortTermDebt", "BALANCE_SHEET.longTermDebt")
+def total_debt(short_term, long_term):
+    return short_term + long_term
+
+@metric("cost_of_sales", "INCOME_STATEMENT.costOfRevenue", "INCOME_STATEMENT.costofGoodsAndServicesSold")
+def cost_of_sales(cost_of_revenue, cost_of_goods):
+    return cost_of_revenue + cost_of_goods
+
+
+# income statement
+
+@metric("gross_profit_margin", "INCOME_STATEMENT.grossProfit", "total_revenue", statement="INCOME_STATEMENT")
+def gross_profit_margin(gross_profit, revenue):
+    return divide(gross_profit, revenue)
+
+@metric("operating_profit_margin", "INCOME_STATEMENT.operatingIncome", "total_revenue", statement="INCOME_STATEMENT")
+def operating_profit_margin(operating_income, revenue):
+    return divide(operating_income, revenue)
+
+@metric("net_profit_margin", "INCOME_STATEMENT.netIncome", "total_revenue", statement="INCOME_STATEMENT")
+def net_profit_margin(net_income, revenue):
+    return divide(net_income, revenue)
+
+@metric("cost_efficiency", "total_revenue", "cost_of_sales", statement="INCOME_STATEMENT")
+def cost_efficiency(revenue, cost):
+    return divide(revenue, cost)
+
+@metric("sg_and_a_efficiency", "total_revenue", "INCOME_STATEMENT.sellingGeneralAndAdministrative", statement="INCOME_STATEMENT")
+def sg_and_a_efficiency(revenue, sg_and_a):
+    return divide(revenue, sg_and_a)
+
+@metric("interest_coverage_ratio", "INCOME_STATEMENT.ebit", "INCOME_STATEMENT.interestAndDebtExpense", statement="INCOME_STATEMENT")
+def interest_coverage_ratio(ebit, interest):
+    return divide(ebit, interest)
+
+
+# balance sheet
+
+@metric("current_ratio", "BALANCE_SHEET.totalCurrentAssets", "BALANCE_SHEET.totalCurrentLiabilities", statement="BALANCE_SHEET")
+def current_ratio(current_assets, current_liabilities):
+    return divide(current_assets, current_liabilities)
+
+@metric("debt_to_equity_ratio", "BALANCE_SHEET.totalLiabilities", "BALANCE_SHEET.totalShareholderEquity", statement="BALANCE_SHEET")
+def debt_to_equity_ratio(liabilities, equity):
+    return divide(liabilities, equity)
+
+@metric("quick_ratio", "BALANCE_SHEET.totalCurrentAssets", "BALANCE_SHEET.inventory", "BALANCE_SHEET.totalCurrentLiabilities", statement="BALANCE_SHEET")
+def quick_ratio(current_assets, inventory, current_liabilities):
+    return divide(current_assets - inventory, current_liabilities)
+
+@metric("asset_turnover", "total_revenue", "BALANCE_SHEET.totalAssets", statement="BALANCE_SHEET")
+def asset_turnover(revenue, assets):
+    return divide(revenue, assets)
+
+@metric("equity_multiplier", "BALANCE_SHEET.totalAssets", "BALANCE_SHEET.totalShareholderEquity", statement="BALANCE_SHEET")
+def equity_multiplier(assets, equity):
+    return divide(assets, equity)
+
+
+# cash flow
+
+@metric("operating_cash_flow_margin", "CASH_FLOW.operatingCashflow", "total_revenue", statement="CASH_FLOW")
+def operating_cash_flow_margin(operating_cash_flow, revenue):
+    return divide(operating_cash_flow, revenue)
+
+@metric("capital_expenditure_coverage_ratio", "CASH_FLOW.operatingCashflow", "CASH_FLOW.capitalExpenditures", statement="CASH_FLOW")
+def capital_expenditure_coverage_ratio(operating_cash_flow, capex):
+    return divide(operating_cash_flow, capex)
+
+@metric("free_cash_flow", "CASH_FLOW.operatingCashflow", "CASH_FLOW.capitalExpenditures", statement="CASH_FLOW")
+def free_cash_flow(operating_cash_flow, capex):
+    return operating_cash_flow - capex
+
+@metric("dividend_coverage_ratio", "CASH_FLOW.netIncome", "CASH_FLOW.dividendPayout", statement="CASH_FLOW")
+def dividend_coverage_ratio(net_income, dividends):
+    return divide(net_income, dividends)
+
+@metric("cash_flow_to_debt_ratio", "CASH_FLOW.operatingCashflow", "total_debt", statement="CASH_FLOW")
+def cash_flow_to_debt_ratio(operating_cash_flow, debt):
+    return divide(operating_cash_flow, debt)
+
+
+def plan(names):
+    # every field and metric the requested metrics depend on, inputs before the metrics that use them
+    order = []
+
+    def visit(name):
+        if name in order:
+            return
+        if "." not in name:
+            if name not in METRICS:
+                raise KeyError(f"unknown metric {name}")
+            for input in METRICS[name].inputs:
+                visit(input)
+        order.append(name)
+
+    for name in names:
+        visit(name)
+    return order
+
+
+def fields_for(names):
+    # {statement: [fields]} the requested metrics read, e.g. to fetch or project only those
+    fields = {}
+    for node in plan(names):
+        if "." in node:
+            function, field = node.split(".", 1)
+            fields.setdefault(function, []).append(field)
+    return fields
+
+
+class MetricEvaluator:
+    # evaluates metrics for one symbol (or the whole store) and one period; fields and
+    # intermediates are computed once and reused by every metric that needs them
+
+    def __init__(self, load, known=None):
+        # load(function) returns a float frame indexed by fiscalDateEnding (or symbol, fiscalDateEnding)
+        self.load = load
+        self.frames = {}
+        self.values = dict(known or {})
+        self.lock = threading.RLock()
+
+    def frame(self, function):
+        with self.lock:
+            if function not in self.frames:
+                self.frames[function] = self.load(function)
+            return self.frames[function]
+
+    def value(self, name):
+        with self.lock:
+            for node in plan([name]):
+                if node in self.values:
+                    continue
+                if "." in node:
+                    function, field = node.split(".", 1)
+                    self.values[node] = self.frame(function)[field]
+                else:
+                    m = METRICS[node]
+                    self.values[node] = m.formula(*[self.values[input] for input in m.inputs])
+            return self.values[name]
+
+    def evaluate(self, names):
+        return pd.DataFrame({name: self.value(name) for name in names})
+
+    def latest(self, function, names=None):
+        # metrics at the statement's most recent period, as the pages show them
+        index = self.frame(function).index
+        names = names or STATEMENT_METRICS[function]
+        if len(index) == 0:
+            return {name: "N/A" for name in names}
+        return to_metrics(self.evaluate(names).reindex([index.max()]))
+
+
+def statement_frame(statement, period):
+    # "ttm" sums flow statements over the trailing four quarters, balances stay point-in-time
+    if period == "ttm":
+        return ttm_frame(statement.function, statement).set_index("fiscalDateEnding")
+    return statement.frame(period)
+
+
+def bundle_evaluator(bundle, period="annual"):
+    # one evaluator per (symbol, period), kept on the bundle so the statement modules share intermediates
+    with bundle.lock:
+        evaluator = bundle.evaluators.get(period)
+        if evaluator is None:
+            evaluator = MetricEvaluator(lambda function: statement_frame(bundle.statement(function), period))
+            bundle.evaluators[period] = evaluator
+    return evaluator
+
+
+def report_frame(function, report):
+    # float frame for a single report dict, or the latest annual report of a decoded statement
+    if isinstance(report, Statement):
+        return report.frame("annual").iloc[:1]
+    return decode(function, {"annualReports": [report]}).frame("annual")
+
+
+def report_metrics(function, report, **known):
+    # metrics of one report on its own; values from other statements are passed in, e.g. total_revenue
+    base = report_frame(function, report)
+    evaluator = MetricEvaluator(
+        lambda f: base if f == function else pd.DataFrame(index=base.index, columns=statement_fields[f], dtype=float),
+        known={name: nan(value) for name, value in known.items()},
+    )
+    return to_metrics(evaluator.evaluate(STATEMENT_METRICS[function]))
+
+
+def to_metrics(ratios, row=0):
+    # one row as the dict the pages render, NaN back to "N/A"
+    return {name: float(value) if pd.notna(value) else "N/A" for name, value in ratios.iloc[row].items()}
+
+
+def to_columns(ratios):
+    # column-oriented like chart_data: {"dates": [...], metric: [...]}, index is fiscalDateEnding
+    out = {"dates": [d.date().isoformat() for d in pd.to_datetime(ratios.index)]}
+    for name in ratios.columns:
+        out[name] = [float(v) if pd.notna(v) else "N/A" for v in ratios[name]]
+    return out
+
+
+def quarterly_metrics(bundle, function):
+    # a statement's metrics on trailing-twelve-month values, one row per reported quarter
+    evaluator = bundle_evaluator(bundle, "ttm")
+    index = evaluator.frame(function).index
+    return to_columns(evaluator.evaluate(STATEMENT_METRICS[function]).reindex(index).sort_index())
+
+
+def universe_ratios(names=None, symbols=None, period="annual", store=None):
+    # metrics for every stored symbol and fiscal period in one vectorized pass; only the
+    # statements and columns the requested metrics need are read
+    store = store or get_store()
+    names = names or [name for function in STATEMENT_METRICS for name in STATEMENT_METRICS[function]]
+    fields = fields_for(names)
+
+    def load(function):
+        df = store.frame(function, fields[function], symbols, period)
+        df["fiscalDateEnding"] = pd.to_datetime(df["fiscalDateEnding"])
+        return df.set_index(KEYS)[fields[function]].astype(float)
+
+    return MetricEvaluator(load).evaluate(names)
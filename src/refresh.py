@@ -0,0 +1,49 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+from src.av_cache import STATEMENT_FUNCTIONS
+
+
+# batch results that have to be recomputed when a statement changes;
+# balance_sheet uses revenue from the income statement and cash_flow uses both
+AFFECTED_RESULTS = {
+    "INCOME_STATEMENT": ("income_statement", "balance_sheet", "cash_flow"),
+    "BALANCE_SHEET": ("balance_sheet", "cash_flow"),
+    "CASH_FLOW": ("cash_flow",),
+}
+
+
+def latest_period(data):
+    if not isinstance(data, dict):
+        return None
+    for period in ("quarterlyReports", "annualReports"):
+        reports = data.get(period) or []
+        if reports:
+            return reports[0].get("fiscalDateEnding")
+    return None
+
+
+def has_new_period(stored_overview, overview):
+    # OVERVIEW moves LatestQuarter (and FiscalYearEnd on a fiscal year change) as soon as a filing is in
+    if not stored_overview or "Error" in stored_overview:
+        return True
+    return any(stored_overview.get(key) != overview.get(key) for key in ("LatestQuarter", "FiscalYearEnd"))
+
+
+def changed_statements(stored_periods, bundle):
+    return [
+        function for function in STATEMENT_FUNCTIONS
+        if stored_periods.get(function) is None or stored_periods.get(function) != latest_period(bundle.get(function))
+    ]
+
+
+def affected_results(functions):
+    results = []
+    for function in functions:
+        for name in AFFECTED_RESULTS[function]:
+            if name not in results:
+                results.append(name)
+    return results
@@ -0,0 +1,247 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import re
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.ratios import METRICS, universe_ratios
+from src.peers import get_peer_index
+
+
+SYMBOLS_PATH = str(project_root / "data" / "ticker_symbol" / "symbols.csv")
+
+# categorical columns a screen can filter on, matched case-insensitively
+ATTRIBUTES = ("Exchange", "Type", "Country", "Currency", "Sector", "Industry")
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?%?)
+    |(?P<string>'[^']*'|"[^"]*")
+    |(?P<op><=|>=|!=|==|=|<|>|\(|\))
+    |(?P<word>[A-Za-z_][A-Za-z0-9_&.-]*)
+)""", re.VERBOSE)
+
+KEYWORDS = ("and", "or", "not")
+
+
+class ScreenError(ValueError):
+    pass
+
+
+def tokenize(query):
+    tokens, pos = [], 0
+    query = query.strip()
+    while pos < len(query):
+        match = TOKEN.match(query, pos)
+        if not match or match.end() == pos:
+            raise ScreenError(f"unexpected input at {query[pos:pos + 20]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word" and value.lower() in KEYWORDS:
+            kind, value = "keyword", value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def parse(query):
+    # or < and < not < comparison, e.g. "exchange = NASDAQ and (net_profit_margin > 20% or not debt_to_equity_ratio >= 0.5)"
+    tokens = tokenize(query)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def take(kind=None, value=None):
+        nonlocal pos
+        token = peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            raise ScreenError(f"expected {value or kind} in {query!r}")
+        pos += 1
+        return token[1]
+
+    def expression():
+        node = conjunction()
+        while peek() == ("keyword", "or"):
+            take()
+            node = ("or", node, conjunction())
+        return node
+
+    def conjunction():
+        node = negation()
+        while peek() == ("keyword", "and"):
+            take()
+            node = ("and", node, negation())
+        return node
+
+    def negation():
+        if peek() == ("keyword", "not"):
+            take()
+            return ("not", negation())
+        if peek() == ("op", "("):
+            take()
+            node = expression()
+            take("op", ")")
+            return node
+        return comparison()
+
+    def comparison():
+        field = take("word")
+        op = take("op")
+        if op not in ("<", "<=", ">", ">=", "=", "==", "!="):
+            raise ScreenError(f"unknown operator {op}")
+        kind, value = peek()
+        take()
+        if kind == "number":
+            value = float(value[:-1]) / 100 if value.endswith("%") else float(value)
+        elif kind == "string":
+            value = value[1:-1]
+        elif kind != "word":
+            raise ScreenError(f"expected a value after {field} {op}")
+        return ("cmp", field, "=" if op == "==" else op, value)
+
+    node = expression()
+    if pos != len(tokens):
+        raise ScreenError(f"unexpected {tokens[pos][1]!r} in {query!r}")
+    return node
+
+
+class Screener:
+    # latest annual metrics and attributes of the whole universe as columns; each metric also
+    # keeps its non-missing values sorted, so a range condition is two binary searches
+
+    def __init__(self, metrics, attributes):
+        self.symbols = attributes.index.union(metrics.index)
+        self.metrics = metrics.reindex(self.symbols)
+        self.attributes = attributes.reindex(self.symbols)
+
+        self.columns = {}
+        self.order = {}
+        self.sorted = {}
+        for name in self.metrics.columns:
+            values = self.metrics[name].to_numpy(dtype=np.float64)
+            present = np.flatnonzero(~np.isnan(values))
+            order = present[np.argsort(values[present], kind="stable")]
+            self.columns[name] = values
+            self.order[name] = order
+            self.sorted[name] = values[order]
+
+        self.categories = {}
+        for name in self.attributes.columns:
+            codes, labels = pd.factorize(self.attributes[name].astype("string").str.upper())
+            self.categories[name.lower()] = (codes, {label: i for i, label in enumerate(labels)})
+
+    def _metric_mask(self, name, op, value):
+        if not isinstance(value, float):
+            raise ScreenError(f"{name} has to be compared with a number")
+        values, order = self.sorted[name], self.order[name]
+        left = np.searchsorted(values, value, side="left")
+        right = np.searchsorted(values, value, side="right")
+        selected = {
+            "<": order[:left], "<=": order[:right], ">": order[right:], ">=": order[left:],
+            "=": order[left:right], "!=": np.concatenate([order[:left], order[right:]]),
+        }[op]
+        mask = np.zeros(len(self.symbols), dtype=bool)
+        mask[selected] = True
+        return mask
+
+    def _attribute_mask(self, name, op, value):
+        if op not in ("=", "!="):
+            raise ScreenError(f"{name} only supports = and !=")
+        codes, labels = self.categories[name]
+        code = labels.get(str(value).upper(), -2)
+        mask = codes == code
+        return ~mask & (codes != -1) if op == "!=" else mask
+
+    def mask(self, node):
+        kind = node[0]
+        if kind == "and":
+            return self.mask(node[1]) & self.mask(node[2])
+        if kind == "or":
+            return self.mask(node[1]) | self.mask(node[2])
+        if kind == "not":
+            # a symbol without data for the negated condition matches neither it nor its negation
+            return ~self.mask(node[1]) & self.known(node[1])
+        _, field, op, value = node
+        if field in self.columns:
+            return self._metric_mask(field, op, value)
+        if field.lower() in self.categories:
+            return self._attribute_mask(field.lower(), op, value)
+        raise ScreenError(f"unknown field {field}")
+
+    def known(self, node):
+        # symbols that have a value for every field the condition refers to
+        if node[0] != "cmp":
+            mask = np.ones(len(self.symbols), dtype=bool)
+            for child in node[1:]:
+                mask &= self.known(child)
+            return mask
+        field = node[1]
+        if field in self.columns:
+            return ~np.isnan(self.columns[field])
+        if field.lower() in self.categories:
+            return self.categories[field.lower()][0] != -1
+        raise ScreenError(f"unknown field {field}")
+
+    def screen(self, query, sort_by=None, ascending=False, limit=None):
+        node = parse(query)
+        mask = self.mask(node)
+        result = self.attributes[mask].join(self.metrics[mask][self.fields(node)])
+        if sort_by is not None:
+            if sort_by not in self.columns:
+                raise ScreenError(f"unknown metric {sort_by}")
+            result[sort_by] = self.metrics[mask][sort_by]
+            result = result.sort_values(sort_by, ascending=ascending, na_position="last")
+        return result.head(limit) if limit else result
+
+    def fields(self, node):
+        # metrics referenced by a query, shown next to the matching symbols
+        if node[0] == "cmp":
+            return [node[1]] if node[1] in self.columns else []
+        return list(dict.fromkeys(f for child in node[1:] for f in self.fields(child)))
+
+
+def universe_attributes(path=SYMBOLS_PATH):
+    # exchange, type and country from symbols.csv, sector and industry from the peer index
+    df = pd.read_csv(path).dropna(subset=["Code"]).drop_duplicates("Code").set_index("Code")
+    members = get_peer_index().members
+    df["Sector"] = pd.Series({symbol: member.get("Sector") for symbol, member in members.items()}, dtype="object")
+    df["Industry"] = pd.Series({symbol: member.get("Industry") for symbol, member in members.items()}, dtype="object")
+    df.index.name = "symbol"
+    return df[list(ATTRIBUTES)]
+
+
+def latest_metrics(store=None):
+    ratios = universe_ratios(list(METRICS), store=store).sort_index()
+    return ratios.groupby(level="symbol").tail(1).droplevel("fiscalDateEnding")
+
+
+def build_screener(store=None, path=SYMBOLS_PATH):
+    # one read of the statement store; no API calls
+    return Screener(latest_metrics(store), universe_attributes(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen stored companies, e.g. \"exchange = NASDAQ and net_profit_margin > 20%\".")
+    parser.add_argument("query")
+    parser.add_argument("--sort", help="metric to sort by, highest first")
+    parser.add_argument("--ascending", action="store_true")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    try:
+        result = build_screener().screen(args.query, args.sort, args.ascending, args.limit)
+    except ScreenError as e:
+        print(f"Error: {e}")
+        return
+    print(result.to_string())
+    print(f"{len(result)} symbols")
+
+
+if __name__ == "__main__":
+    main()
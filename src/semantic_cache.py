@@ -0,0 +1,209 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CACHE_PATH = str(project_root / "data" / "cache" / "report_answers.sqlite")
+# cosine similarity above which two questions about the same document share an answer
+DEFAULT_THRESHOLD = 0.95
+
+
+def document_hash(pdf):
+    # uploaded file or raw bytes; the same report uploaded by different users hashes the same
+    data = pdf.getvalue() if hasattr(pdf, "getvalue") else pdf
+    return hashlib.sha256(data).hexdigest()
+
+
+COLUMNS = ["doc_hash", "model", "insight", "question", "embedding", "answer", "created_at"]
+
+
+class SemanticCache:
+    # answers per (document, insight, question); a question is looked up by its exact text first and
+    # then by the nearest stored question embedding, so a reworded question skips the query engine too.
+    # Only questions for the same insight are compared: the report prompts share most of their text,
+    # so questions for different insights of one section embed close together. Each instance reads and
+    # writes the answers of one model, so e.g. stand-in answers never reach an OpenAI session
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, threshold=DEFAULT_THRESHOLD, model=""):
+        self.path = path
+        self.threshold = threshold
+        self.model = model
+        self.lock = threading.Lock()
+        # (doc_hash, insight) -> (questions, answers, unit embeddings as one matrix)
+        self.documents = {}
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(answers)")]
+            if columns and columns != COLUMNS:
+                # answers stored under an older key cannot be told apart, start over
+                logger.info(f"Dropping report answers cached with columns {columns}")
+                conn.execute("DROP TABLE answers")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    doc_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    insight TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (doc_hash, model, insight, question)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _document(self, doc_hash, insight):
+        if (doc_hash, insight) not in self.documents:
+            with self._connect() as conn:
+                rows = conn.execute("SELECT question, answer, embedding FROM answers WHERE doc_hash = ? AND model = ? AND insight = ?", (doc_hash, self.model, insight)).fetchall()
+            vectors = [np.frombuffer(row[2], dtype=np.float32) for row in rows]
+            self.documents[doc_hash, insight] = (
+                [row[0] for row in rows],
+                [row[1] for row in rows],
+                np.vstack(vectors) if vectors else None,
+            )
+        return self.documents[doc_hash, insight]
+
+    def exact(self, doc_hash, insight, question):
+        with self.lock:
+            questions, answers, _ = self._document(doc_hash, insight)
+            if question in questions:
+                self.stats["exact_hits"] += 1
+                return answers[questions.index(question)]
+        return None
+
+    def nearest(self, doc_hash, insight, embedding):
+        # the stored answer for this insight whose question is most similar, if it clears the threshold
+        query = unit(embedding)
+        with self.lock:
+            _, answers, matrix = self._document(doc_hash, insight)
+            if matrix is not None and matrix.shape[1] == len(query):
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.stats["semantic_hits"] += 1
+                    return answers[best]
+            self.stats["misses"] += 1
+        return None
+
+    def add(self, doc_hash, insight, question, embedding, answer):
+        vector = unit(embedding)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (doc_hash, model, insight, question, embedding, answer, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (doc_hash, self.model, insight, question, vector.tobytes(), answer, time.time()),
+            )
+        with self.lock:
+            questions, answers, matrix = self._document(doc_hash, insight)
+            if question in questions:
+                answers[questions.index(question)] = answer
+                return
+            questions.append(question)
+            answers.append(answer)
+            matrix = vector[None, :] if matrix is None else np.vstack([matrix, vector])
+            self.documents[doc_hash, insight] = (questions, answers, matrix)
+
+    def invalidate(self, doc_hash):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM answers WHERE doc_hash = ?", (doc_hash,))
+        with self.lock:
+            for key in [key for key in self.documents if key[0] == doc_hash]:
+                del self.documents[key]
+
+    def hit_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = sum(stats.values())
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_cache = None
+
+
+def answer_model():
+    # the model behind the report query engines, e.g. "stub" with LLM_BACKEND=stub
+    from src.utils import get_service_context
+    return get_service_context("openai").llm.metadata.model_name
+
+
+def get_semantic_cache():
+    # SEMANTIC_CACHE_PATH="" disables the cache
+    global _cache
+    path = os.environ.get("SEMANTIC_CACHE_PATH", DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+    model = answer_model()
+    if _cache is None or _cache.path != path or _cache.model != model:
+        _cache = SemanticCache(path, float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)), model)
+    return _cache
+
+
+def embed_query(question):
+    # same embedding model the report index is built with
+    from src.utils import get_embed_model
+    return get_embed_model().get_query_embedding(question)
+
+
+def response_chunks(response):
+    # a streaming response yields its tokens, any other response its full text
+    if hasattr(response, "response_gen"):
+        yield from response.response_gen
+    else:
+        yield response.response
+
+
+def stream_query(engine, doc_hash, question, embed=embed_query, insight=""):
+    # engine.query(question) in chunks, skipping retrieval, sub-questions and synthesis on a hit;
+    # a cached answer comes back as one chunk and only complete answers are stored. insight is the
+    # field the question asks for, answers are only shared between questions for the same one
+    cache = get_semantic_cache()
+    if cache is None or doc_hash is None:
+        yield from response_chunks(engine.query(question))
+        return
+
+    answer = cache.exact(doc_hash, insight, question)
+    if answer is not None:
+        yield answer
+        return
+    embedding = embed(question)
+    answer = cache.nearest(doc_hash, insight, embedding)
+    if answer is not None:
+        logger.info(f"Semantic cache hit for {doc_hash[:12]}")
+        yield answer
+        return
+
+    chunks = []
+    for chunk in response_chunks(engine.query(question)):
+        chunks.append(chunk)
+        yield chunk
+    cache.add(doc_hash, insight, question, embedding, "".join(chunks))
+
+
+def cached_query(engine, doc_hash, question, embed=embed_query, insight=""):
+    return "".join(stream_query(engine, doc_hash, question, embed, insight))
@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    # concurrent calls with the same key share one execution; late callers wait for the leader's result
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def begin(self, key):
+        # returns (future, is_leader); only the leader should do the work and call finish()
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.calls[key] = future
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self.lock:
+            self.calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def stream(self, key, fn, *args, **kwargs):
+        # like do() for a generator of text chunks: the leader yields them as they arrive, late
+        # callers get the leader's full text as one chunk
+        future, leader = self.begin(key)
+        if not leader:
+            yield future.result()
+            return
+
+        chunks = []
+        try:
+            for chunk in fn(*args, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            self.finish(key, future, error=RuntimeError(f"stream {key!r} was closed before it completed"))
+            raise
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, "".join(chunks))
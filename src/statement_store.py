@@ -0,0 +1,116 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+
+from src.av_schema import statement_fields
+from src.av_decode import Statement, decode
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_STORE_DIR = str(project_root / "data" / "store")
+
+STATEMENT_NAMES = {
+    "INCOME_STATEMENT": "income_statement",
+    "BALANCE_SHEET": "balance_sheet",
+    "CASH_FLOW": "cash_flow",
+}
+PERIODS = {"annualReports": "annual", "quarterlyReports": "quarterly"}
+
+SYMBOL_PARTITIONING = ds.partitioning(pa.schema([("symbol", pa.string())]), flavor="hive")
+
+
+def statement_schema(function):
+    return pa.schema(
+        [("period", pa.string()), ("fiscalDateEnding", pa.date32()), ("reportedCurrency", pa.string())]
+        + [(field, pa.float64()) for field in statement_fields[function]]
+    )
+
+
+def to_table(function, data):
+    # one row per report, annual and quarterly, with typed columns in schema order
+    statement = data if isinstance(data, Statement) else decode(function, data)
+    columns = {
+        "period": statement.periods(),
+        "fiscalDateEnding": statement.dates,
+        "reportedCurrency": list(statement.currencies),
+    }
+    for i, field in enumerate(statement.fields):
+        columns[field] = pa.array(statement.values[:, i], mask=statement.missing[:, i])
+    return pa.table(columns, schema=statement_schema(function))
+
+
+class StatementStore:
+
+    def __init__(self, path=DEFAULT_STORE_DIR):
+        self.path = path
+
+    def statement_dir(self, function):
+        return os.path.join(self.path, f"statement={STATEMENT_NAMES[function]}")
+
+    def write(self, symbol, function, data):
+        # replaces the partition for (statement, symbol)
+        partition = os.path.join(self.statement_dir(function), f"symbol={symbol}")
+        shutil.rmtree(partition, ignore_errors=True)
+        os.makedirs(partition, exist_ok=True)
+        pq.write_table(to_table(function, data), os.path.join(partition, "part-0.parquet"))
+
+    def dataset(self, function):
+        return ds.dataset(
+            self.statement_dir(function), format="parquet", partitioning=SYMBOL_PARTITIONING,
+            schema=statement_schema(function).append(pa.field("symbol", pa.string())),
+        )
+
+    def read(self, function, columns=None, symbols=None, period=None):
+        # only the projected columns are read from disk
+        if not os.path.isdir(self.statement_dir(function)):
+            return statement_schema(function).append(pa.field("symbol", pa.string())).empty_table()
+
+        filters = []
+        if symbols is not None:
+            filters.append(ds.field("symbol").isin(list(symbols)))
+        if period is not None:
+            filters.append(ds.field("period") == period)
+        expression = None
+        for f in filters:
+            expression = f if expression is None else expression & f
+
+        if columns is not None:
+            columns = list(dict.fromkeys(["symbol", "period", "fiscalDateEnding", *columns]))
+        return self.dataset(function).to_table(columns=columns, filter=expression)
+
+    def frame(self, function, columns=None, symbols=None, period=None):
+        return self.read(function, columns, symbols, period).to_pandas()
+
+    def wide(self, function, column, symbols=None, period="annual"):
+        # fiscalDateEnding x symbol matrix for one field, e.g. netIncome for 500 tickers over 15 years
+        df = self.frame(function, [column], symbols, period)
+        return df.pivot_table(index="fiscalDateEnding", columns="symbol", values=column, aggfunc="last").sort_index()
+
+    def symbols(self, function):
+        if not os.path.isdir(self.statement_dir(function)):
+            return []
+        return sorted(name.split("=", 1)[1] for name in os.listdir(self.statement_dir(function)) if name.startswith("symbol="))
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    path = os.environ.get("STATEMENT_STORE_PATH", DEFAULT_STORE_DIR)
+    if _store is None or _store.path != path:
+        _store = StatementStore(path)
+    return _store
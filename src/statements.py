@@ -0,0 +1,138 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from src.av_client import av_query, is_cacheable
+from src.av_cache import get_cache
+from src.av_scheduler import INTERACTIVE
+from src.av_schema import statement_fields
+from src.av_decode import PERIODS, decode
+
+
+def function_params(function, symbol):
+    if function == "NEWS_SENTIMENT":
+        return {"tickers": symbol, "sort": "RELEVANCE"}
+    return {"symbol": symbol}
+
+
+# decoded statements shared by every bundle of the same response, keyed by (function, symbol, fetched_at);
+# the least recently used is dropped
+MAX_DECODED = int(os.environ.get("STATEMENT_CACHE_SIZE", 64))
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+
+
+def decoded_statement(function, symbol, fetched_at, data):
+    key = (function, symbol, fetched_at)
+    with _decoded_lock:
+        if key in _decoded:
+            _decoded.move_to_end(key)
+            return _decoded[key]
+    statement = decode(function, data)
+    with _decoded_lock:
+        _decoded[key] = statement
+        if len(_decoded) > MAX_DECODED:
+            _decoded.popitem(last=False)
+    return statement
+
+
+def latest_reports(data):
+    # the payload without the older reports, the prompts only use the latest annual one
+    return {key: value[:1] if key in PERIODS else value for key, value in data.items()}
+
+
+class StatementBundle:
+    # fetches each endpoint at most once per symbol and shares the payload between the statement modules
+
+    def __init__(self, symbol, priority=INTERACTIVE, on_eta=None):
+        # on_eta(seconds) is passed to every request made for the bundle, see QuotaScheduler.acquire
+        self.symbol = symbol
+        self.priority = priority
+        self.on_eta = on_eta
+        self.data = {}
+        self.fetched = {}
+        self.decoded = {}
+        self.evaluators = {}
+        self.pending = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def keep(self, function, data):
+        self.fetched[function] = time.time()
+        self.data[function] = data
+
+    def fetched_at(self, function):
+        # the response cache's timestamp is shared by every bundle served the same response
+        cache = get_cache()
+        fetched_at = cache.fetched_at(function, function_params(function, self.symbol)) if cache is not None else None
+        return fetched_at if fetched_at is not None else self.fetched.get(function)
+
+    def _function_lock(self, function):
+        with self.lock:
+            return self.locks.setdefault(function, threading.Lock())
+
+    def expect(self, functions):
+        # marks endpoints that are being fetched elsewhere (see src/av_async.py), get() waits for them
+        with self.lock:
+            for function in functions:
+                if function not in self.data and function not in self.pending:
+                    self.pending[function] = Future()
+
+    def get(self, function):
+        with self.lock:
+            future = self.pending.get(function)
+        if future is not None:
+            return future.result()
+
+        with self._function_lock(function):
+            if function in self.data:
+                return self.data[function]
+
+            data = av_query(function, priority=self.priority, on_eta=self.on_eta, **function_params(function, self.symbol))
+            # throttle and error payloads are returned but not kept, so a retry fetches again
+            if is_cacheable(data):
+                self.keep(function, data)
+            return data
+
+    def put(self, function, data):
+        if is_cacheable(data):
+            self.keep(function, data)
+        with self.lock:
+            future = self.pending.pop(function, None)
+        if future is not None:
+            future.set_result(data)
+
+    def statement(self, function):
+        # typed copy of a statement payload (see src/av_decode.py), decoded once per response; the
+        # payload is trimmed to its latest reports afterwards
+        data = self.get(function)
+        if function not in statement_fields or not is_cacheable(data):
+            return None
+        with self._function_lock(("decoded", function)):
+            if function not in self.decoded:
+                self.decoded[function] = decoded_statement(function, self.symbol, self.fetched_at(function), data)
+                self.data[function] = latest_reports(data)
+            return self.decoded[function]
+
+    def overview(self):
+        return self.get("OVERVIEW")
+
+    def income_statement(self):
+        return self.get("INCOME_STATEMENT")
+
+    def balance_sheet(self):
+        return self.get("BALANCE_SHEET")
+
+    def cash_flow(self):
+        return self.get("CASH_FLOW")
+
+    def news(self):
+        return self.get("NEWS_SENTIMENT")
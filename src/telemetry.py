@@ -0,0 +1,228 @@
+import sys
+from pathlib import Path
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+sys.path.append(str(project_root))
+
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain.callbacks.base import BaseCallbackHandler
+from llama_index.callbacks import CBEventType, EventPayload
+from llama_index.callbacks.base_handler import BaseCallbackHandler as LlamaCallbackHandler
+
+from src.compaction import count_tokens
+
+import logging
+from logger_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+# USD per 1K (prompt, completion) tokens, the longest matching model prefix wins; LLM_PRICES
+# takes a JSON object of the same shape, e.g. '{"gpt-3.5-turbo": [0.0005, 0.0015]}'
+DEFAULT_PRICES = {
+    "gpt-3.5-turbo": (0.001, 0.002),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-1106-preview": (0.01, 0.03),
+    "text-embedding-ada-002": (0.0001, 0.0),
+    "stub": (0.0, 0.0),
+}
+
+TOTALS = ("calls", "wall_s", "queue_s", "prompt_tokens", "completion_tokens", "cost_usd")
+
+# the report run and insight field the current thread is working for; the LLM executor copies
+# them into its workers, so calls made there are attributed to the caller
+_run = ContextVar("llm_run", default=None)
+_field = ContextVar("llm_field", default=None)
+# time the current executor call waited for a worker and the rate limiter, charged to its first call
+_queued = ContextVar("llm_queued", default=None)
+
+_prices = None
+
+
+def prices():
+    global _prices
+    if _prices is None:
+        _prices = {**DEFAULT_PRICES, **{model: tuple(price) for model, price in json.loads(os.environ.get("LLM_PRICES") or "{}").items()}}
+    return _prices
+
+
+def cost(model, prompt_tokens, completion_tokens):
+    matches = [name for name in prices() if (model or "").startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = prices()[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class Run:
+    # every LLM and embedding call made for one report run
+
+    def __init__(self, name):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def totals(self, records=None):
+        if records is None:
+            with self.lock:
+                records = list(self.records)
+        totals = dict.fromkeys(TOTALS, 0)
+        for record in records:
+            totals["calls"] += 1
+            for key in TOTALS[1:]:
+                totals[key] += record[key]
+        return {key: round(value, 6) for key, value in totals.items()}
+
+    def by_field(self):
+        # {field: totals}, most expensive first; calls outside any field are under None
+        with self.lock:
+            records = list(self.records)
+        fields = {}
+        for record in records:
+            fields.setdefault(record["field"], []).append(record)
+        totals = {field: self.totals(records) for field, records in fields.items()}
+        return dict(sorted(totals.items(), key=lambda item: (item[1]["cost_usd"], item[1]["wall_s"]), reverse=True))
+
+    def summary(self):
+        return {"run": self.id, "name": self.name, "elapsed_s": round(self.elapsed or time.perf_counter() - self.started, 3), **self.totals()}
+
+
+@contextmanager
+def tracked_run(name):
+    run = Run(name)
+    token = _run.set(run)
+    try:
+        yield run
+    finally:
+        _run.reset(token)
+        run.elapsed = time.perf_counter() - run.started
+        logger.info(f"llm_run {json.dumps(run.summary())}")
+
+
+@contextmanager
+def field_scope(field, queued=None):
+    field_token = _field.set(field)
+    queued_token = _queued.set([queued] if queued is not None else None)
+    try:
+        yield
+    finally:
+        _queued.reset(queued_token)
+        _field.reset(field_token)
+
+
+def record(kind, model, wall, prompt_tokens, completion_tokens, error=None):
+    # one structured log record per call, also kept on the current run
+    run = _run.get()
+    queued = _queued.get()
+    entry = {
+        "kind": kind,
+        "model": model,
+        "run": run.id if run is not None else None,
+        "field": _field.get(),
+        "wall_s": round(wall, 4),
+        "queue_s": round(queued.pop() if queued else 0.0, 4),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": round(cost(model, prompt_tokens, completion_tokens), 6),
+    }
+    if error is not None:
+        entry["error"] = type(error).__name__
+    logger.info(f"llm_call {json.dumps(entry)}")
+    if run is not None:
+        run.add(entry)
+    return entry
+
+
+def reported_usage(raw):
+    # token usage a provider response carries, as a dict or an openai response object
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return {}
+    if not isinstance(usage, dict):
+        usage = {"prompt_tokens": getattr(usage, "prompt_tokens", 0), "completion_tokens": getattr(usage, "completion_tokens", 0)}
+    return usage
+
+
+class LangChainTelemetry(BaseCallbackHandler):
+    # attached to the clients get_model builds; token counts come from the provider when it reports
+    # them and are counted with tiktoken otherwise, e.g. for streamed completions
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.calls[run_id] = (time.perf_counter(), "\n".join(str(m.content) for batch in messages for m in batch))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.calls[run_id] = (time.perf_counter(), "\n".join(prompts))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id not in self.calls:
+            return
+        start, prompt = self.calls.pop(run_id)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        text = "".join(generation.text for generations in response.generations for generation in generations)
+        record("llm", self.model, time.perf_counter() - start,
+               usage.get("prompt_tokens") or count_tokens(prompt), usage.get("completion_tokens") or count_tokens(text))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if run_id not in self.calls:
+            return
+        start, prompt = self.calls.pop(run_id)
+        record("llm", self.model, time.perf_counter() - start, count_tokens(prompt), 0, error)
+
+
+class LlamaIndexTelemetry(LlamaCallbackHandler):
+    # callback handler of the service contexts get_service_context builds: completions, including
+    # sub-questions and synthesis, and embeddings of report chunks and questions
+
+    def __init__(self, model):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.model = model
+        self.events = {}
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+        if event_type in (CBEventType.LLM, CBEventType.EMBEDDING):
+            serialized = (payload or {}).get(EventPayload.SERIALIZED) or {}
+            model = serialized.get("model") if event_type == CBEventType.LLM else serialized.get("model_name")
+            self.events[event_id] = (time.perf_counter(), model or self.model)
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        if event_id not in self.events:
+            return
+        start, model = self.events.pop(event_id)
+        wall = time.perf_counter() - start
+        payload = payload or {}
+        if event_type == CBEventType.EMBEDDING:
+            record("embedding", model, wall, sum(count_tokens(chunk) for chunk in payload.get(EventPayload.CHUNKS) or []), 0)
+            return
+        response = payload.get(EventPayload.COMPLETION) or payload.get(EventPayload.RESPONSE)
+        prompt = payload.get(EventPayload.PROMPT) or "\n".join(str(m.content) for m in payload.get(EventPayload.MESSAGES) or [])
+        text = getattr(response, "text", None)
+        if text is None:
+            message = getattr(response, "message", None)
+            text = str(message.content) if message is not None else ""
+        usage = reported_usage(getattr(response, "raw", None))
+        record("llm", model, wall, usage.get("prompt_tokens") or count_tokens(str(prompt)), usage.get("completion_tokens") or count_tokens(text))
+
+    def start_trace(self, trace_id=None):
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None):
+        pass
@@ -18,3 +18,13 @@ def get_ticker(selected_company):
     return {
         "Error":"Company not found"
     }
+
+def filter_symbols(exchange=None, type=None, country=None):
+    df=pd.read_csv('data/ticker_symbol/symbols.csv')
+    if exchange:
+        df = df[df['Exchange'] == exchange]
+    if type:
+        df = df[df['Type'] == type]
+    if country:
+        df = df[df['Country'] == country]
+    return df['Code'].dropna().tolist()
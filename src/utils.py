@@ -6,21 +6,39 @@ from langchain.output_parsers import PydanticOutputParser
 from langchain.chat_models import ChatOpenAI
 # from llama_index import VectorStoreIndex, SimpleDirectoryReader
 # from llama_index.vector_stores import WeaviateVectorStore
+from llama_index import ServiceContext
+from llama_index.callbacks import CallbackManager
 from llama_index.schema import Document
-from llama_index.llms import OpenAI
+from llama_index.llms import OpenAI as LlamaOpenAI
 # from llama_index.node_parser import SimpleNodeParser
 
 
 # from dotenv import dotenv_values
 from pypdf import PdfReader
 import streamlit as st
-import requests
-import time
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import re
 import json
+import pandas as pd
 import plotly.graph_objects as go
-from pydantic import create_model
+from pydantic import create_model, Field
+from pydantic.fields import FieldInfo
+from langchain.schema import OutputParserException
 from langchain.llms import OpenAI
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from src.statements import StatementBundle
+from src.singleflight import SingleFlight
+from src.ratios import bundle_evaluator
+from src.llm_executor import run_ordered, stream_ordered
+from src.llm_cache import cached_predict, cached_stream, discard
+from src.prompt_registry import get_prompts
+from src.compaction import compact_inputs, count_tokens
+from src.llm_stub import StubChatModel, StubLLM, StubEmbedding, STUB_MODEL
+from src.telemetry import LangChainTelemetry, LlamaIndexTelemetry, field_scope
 
 import logging
 from logger_config import setup_logging
@@ -33,11 +51,67 @@ APP_ID = 'chat-completion'
 MODEL_ID = 'GPT-4'
 MODEL_VERSION_ID = '4aa760933afa4a33a0e5b4652cfa92fa'
 
-def get_model(model_name):
+# LLM_BACKEND overrides the model every caller asks for, e.g. LLM_BACKEND=stub for the
+# deterministic local stand-in in src/llm_stub.py
+MODELS = {"openai": {"model_name": "gpt-3.5-turbo"}, "stub": {}}
+
+# clients are shared by every session and thread that asks for the same model, parameters and API key,
+# so their HTTP connections to the provider stay open between insights; the least recently used is dropped
+MAX_CLIENTS = 32
+_clients = OrderedDict()
+_service_contexts = OrderedDict()
+_clients_lock = threading.RLock()
+
+def client_key(model_name, params):
+    OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") or ""
+    return model_name, tuple(sorted(params.items())), hashlib.sha256(OPENAI_API_KEY.encode()).hexdigest()
+
+def pooled(pool, key, build):
+    with _clients_lock:
+        if key in pool:
+            pool.move_to_end(key)
+            return pool[key]
+        pool[key] = build()
+        if len(pool) > MAX_CLIENTS:
+            pool.popitem(last=False)
+        return pool[key]
+
+def backend(model_name):
+    model_name = os.environ.get("LLM_BACKEND") or model_name
+    if model_name not in MODELS:
+        raise ValueError(f"unknown model {model_name}")
+    return model_name
+
+def get_model(model_name, **params):
+    model_name = backend(model_name)
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-    if model_name == "openai":
-        model = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model_name="gpt-3.5-turbo")
-    return model
+
+    # every completion made through the client is timed and counted, see src/telemetry.py
+    def build():
+        if model_name == "stub":
+            return StubChatModel(callbacks=[LangChainTelemetry(STUB_MODEL)])
+        settings = {**MODELS[model_name], **params}
+        return ChatOpenAI(openai_api_key=OPENAI_API_KEY, callbacks=[LangChainTelemetry(settings["model_name"])], **settings)
+
+    return pooled(_clients, client_key(model_name, params), build)
+
+def get_service_context(model_name="openai", **params):
+    # llama_index context with its own llama_index client, shared like the langchain ones; wrapping the
+    # pooled langchain client is not an option, LangChainLLM streams by setting callbacks on it
+    model_name = backend(model_name)
+    OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+    def build():
+        if model_name == "stub":
+            callback_manager = CallbackManager([LlamaIndexTelemetry(STUB_MODEL)])
+            return ServiceContext.from_defaults(llm=StubLLM(), embed_model=StubEmbedding(model_name=STUB_MODEL), callback_manager=callback_manager)
+        callback_manager = CallbackManager([LlamaIndexTelemetry(MODELS[model_name]["model_name"])])
+        return ServiceContext.from_defaults(llm=LlamaOpenAI(api_key=OPENAI_API_KEY, model=MODELS[model_name]["model_name"], **params), callback_manager=callback_manager)
+
+    return pooled(_service_contexts, client_key(model_name, params), build)
+
+def get_embed_model(model_name="openai"):
+    return get_service_context(model_name).embed_model
 
 def process_pdf(pdfs):
     docs = []
@@ -99,73 +173,210 @@ def format_currency(value):
     else:
         return f"${value:.2f}"
 
-def get_total_revenue(symbol):
-    AV_API_KEY = os.environ.get("AV_API_KEY")
-    time.sleep(3)
-    url = "https://www.alphavantage.co/query"
-    params = {
-        "function": "INCOME_STATEMENT",
-        "symbol": symbol,
-        "apikey": AV_API_KEY
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    logger.info(f"total rev: {data}")
-    total_revenue = safe_float(data["annualReports"][0]["totalRevenue"])
+def get_total_revenue(symbol, bundle=None):
+    if bundle is None:
+        bundle = StatementBundle(symbol)
+    total_revenue = bundle_evaluator(bundle).latest("INCOME_STATEMENT", ["total_revenue"])["total_revenue"]
+    logger.info(f"total rev: {total_revenue}")
 
     return total_revenue
 
-def get_total_debt(symbol):
-    AV_API_KEY = os.environ.get("AV_API_KEY")
-    time.sleep(3)
-    url = "https://www.alphavantage.co/query"
-    params = {
-        "function": "BALANCE_SHEET",
-        "symbol": symbol,
-        "apikey": AV_API_KEY
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    short_term = safe_float(data["annualReports"][0]["shortTermDebt"])
-    time.sleep(3)
-    long_term = safe_float(data["annualReports"][0]["longTermDebt"])
-
-    if short_term == "N/A" or long_term == "N/A":
-        return "N/A"
-    return short_term + long_term
+def get_total_debt(symbol, bundle=None):
+    if bundle is None:
+        bundle = StatementBundle(symbol)
+    return bundle_evaluator(bundle).latest("BALANCE_SHEET", ["total_debt"])["total_debt"]
 
 def generate_pydantic_model(fields_to_include, attributes, base_fields):
-    selected_fields = {attr: base_fields[attr] for attr, include in zip(attributes, fields_to_include) if include}
+    # base_fields is a model's model_fields or a {field: description} dict from src/fields2.py
+    selected_fields = {}
+    for attr, include in zip(attributes, fields_to_include):
+        if include:
+            field = base_fields[attr]
+            selected_fields[attr] = (str, field if isinstance(field, FieldInfo) else Field(..., description=field))
     
     return create_model("DynamicModel", **selected_fields)
 
-def insights(insight_name, type_of_data, data, output_format):
-    
-    with open("prompts/iv2.prompt", "r") as f:
-        template = f.read()
+insight_flight = SingleFlight()
 
-    
-    prompt = PromptTemplate(
-        template=template,
-        input_variables=["insight_name","type_of_data","inputs", "output_format"],
-        # partial_variables={"output_format": parser.get_format_instructions()}
-    )
+def insight_prompt(insight_name, type_of_data, data, output_format):
 
-    model = get_model("openai")
+    # statement data trimmed to what the insight needs, within the token budget of the whole prompt
+    _, empty = get_prompts().format("iv2", insight_name=insight_name, type_of_data=type_of_data, inputs="", output_format=output_format)
+    data = json.dumps(compact_inputs(data, [insight_name], overhead=count_tokens(empty)))
 
-    data = json.dumps(data)
+    # (template, formatted prompt) from the templates compiled at startup
+    return get_prompts().format("iv2", insight_name=insight_name, type_of_data=type_of_data, inputs=data, output_format=output_format)
 
-    formatted_input = prompt.format(insight_name=insight_name,type_of_data=type_of_data, inputs=data, output_format=output_format)
-    # print("-"*30)
-    # print("Formatted Input:")
-    # print(formatted_input)
-    # print("-"*30)
+def insights(insight_name, type_of_data, data, output_format, tag=None):
+
+    template, formatted_input = insight_prompt(insight_name, type_of_data, data, output_format)
+    model = get_model("openai")
 
-    response = model.predict(formatted_input)
+    # sessions asking for the same insight on the same data wait for one completion,
+    # repeat views are answered from the persistent cache; tag is the symbol the data belongs to
+    response = insight_flight.do(formatted_input, cached_predict, model, template, formatted_input, tag)
     return response
 
+def stream_insights(insight_name, type_of_data, data, output_format, tag=None):
+    # the completion insights() returns, yielded in chunks as they arrive; sessions streaming the
+    # same insight share one completion
+    template, formatted_input = insight_prompt(insight_name, type_of_data, data, output_format)
+    yield from insight_flight.stream(formatted_input, cached_stream, get_model("openai"), template, formatted_input, tag)
+
+
+# "batched" asks for all selected insights of a statement in one structured completion,
+# "per_field" sends one prompt per insight
+INSIGHT_MODE = os.environ.get("INSIGHT_MODE", "batched")
+
+# a string member of a JSON object that may still be streaming in, e.g. '{"revenue_health": "Revenue gr'
+PARTIAL_FIELD = re.compile(r'"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+def partial_fields(text):
+    fields = {}
+    for match in PARTIAL_FIELD.finditer(text):
+        try:
+            fields[match.group(1)] = json.loads(f'"{match.group(2)}"')
+        except ValueError:
+            # an escape sequence cut off mid-way, the next chunk completes it
+            pass
+    return fields
+
+def structured_prompt(type_of_data, data, output_model):
+    # (parser, template, formatted prompt) asking for every insight of output_model in one completion
+    parser = PydanticOutputParser(pydantic_object=output_model)
+
+    # one copy of the fields any of the insights needs, within their combined budget; the format
+    # instructions grow with every insight and count against it
+    output_format = parser.get_format_instructions()
+    _, empty = get_prompts().format("insights", type_of_data=type_of_data, inputs="", output_format=output_format)
+    data = compact_inputs(data, list(output_model.model_fields), overhead=count_tokens(empty))
+    template, formatted_input = get_prompts().format("insights", type_of_data=type_of_data, inputs=json.dumps(data), output_format=output_format)
+    return parser, template, formatted_input
+
+def statement_insights(type_of_data, data, fields_to_include, attributes, descriptions, insight_model, tag=None, on_chunk=None):
+    # {field: insight} for the selected fields of one statement; on_chunk(field, text so far) is
+    # called from the calling thread while the insights stream in
+    request = (type_of_data, data, fields_to_include, attributes, descriptions, insight_model, tag)
+    return statements_insights({type_of_data: request}, on_chunk)[type_of_data]
+
+def statements_insights(requests, on_chunk=None):
+    # {name: {field: insight}} for requests {name: (type_of_data, data, fields_to_include, attributes,
+    # descriptions, insight_model, tag)}; the completions of all statements go to the pool together,
+    # so a report waits for its slowest insight rather than the sum of its statements
+    selected = {name: [field for field, include in zip(attributes, fields_to_include) if include]
+                for name, (_, _, fields_to_include, attributes, *_) in requests.items()}
+    ins = {name: {} for name in requests}
+
+    # one structured completion per statement, its cost is reported under all of the selected insights
+    structured = {}
+    if INSIGHT_MODE == "batched":
+        for name, (type_of_data, data, fields_to_include, attributes, _, insight_model, tag) in requests.items():
+            if len(selected[name]) > 1:
+                output_model = generate_pydantic_model(fields_to_include, attributes, insight_model.model_fields)
+                structured["+".join(selected[name])] = (name, output_model, tag, *structured_prompt(type_of_data, data, output_model))
+
+    # the per-field calls get their own client, requests without insights need no API key
+    model = get_model("openai") if structured else None
+    responses = {}
+    if on_chunk is None:
+        responses = run_ordered([(key, insight_flight.do, formatted_input, cached_predict, model, template, formatted_input, tag)
+                                 for key, (_, _, tag, _, template, formatted_input) in structured.items()])
+    else:
+        # on_chunk(field, text so far) for every insight read from the partial JSON
+        for key, chunk in stream_ordered([(key, insight_flight.stream, formatted_input, cached_stream, model, template, formatted_input, tag)
+                                          for key, (_, _, tag, _, template, formatted_input) in structured.items()]):
+            responses[key] = responses.get(key, "") + chunk
+            for field, text in partial_fields(responses[key]).items():
+                if field in structured[key][1].model_fields:
+                    on_chunk(field, text)
+
+    for key, (name, _, _, parser, template, formatted_input) in structured.items():
+        try:
+            ins[name] = parser.parse(responses[key]).model_dump()
+        except (OutputParserException, ValueError) as e:
+            # a malformed completion falls back to one prompt per insight
+            discard(model, template, formatted_input)
+            logger.warning(f"Structured {requests[name][0]} insights could not be parsed, falling back to one call per field: {e}")
+
+    # the remaining fields of every statement run concurrently, results keep the attribute order;
+    # insight fields are unique across statements and key the calls
+    pending = [(name, field, field, type_of_data, data, str({field: descriptions[field]}), tag)
+               for name, (type_of_data, data, _, _, descriptions, _, tag) in requests.items()
+               for field in selected[name] if not ins[name].get(field)]
+    if on_chunk is None:
+        results = run_ordered([(field, insights, *args) for _, field, *args in pending])
+    else:
+        results = {field: "" for _, field, *_ in pending}
+        for field, chunk in stream_ordered([(field, stream_insights, *args) for _, field, *args in pending]):
+            results[field] += chunk
+            on_chunk(field, results[field])
+    for name, field, *_ in pending:
+        ins[name][field] = results[field]
+
+    return {name: {field: ins[name][field] for field in selected[name]} for name in requests}
+
+
+class InsightPlaceholders:
+    # on_chunk for the pages: one placeholder per insight, updated as the text streams in
+    # and cleared once the finished insights are rendered; fields reserves them in that order
+
+    def __init__(self, fields=()):
+        self.placeholders = {field: st.empty() for field in fields}
+
+    def __call__(self, field, text):
+        if field not in self.placeholders:
+            self.placeholders[field] = st.empty()
+        self.placeholders[field].markdown(f"**{format_title(field)}**\n\n{text}")
+
+    def clear(self):
+        for placeholder in self.placeholders.values():
+            placeholder.empty()
+        self.placeholders = {}
+
+
+class QuotaStatus:
+    # on_eta for the pages: shows the estimated wait when the Alpha Vantage quota is busy; requests
+    # are made from the prefetch threads, which are attached to the page's script run to draw
+
+    def __init__(self, min_wait=1):
+        self.min_wait = min_wait
+        self.ctx = get_script_run_ctx()
+        self.placeholder = st.empty()
+        self.shown = False
+
+    def __call__(self, eta):
+        if eta <= self.min_wait and not self.shown:
+            return
+        add_script_run_ctx(threading.current_thread(), self.ctx)
+        if eta <= self.min_wait:
+            self.placeholder.empty()
+            self.shown = False
+        else:
+            self.placeholder.write(f"Alpha Vantage quota is busy, estimated wait {eta:.0f}s...")
+            self.shown = True
+
+    def clear(self):
+        self.placeholder.empty()
+
+
+def show_telemetry(summary, fields):
+    # summary and by_field() of a telemetry Run, as the pages keep them in the session
+    st.caption(f"LLM calls: {summary['calls']}, {summary['prompt_tokens']} prompt and {summary['completion_tokens']} completion tokens, "
+               f"${summary['cost_usd']:.4f}, {summary['wall_s']:.1f}s in calls and {summary['queue_s']:.1f}s queued")
+    if fields:
+        with st.expander("Cost per insight"):
+            df = pd.DataFrame.from_dict(fields, orient="index")
+            # a batched completion is listed under all of its fields, e.g. "Revenue Health + R And D Focus"
+            df.index = [" + ".join(format_title(part) for part in field.split("+")) if field else "Other" for field in df.index]
+            st.dataframe(df.round({"wall_s": 2, "queue_s": 2, "cost_usd": 5}))
+
     
 
+def quarterly_table(quarterly_metrics):
+    # newest quarter first, "N/A" shown as empty cells
+    df = pd.DataFrame(quarterly_metrics).set_index("dates").replace("N/A", None)
+    return df.iloc[::-1]
+
 def format_title(s: str) -> str:
     return ' '.join(word.capitalize() for word in s.split('_'))
 
@@ -1,12 +1,48 @@
 import json
 import unittest
 import os
+import tempfile
+import threading
+import time
+import types
+import urllib.request
+import numpy as np
+from unittest import mock
 from tqdm import tqdm
 from dotenv import load_dotenv
 
 from src.company_overview import company_overview
 from src.income_statement import income_statement
 from src.ticker_search import get_companies , get_ticker
+from src.av_client import RateLimiter
+from src.av_cache import ResponseCache
+from src.singleflight import SingleFlight
+from src.av_stub_server import synthetic_response, serve, replay_path
+from src.statement_store import StatementStore
+from src.statements import StatementBundle
+from src.av_async import prefetch, fetch_all
+import src.av_async as av_async
+import src.av_client as av_client
+from src.periods import ttm_frame
+from src.av_decode import decode
+from src.ratios import universe_ratios, metric, plan, fields_for, MetricEvaluator, METRICS
+from src.income_statement import metrics as income_metrics
+from src.balance_sheet import metrics as balance_metrics
+from src.peers import PeerIndex, describe, peer_ranks
+import src.peers as peers
+from src.screener import Screener, ScreenError, parse
+from src.llm_executor import ProviderExecutor, run_ordered
+from src.llm_cache import CompletionCache, completion_key
+from src.semantic_cache import SemanticCache, cached_query, answer_model
+from src.prompt_registry import PromptRegistry, get_prompts
+from src.compaction import compact_inputs, scaled
+from src.llm_stub import StubBackend, StubChatModel, hashed_embedding, sub_questions
+from src.telemetry import tracked_run, field_scope, record, cost
+import src.utils as utils
+from src.pydantic_models import IncomeStatementInsights, BalanceSheetInsights
+from src.fields2 import inc_stat, inc_stat_attributes, bal_sheet, balance_sheet_attributes, risk_management
+from src.refresh import latest_period, has_new_period, affected_results
+from src.av_scheduler import QuotaScheduler, QuotaExhausted, INTERACTIVE, BACKGROUND, is_throttle, is_daily_limit
 from src.rag.ingestion import Ingestion
 from src.rag.retrieval import Retrieve
 
@@ -20,6 +56,26 @@ setup_logging()
 logger = logging.getLogger(__name__)
 
 
+class TempEnvMixin:
+    # a temporary directory and the env overrides of the test class, both undone afterwards;
+    # "{tmp}" in a value is replaced with the directory
+    env = {}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.dict(os.environ, {key: value.format(tmp=self.tmp.name) for key, value in self.env.items()})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+# the local stand-in LLM without delays, with a completion cache of its own
+STUB_ENV = {
+    "LLM_BACKEND": "stub", "LLM_STUB_LATENCY_MS": "0", "LLM_STUB_TOKENS_PER_SECOND": "0",
+    "LLM_CACHE_PATH": os.path.join("{tmp}", "llm.sqlite"),
+}
+
+
 class TestCompanyOverview(unittest.TestCase):
 
     def test_company_overview(self):
@@ -82,6 +138,940 @@ class TestTickerSearch(unittest.TestCase):
                 except Exception as e:
                     self.fail(f"get_ticker() raised an exception for {test_case['company_name']}: {e}")
 
+class TestRateLimiter(unittest.TestCase):
+
+    def test_burst_within_minute_budget(self):
+        limiter = RateLimiter(calls_per_minute=5, calls_per_day=500)
+        waits = [limiter.reserve() for _ in range(5)]
+        self.assertEqual(waits, [0.0] * 5)
+
+    def test_waits_when_minute_budget_exhausted(self):
+        limiter = RateLimiter(calls_per_minute=5, calls_per_day=500)
+        for _ in range(5):
+            limiter.reserve()
+        wait = limiter.reserve()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 12)
+
+    def test_waits_when_day_budget_exhausted(self):
+        limiter = RateLimiter(calls_per_minute=100, calls_per_day=2)
+        limiter.reserve()
+        limiter.reserve()
+        self.assertGreater(limiter.reserve(), 60)
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(os.path.join(tempfile.mkdtemp(), "cache.sqlite"))
+
+    def test_statement_roundtrip(self):
+        data = {
+            "symbol": "TSLA",
+            "annualReports": [{"fiscalDateEnding": "2023-12-31", "totalRevenue": "2"}, {"fiscalDateEnding": "2022-12-31", "totalRevenue": "1"}],
+            "quarterlyReports": [],
+        }
+        self.cache.set("INCOME_STATEMENT", {"symbol": "TSLA", "apikey": "key"}, data)
+        self.assertEqual(self.cache.get("INCOME_STATEMENT", {"symbol": "tsla"}), data)
+
+    def test_historical_reports_are_immutable(self):
+        first = {"symbol": "TSLA", "annualReports": [{"fiscalDateEnding": "2023-12-31", "totalRevenue": "2"}, {"fiscalDateEnding": "2022-12-31", "totalRevenue": "1"}]}
+        restated = {"symbol": "TSLA", "annualReports": [{"fiscalDateEnding": "2023-12-31", "totalRevenue": "3"}, {"fiscalDateEnding": "2022-12-31", "totalRevenue": "9"}]}
+        self.cache.set("INCOME_STATEMENT", {"symbol": "TSLA"}, first)
+        self.cache.set("INCOME_STATEMENT", {"symbol": "TSLA"}, restated)
+        reports = self.cache.get("INCOME_STATEMENT", {"symbol": "TSLA"})["annualReports"]
+        self.assertEqual([r["totalRevenue"] for r in reports], ["3", "1"])
+
+    def test_invalidate(self):
+        self.cache.set("OVERVIEW", {"symbol": "TSLA"}, {"Symbol": "TSLA"})
+        self.cache.invalidate(symbol="TSLA")
+        self.assertIsNone(self.cache.get("OVERVIEW", {"symbol": "TSLA"}))
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"Symbol": "TSLA"}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("TSLA", fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"Symbol": "TSLA"}] * 5)
+
+    def test_sequential_calls_are_not_coalesced(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do("key", lambda: 1), 1)
+        self.assertEqual(flight.do("key", lambda: 2), 2)
+
+class TestStubServer(unittest.TestCase):
+
+    def test_synthetic_responses_are_deterministic(self):
+        for function in ["OVERVIEW", "INCOME_STATEMENT", "BALANCE_SHEET", "CASH_FLOW", "NEWS_SENTIMENT"]:
+            with self.subTest(function=function):
+                self.assertEqual(synthetic_response(function, "TSLA"), synthetic_response(function, "TSLA"))
+
+    def test_synthetic_statement_periods(self):
+        data = synthetic_response("INCOME_STATEMENT", "TSLA")
+        self.assertEqual(data["annualReports"][0]["fiscalDateEnding"], "2023-12-31")
+        self.assertEqual([r["fiscalDateEnding"] for r in data["quarterlyReports"][:4]], ["2023-12-31", "2023-09-30", "2023-06-30", "2023-03-31"])
+
+    def get(self, **kwargs):
+        server = serve(port=0, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/query?function=OVERVIEW&symbol=TSLA"
+
+        def get():
+            with urllib.request.urlopen(url) as response:
+                return json.load(response)
+        return get
+
+    def test_injected_throttles_are_per_minute(self):
+        data = self.get(throttle_rate=1.0)()
+        self.assertTrue(is_throttle(data))
+        self.assertFalse(is_daily_limit(data))
+
+    def test_daily_limit(self):
+        get = self.get(calls_per_day=1)
+        self.assertEqual(get()["Symbol"], "TSLA")
+        data = get()
+        self.assertTrue(is_throttle(data))
+        self.assertTrue(is_daily_limit(data))
+
+class TestStatementBundle(unittest.TestCase):
+
+    def setUp(self):
+        # a fresh client against the local stand-in, with latency so concurrent requests overlap
+        self.server = serve(port=0, latency_ms=100)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        patcher = mock.patch.dict(os.environ, {
+            "AV_BASE_URL": f"http://127.0.0.1:{self.server.server_address[1]}/query",
+            "AV_CACHE_PATH": "", "AV_CALLS_PER_MINUTE": "100000", "AV_CALLS_PER_DAY": "100000",
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client = mock.patch.object(av_client, "_client", None)
+        client.start()
+        self.addCleanup(client.stop)
+        os.environ.pop("AV_RECORD_DIR", None)
+
+    def test_concurrent_gets_fetch_once(self):
+        bundle = StatementBundle("TSLA")
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(bundle.get("INCOME_STATEMENT"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.state.served, 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result == synthetic_response("INCOME_STATEMENT", "TSLA") for result in results))
+
+    def test_prefetch_fills_the_bundle(self):
+        bundle = StatementBundle("MSFT")
+        prefetch(bundle, ("OVERVIEW", "INCOME_STATEMENT", "BALANCE_SHEET"))
+        self.assertEqual(bundle.overview()["Symbol"], "MSFT")
+        self.assertIsNotNone(bundle.statement("INCOME_STATEMENT"))
+        self.assertIn("annualReports", bundle.balance_sheet())
+        self.assertEqual(bundle.income_statement()["annualReports"], synthetic_response("INCOME_STATEMENT", "MSFT")["annualReports"][:1])
+        self.assertEqual(self.server.state.served, 3)
+
+    def test_decoding_drops_older_reports(self):
+        bundle = StatementBundle("TSLA")
+        data = synthetic_response("CASH_FLOW", "TSLA")
+        statement = bundle.statement("CASH_FLOW")
+        self.assertEqual(len(statement), len(data["annualReports"]) + len(data["quarterlyReports"]))
+        self.assertEqual(bundle.cash_flow(), {**data, "annualReports": data["annualReports"][:1], "quarterlyReports": data["quarterlyReports"][:1]})
+
+    def test_bundles_share_the_decoded_statement_of_a_cached_response(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {"AV_CACHE_PATH": os.path.join(tmp, "av.sqlite")}):
+            first = StatementBundle("AAPL").statement("BALANCE_SHEET")
+            self.assertIs(StatementBundle("AAPL").statement("BALANCE_SHEET"), first)
+            self.assertIsNot(StatementBundle("NVDA").statement("BALANCE_SHEET"), first)
+        self.assertEqual(self.server.state.served, 2)
+
+    def test_throttles_are_not_recorded(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        os.environ["AV_RECORD_DIR"] = tmp.name
+        av_client.av_query("OVERVIEW", symbol="TSLA")
+        with open(replay_path(tmp.name, "OVERVIEW", "TSLA")) as f:
+            recorded = f.read()
+
+        throttled = serve(port=0, throttle_rate=1.0)
+        threading.Thread(target=throttled.serve_forever, daemon=True).start()
+        self.addCleanup(throttled.server_close)
+        self.addCleanup(throttled.shutdown)
+        os.environ["AV_BASE_URL"] = f"http://127.0.0.1:{throttled.server_address[1]}/query"
+        with mock.patch.object(av_client, "MAX_THROTTLE_RETRIES", 0), mock.patch.object(av_async, "MAX_THROTTLE_RETRIES", 0):
+            # a fresh client each time, the first throttle pauses the scheduler
+            with mock.patch.object(av_client, "_client", None):
+                self.assertTrue(is_throttle(av_client.av_query("OVERVIEW", refresh=True, symbol="TSLA")))
+            with mock.patch.object(av_client, "_client", None):
+                self.assertTrue(is_throttle(fetch_all("TSLA", ("OVERVIEW",))["OVERVIEW"]))
+        with open(replay_path(tmp.name, "OVERVIEW", "TSLA")) as f:
+            self.assertEqual(f.read(), recorded)
+
+    def test_quota_wait_is_reported(self):
+        etas = []
+        bundle = StatementBundle("MSFT", on_eta=etas.append)
+        prefetch(bundle, ("OVERVIEW", "INCOME_STATEMENT"))
+        bundle.overview()
+        bundle.income_statement()
+        bundle.balance_sheet()
+        self.assertEqual(len(etas), 3)
+        self.assertTrue(all(eta >= 0 for eta in etas))
+
+    def test_prefetch_without_api_key(self):
+        os.environ.pop("AV_API_KEY", None)
+        bundle = StatementBundle("MSFT")
+        prefetch(bundle, ("OVERVIEW", "INCOME_STATEMENT"))
+        self.assertEqual(bundle.overview()["Symbol"], "MSFT")
+        self.assertEqual(bundle.income_statement(), synthetic_response("INCOME_STATEMENT", "MSFT"))
+        self.assertEqual(self.server.state.served, 2)
+
+
+class TestQuotaScheduler(unittest.TestCase):
+
+    def test_interactive_served_before_background(self):
+        scheduler = QuotaScheduler(RateLimiter(calls_per_minute=120, calls_per_day=10000))
+        scheduler.limiter.drain()
+        order = []
+
+        def request(name, priority):
+            scheduler.acquire(priority)
+            order.append(name)
+
+        background = threading.Thread(target=request, args=("background", BACKGROUND))
+        background.start()
+        # the background request has to be waiting for the token before the interactive one arrives
+        while not scheduler.queue and not order:
+            time.sleep(0.001)
+        interactive = threading.Thread(target=request, args=("interactive", INTERACTIVE))
+        interactive.start()
+        background.join()
+        interactive.join()
+
+        self.assertEqual(order, ["interactive", "background"])
+
+    def test_throttle_pauses_interactive_callers(self):
+        scheduler = QuotaScheduler(RateLimiter(calls_per_minute=5, calls_per_day=500))
+        scheduler.report_throttle({"Information": "Our standard API rate limit is 5 requests per minute."})
+        self.assertGreater(scheduler.eta(INTERACTIVE), 50)
+        with self.assertRaises(QuotaExhausted):
+            scheduler.acquire(INTERACTIVE, max_wait=1)
+
+    def test_minute_throttle_pauses_for_a_minute(self):
+        scheduler = QuotaScheduler(RateLimiter(calls_per_minute=5, calls_per_day=500))
+        scheduler.report_throttle({"Note": "Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute and 500 calls per day. "
+                                           "Please visit https://www.alphavantage.co/premium/ if you would like to target a higher API call frequency."})
+        self.assertAlmostEqual(scheduler.blocked_until - time.monotonic(), 60, delta=1)
+        self.assertGreater(scheduler.limiter.wait_time(), 0)
+        self.assertLessEqual(scheduler.eta(BACKGROUND), 61)
+
+    def test_daily_throttle_pauses_until_tomorrow(self):
+        scheduler = QuotaScheduler(RateLimiter(calls_per_minute=5, calls_per_day=500))
+        with mock.patch("src.av_scheduler.seconds_until_tomorrow", return_value=3600):
+            scheduler.report_throttle({"Information": "Our standard API rate limit is 25 requests per day."})
+        self.assertAlmostEqual(scheduler.blocked_until - time.monotonic(), 3600, delta=1)
+
+    def test_is_throttle(self):
+        self.assertTrue(is_throttle({"Information": "Our standard API rate limit is 25 requests per day."}))
+        self.assertFalse(is_throttle({"Error Message": "Invalid API call."}))
+
+class TestRefresh(unittest.TestCase):
+
+    def test_latest_period_prefers_quarterly(self):
+        data = {"annualReports": [{"fiscalDateEnding": "2022-12-31"}], "quarterlyReports": [{"fiscalDateEnding": "2023-03-31"}]}
+        self.assertEqual(latest_period(data), "2023-03-31")
+
+    def test_has_new_period(self):
+        stored = {"LatestQuarter": "2023-09-30", "FiscalYearEnd": "December"}
+        self.assertFalse(has_new_period(stored, {"LatestQuarter": "2023-09-30", "FiscalYearEnd": "December"}))
+        self.assertTrue(has_new_period(stored, {"LatestQuarter": "2023-12-31", "FiscalYearEnd": "December"}))
+
+    def test_affected_results_follow_dependencies(self):
+        self.assertEqual(affected_results(["CASH_FLOW"]), ["cash_flow"])
+        self.assertEqual(affected_results(["BALANCE_SHEET"]), ["balance_sheet", "cash_flow"])
+        self.assertEqual(affected_results(["INCOME_STATEMENT", "CASH_FLOW"]), ["income_statement", "balance_sheet", "cash_flow"])
+
+class TestStatementStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = StatementStore(tempfile.mkdtemp())
+        for symbol in ["TSLA", "AAPL"]:
+            self.store.write(symbol, "INCOME_STATEMENT", synthetic_response("INCOME_STATEMENT", symbol))
+
+    def test_projection_and_filters(self):
+        table = self.store.read("INCOME_STATEMENT", ["netIncome"], symbols=["TSLA"], period="annual")
+        self.assertEqual(table.column_names, ["symbol", "period", "fiscalDateEnding", "netIncome"])
+        self.assertEqual(table.num_rows, 10)
+        self.assertEqual(set(table["symbol"].to_pylist()), {"TSLA"})
+
+    def test_wide_frame(self):
+        wide = self.store.wide("INCOME_STATEMENT", "totalRevenue")
+        self.assertEqual(list(wide.columns), ["AAPL", "TSLA"])
+        self.assertEqual(len(wide), 10)
+
+    def test_missing_values_are_null(self):
+        data = {"annualReports": [{"fiscalDateEnding": "2023-12-31", "totalRevenue": "None", "netIncome": "5"}]}
+        self.store.write("NONE", "INCOME_STATEMENT", data)
+        table = self.store.read("INCOME_STATEMENT", ["totalRevenue", "netIncome"], symbols=["NONE"])
+        self.assertEqual(table["totalRevenue"].to_pylist(), [None])
+        self.assertEqual(table["netIncome"].to_pylist(), [5.0])
+
+class TestPeriods(unittest.TestCase):
+
+    def quarters(self, dates, revenue):
+        return {"quarterlyReports": [{"fiscalDateEnding": d, "totalRevenue": str(r)} for d, r in zip(dates, revenue)]}
+
+    def test_ttm_sums_four_consecutive_quarters(self):
+        data = self.quarters(["2023-12-31", "2023-09-30", "2023-06-30", "2023-03-31", "2022-12-31"], [5, 4, 3, 2, 1])
+        frame = ttm_frame("INCOME_STATEMENT", data, ["totalRevenue"])
+        self.assertEqual(frame["totalRevenue"].tolist()[3:], [10.0, 14.0])
+        self.assertTrue(frame["totalRevenue"][:3].isna().all())
+
+    def test_gap_in_quarters_gives_nan(self):
+        data = self.quarters(["2023-12-31", "2023-09-30", "2023-06-30", "2022-12-31"], [4, 3, 2, 1])
+        frame = ttm_frame("INCOME_STATEMENT", data, ["totalRevenue"])
+        self.assertTrue(frame["totalRevenue"].isna().all())
+
+    def test_balances_are_point_in_time(self):
+        data = {"quarterlyReports": [{"fiscalDateEnding": "2023-12-31", "totalAssets": "7"}, {"fiscalDateEnding": "2023-09-30", "totalAssets": "6"}]}
+        frame = ttm_frame("BALANCE_SHEET", data, ["totalAssets"])
+        self.assertEqual(frame["totalAssets"].tolist(), [6.0, 7.0])
+
+class TestDecoder(unittest.TestCase):
+
+    def test_values_and_missing_mask(self):
+        data = {
+            "annualReports": [{"fiscalDateEnding": "2023-12-31", "totalRevenue": "100", "netIncome": "None"}],
+            "quarterlyReports": [{"fiscalDateEnding": "2023-12-31", "totalRevenue": "30"}, {"fiscalDateEnding": "2023-09-30", "totalRevenue": "25"}],
+        }
+        statement = decode("INCOME_STATEMENT", data)
+        self.assertEqual(len(statement), 3)
+        self.assertEqual(statement.value("totalRevenue"), 100.0)
+        self.assertIsNone(statement.value("netIncome"))
+        self.assertTrue(statement.missing[0, statement.index["netIncome"]])
+        self.assertEqual(statement.history("totalRevenue", "quarterly"), [25.0, 30.0])
+        self.assertEqual(statement.history_dates("quarterly"), ["2023-09-30", "2023-12-31"])
+
+    def test_matches_payload(self):
+        data = synthetic_response("CASH_FLOW", "AAPL")
+        statement = decode("CASH_FLOW", data)
+        self.assertEqual(statement.annual_count, len(data["annualReports"]))
+        report = data["quarterlyReports"][3]
+        for field in statement.fields:
+            expected = None if report[field] == "None" else float(report[field])
+            self.assertEqual(statement.value(field, "quarterly", 3), expected)
+
+class TestRatios(unittest.TestCase):
+
+    def test_missing_and_zero_operands_give_na(self):
+        report = {"grossProfit": "40", "totalRevenue": "100", "netIncome": "None", "ebit": "10", "interestAndDebtExpense": "0"}
+        met = income_metrics(report)
+        self.assertAlmostEqual(met["gross_profit_margin"], 0.4)
+        self.assertEqual(met["net_profit_margin"], "N/A")
+        self.assertEqual(met["interest_coverage_ratio"], "N/A")
+
+    def test_scalar_revenue_sentinel(self):
+        report = {"totalAssets": "200", "totalCurrentAssets": "50", "totalCurrentLiabilities": "25"}
+        self.assertAlmostEqual(balance_metrics(report, 100.0)["asset_turnover"], 0.5)
+        self.assertEqual(balance_metrics(report, "N/A")["asset_turnover"], "N/A")
+        self.assertAlmostEqual(balance_metrics(report, "N/A")["current_ratio"], 2.0)
+
+    def test_universe_matches_single_report(self):
+        store = StatementStore(tempfile.mkdtemp())
+        for symbol in ["TSLA", "AAPL"]:
+            for function in ["INCOME_STATEMENT", "BALANCE_SHEET", "CASH_FLOW"]:
+                store.write(symbol, function, synthetic_response(function, symbol))
+        ratios = universe_ratios(store=store)
+        self.assertEqual(len(ratios), 20)
+        report = synthetic_response("INCOME_STATEMENT", "AAPL")["annualReports"][0]
+        row = ratios.loc[("AAPL", report["fiscalDateEnding"])]
+        for name, value in income_metrics(report).items():
+            if value == "N/A":
+                self.assertTrue(row[name] != row[name])
+            else:
+                self.assertAlmostEqual(row[name], value)
+
+class TestMetricRegistry(unittest.TestCase):
+
+    def test_plan_orders_inputs_first(self):
+        order = plan(["cash_flow_to_debt_ratio"])
+        self.assertLess(order.index("total_debt"), order.index("cash_flow_to_debt_ratio"))
+        self.assertEqual(sorted(fields_for(["cash_flow_to_debt_ratio"])), ["BALANCE_SHEET", "CASH_FLOW"])
+
+    def test_only_needed_statements_are_loaded(self):
+        loaded = []
+        def load(function):
+            loaded.append(function)
+            return decode(function, synthetic_response(function, "AAPL")).frame("annual")
+        evaluator = MetricEvaluator(load)
+        evaluator.evaluate(["current_ratio", "quick_ratio"])
+        self.assertEqual(loaded, ["BALANCE_SHEET"])
+
+    def test_shared_intermediates_are_evaluated_once(self):
+        calls = []
+        metric("test_debt_twice", "total_debt", "total_debt")(lambda a, b: calls.append(1) or a + b)
+        try:
+            evaluator = MetricEvaluator(lambda f: decode(f, synthetic_response(f, "AAPL")).frame("annual"))
+            first = evaluator.value("total_debt")
+            evaluator.value("test_debt_twice")
+            evaluator.value("test_debt_twice")
+            self.assertIs(evaluator.value("total_debt"), first)
+            self.assertEqual(len(calls), 1)
+        finally:
+            del METRICS["test_debt_twice"]
+
+    def test_unknown_inputs_are_rejected(self):
+        with self.assertRaises(ValueError):
+            metric("bad_metric", "INCOME_STATEMENT.notAField")(lambda x: x)
+        with self.assertRaises(ValueError):
+            metric("bad_metric", "not_a_metric")(lambda x: x)
+
+class TestPeerIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "peers.json")
+        self.index = PeerIndex(self.path)
+        for i in range(10):
+            industry = "SEMICONDUCTORS" if i < 6 else "SOFTWARE"
+            self.index.update(f"S{i}", {"Sector": "TECHNOLOGY", "Industry": industry}, {"current_ratio": float(i), "asset_turnover": "N/A"})
+
+    def test_percentile_within_industry(self):
+        ranks = self.index.rank({"Sector": "TECHNOLOGY", "Industry": "SEMICONDUCTORS"}, {"current_ratio": 4.5, "asset_turnover": 1.0})
+        self.assertEqual(ranks["current_ratio"], {"percentile": 250 / 3, "group": "SEMICONDUCTORS", "peers": 6})
+        self.assertNotIn("asset_turnover", ranks)
+        self.assertEqual(describe(ranks["current_ratio"]), "83rd percentile of SEMICONDUCTORS")
+
+    def test_small_industry_falls_back_to_sector(self):
+        ranks = self.index.rank({"Sector": "TECHNOLOGY", "Industry": "SOFTWARE"}, {"current_ratio": 5.0})
+        self.assertEqual(ranks["current_ratio"]["group"], "TECHNOLOGY")
+        self.assertEqual(ranks["current_ratio"]["percentile"], 55.0)
+
+    def test_update_replaces_previous_values(self):
+        self.index.update("S0", {"Sector": "TECHNOLOGY", "Industry": "SEMICONDUCTORS"}, {"current_ratio": 100.0})
+        values = self.index.values[("Industry", "SEMICONDUCTORS", "current_ratio")]
+        self.assertEqual(values.tolist(), [1.0, 2.0, 3.0, 4.0, 5.0, 100.0])
+
+    def test_ranks_need_enough_peers(self):
+        bundle = mock.Mock()
+        bundle.overview.return_value = {"Sector": "TECHNOLOGY", "Industry": "SEMICONDUCTORS"}
+        with mock.patch.object(peers, "get_peer_index", lambda: PeerIndex(os.path.join(tempfile.mkdtemp(), "peers.json"))):
+            self.assertEqual(peer_ranks(bundle, {"current_ratio": 4.5}), {})
+        bundle.overview.assert_not_called()
+        with mock.patch.object(peers, "get_peer_index", lambda: self.index):
+            self.assertEqual(peer_ranks(bundle, {"current_ratio": 4.5})["current_ratio"]["peers"], 6)
+
+    def test_save_and_load(self):
+        self.index.save()
+        loaded = PeerIndex(self.path)
+        for key, values in self.index.values.items():
+            self.assertEqual(loaded.values[key].tolist(), values.tolist())
+
+class TestScreener(unittest.TestCase):
+
+    def setUp(self):
+        import pandas as pd
+        attributes = pd.DataFrame(
+            {"Exchange": ["NASDAQ", "NASDAQ", "NYSE", "NASDAQ"], "Type": ["Common Stock", "ETF", "Common Stock", "Common Stock"]},
+            index=pd.Index(["AAA", "BBB", "CCC", "DDD"], name="symbol"),
+        )
+        metrics = pd.DataFrame(
+            {"net_profit_margin": [0.25, 0.30, 0.40, float("nan")], "debt_to_equity_ratio": [0.4, 0.2, 0.1, 0.3]},
+            index=attributes.index,
+        )
+        self.screener = Screener(metrics, attributes)
+
+    def symbols(self, query, **kwargs):
+        return list(self.screener.screen(query, **kwargs).index)
+
+    def test_combined_filters(self):
+        query = "exchange = nasdaq and type = 'Common Stock' and net_profit_margin > 20% and debt_to_equity_ratio < 0.5"
+        self.assertEqual(self.symbols(query), ["AAA"])
+
+    def test_precedence_and_not(self):
+        self.assertEqual(parse("a > 1 or b > 2 and c > 3")[0], "or")
+        self.assertEqual(self.symbols("not exchange = NASDAQ or net_profit_margin >= 0.3", sort_by="net_profit_margin"), ["CCC", "BBB"])
+
+    def test_missing_metric_never_matches_a_range(self):
+        self.assertEqual(self.symbols("net_profit_margin < 1 or net_profit_margin >= 1"), ["AAA", "BBB", "CCC"])
+
+    def test_not_excludes_missing_metrics(self):
+        self.assertEqual(self.symbols("not net_profit_margin <= 0"), ["AAA", "BBB", "CCC"])
+        self.assertEqual(self.symbols("not (net_profit_margin < 0.3 or debt_to_equity_ratio > 0.35)"), ["BBB", "CCC"])
+
+    def test_errors(self):
+        for query in ["unknown_metric > 1", "net_profit_margin > NASDAQ", "exchange > 1", "net_profit_margin >", "(exchange = NYSE"]:
+            with self.assertRaises(ScreenError):
+                self.screener.screen(query)
+
+class TestStructuredInsights(TempEnvMixin, unittest.TestCase):
+
+    class FakeModel:
+
+        def __init__(self, structured_reply):
+            self.structured_reply = structured_reply
+            self.prompts = []
+
+        def predict(self, text):
+            self.prompts.append(text)
+            return self.structured_reply if "output schema" in text else f"insight {len(self.prompts)}"
+
+        def stream(self, text):
+            reply = self.predict(text)
+            for i in range(0, len(reply), 4):
+                yield types.SimpleNamespace(content=reply[i:i + 4])
+
+    env = {"LLM_CACHE_PATH": os.path.join("{tmp}", "llm.sqlite")}
+
+    def run_insights(self, model, fields):
+        with mock.patch.object(utils, "get_model", lambda name: model):
+            return utils.statement_insights("income statement", {"ticker": "TEST"}, fields, inc_stat_attributes, inc_stat, IncomeStatementInsights)
+
+    def test_one_call_for_all_selected_fields(self):
+        model = self.FakeModel('{"revenue_health": "a", "debt_management": "b"}')
+        ins = self.run_insights(model, [True, False, False, True, False])
+        self.assertEqual(ins, {"revenue_health": "a", "debt_management": "b"})
+        self.assertEqual(len(model.prompts), 1)
+        self.assertEqual(model.prompts[0].count('"ticker"'), 1)
+
+    def test_malformed_reply_falls_back_to_per_field(self):
+        model = self.FakeModel("not json")
+        ins = self.run_insights(model, [True, True, False, False, False])
+        self.assertEqual(list(ins), ["revenue_health", "operational_efficiency"])
+        self.assertEqual(len(model.prompts), 3)
+
+    def test_streamed_insights_match_final_text(self):
+        model = self.FakeModel('{"revenue_health": "revenue grew \\"fast\\"", "debt_management": "low debt"}')
+        seen = []
+        with mock.patch.object(utils, "get_model", lambda name: model):
+            ins = utils.statement_insights("income statement", {"ticker": "TEST"}, [True, False, False, True, False],
+                inc_stat_attributes, inc_stat, IncomeStatementInsights, on_chunk=lambda field, text: seen.append((field, text)))
+        self.assertEqual(ins, {"revenue_health": 'revenue grew "fast"', "debt_management": "low debt"})
+        self.assertGreater(len(seen), 2)
+        self.assertEqual(seen[-1], ("debt_management", "low debt"))
+        self.assertIn(("revenue_health", 'revenue grew "fast"'), seen)
+
+    def test_streamed_fallback_per_field(self):
+        model = self.FakeModel("not json")
+        seen = {}
+        with mock.patch.object(utils, "get_model", lambda name: model):
+            ins = utils.statement_insights("income statement", {"ticker": "TEST"}, [True, True, False, False, False],
+                inc_stat_attributes, inc_stat, IncomeStatementInsights, on_chunk=seen.__setitem__)
+        self.assertEqual(seen, ins)
+        self.assertEqual(list(ins), ["revenue_health", "operational_efficiency"])
+
+    def test_concurrent_streams_share_one_call(self):
+        model = self.FakeModel('{"revenue_health": "a", "debt_management": "b"}')
+        started, release = threading.Event(), threading.Event()
+        stream = model.stream
+
+        def slow_stream(text):
+            started.set()
+            release.wait(5)
+            yield from stream(text)
+
+        model.stream = slow_stream
+        results = []
+
+        def view():
+            results.append(utils.statement_insights("income statement", {"ticker": "TEST"}, [True, False, False, True, False],
+                inc_stat_attributes, inc_stat, IncomeStatementInsights, on_chunk=lambda field, text: None))
+
+        with mock.patch.object(utils, "get_model", lambda name: model):
+            leader = threading.Thread(target=view)
+            leader.start()
+            self.assertTrue(started.wait(5))
+            follower = threading.Thread(target=view)
+            follower.start()
+            time.sleep(0.1)
+            release.set()
+            leader.join()
+            follower.join()
+        self.assertEqual(results, [{"revenue_health": "a", "debt_management": "b"}] * 2)
+        self.assertEqual(len(model.prompts), 1)
+
+    def test_statements_are_generated_in_one_batch(self):
+        model = self.FakeModel("not json")
+        active, peak, lock = [0], [0], threading.Lock()
+        predict = model.predict
+
+        def slow_predict(text):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.2)
+            with lock:
+                active[0] -= 1
+            return predict(text)
+
+        model.predict = slow_predict
+        requests = {
+            "income_statement": ("income statement", {"ticker": "TEST"}, [True, True, False, False, False], inc_stat_attributes, inc_stat, IncomeStatementInsights, "TEST"),
+            "balance_sheet": ("balance sheet", {"ticker": "TEST"}, [True, True, False, False, False], balance_sheet_attributes, bal_sheet, BalanceSheetInsights, "TEST"),
+        }
+        with mock.patch.object(utils, "get_model", lambda name: model), mock.patch.object(utils, "INSIGHT_MODE", "per_field"):
+            ins = utils.statements_insights(requests)
+        self.assertEqual(list(ins["balance_sheet"]), balance_sheet_attributes[:2])
+        self.assertEqual(len(model.prompts), 4)
+        self.assertEqual(peak[0], 4)
+
+    def test_repeat_view_is_served_from_cache(self):
+        model = self.FakeModel('{"revenue_health": "a", "debt_management": "b"}')
+        fields = [True, False, False, True, False]
+        first = self.run_insights(model, fields)
+        self.assertEqual(self.run_insights(model, fields), first)
+        self.assertEqual(len(model.prompts), 1)
+
+    def test_unparsable_reply_is_not_cached(self):
+        model = self.FakeModel("not json")
+        self.run_insights(model, [True, True, False, False, False])
+        self.run_insights(model, [True, True, False, False, False])
+        # the structured call is repeated, the per-field insights are cached
+        self.assertEqual(len(model.prompts), 4)
+
+
+class TestPromptRegistry(unittest.TestCase):
+
+    def test_prompts_are_compiled_once(self):
+        registry = PromptRegistry()
+        template, text = registry.format("report", insight_name="risk_factors", section_name="Risk Management", output_format="{}")
+        self.assertEqual(template, open("prompts/report.prompt").read())
+        self.assertIn("risk_factors", text)
+
+    def test_missing_variable_is_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("iv2", "insights", "report"):
+                with open(os.path.join(tmp, f"{name}.prompt"), "w") as f:
+                    f.write(open(f"prompts/{name}.prompt").read())
+            with open(os.path.join(tmp, "report.prompt"), "w") as f:
+                f.write("Write about {insight_name}")
+            with self.assertRaises(ValueError):
+                PromptRegistry(tmp)
+
+
+class TestClientPool(unittest.TestCase):
+
+    def test_clients_are_reused(self):
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "key-a"}):
+            model = utils.get_model("openai")
+            self.assertIs(utils.get_model("openai"), model)
+            self.assertIsNot(utils.get_model("openai", temperature=0), model)
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "key-b"}):
+            self.assertIsNot(utils.get_model("openai"), model)
+
+    def test_service_context_is_shared(self):
+        with mock.patch.object(utils.ServiceContext, "from_defaults", lambda **kwargs: types.SimpleNamespace(**kwargs)):
+            context = utils.get_service_context("openai")
+            self.assertIs(utils.get_service_context("openai"), context)
+            self.assertIsInstance(context.llm, utils.LlamaOpenAI)
+
+
+class TestCompaction(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            "annual_report_data": {
+                "fiscalDateEnding": "2023-09-30", "reportedCurrency": "USD",
+                "interestExpense": "3933000000", "interestAndDebtExpense": "None", "ebit": "118658000000",
+                "ebitda": "125820000000", "totalRevenue": "383285000000", "researchAndDevelopment": "29915000000",
+            },
+            "historical_data": {
+                "dates": ["2021-09-30", "2022-09-30", "2023-09-30"],
+                "interest_expense": [2645000000.0, 2931000000.0, None],
+            },
+        }
+
+    def test_scaled(self):
+        self.assertEqual(scaled("383285000000"), "383.3B")
+        self.assertEqual(scaled(-2931000000.0), "-2.931B")
+        self.assertEqual(scaled(0.5), "0.5")
+        self.assertIsNone(scaled("None"))
+        self.assertEqual(scaled("2023-09-30"), "2023-09-30")
+
+    def test_only_fields_of_the_insight(self):
+        compact = compact_inputs(self.data, ["debt_management"], budget=1000)
+        self.assertEqual(compact["annual_report_data"], {"interestExpense": "3.933B", "ebit": "118.7B", "ebitda": "125.8B"})
+        self.assertEqual(compact["historical_data"]["interest_expense"], ["2.645B", "2.931B", None])
+        self.assertEqual(compact["reportedCurrency"], "USD")
+
+    def test_budget_drops_history_before_fields(self):
+        count = lambda text: len(text)
+        full = len(json.dumps(compact_inputs(self.data, ["debt_management"], budget=1000)))
+        compact = compact_inputs(self.data, ["debt_management"], budget=full - 10, count=count)
+        self.assertEqual(compact["historical_data"]["dates"], ["2022-09-30", "2023-09-30"])
+        compact = compact_inputs(self.data, ["debt_management"], budget=200, count=count)
+        self.assertEqual(compact["historical_data"], {})
+        self.assertLessEqual(len(json.dumps(compact)), 200)
+        self.assertIn("interestExpense", compact["annual_report_data"])
+
+    def test_budget_is_per_insight_and_counts_the_prompt(self):
+        count = lambda text: len(text)
+        full = len(json.dumps(compact_inputs(self.data, ["debt_management"], budget=1000)))
+        # the rest of the prompt leaves too little room for the history
+        compact = compact_inputs(self.data, ["debt_management"], budget=full + 40, count=count, overhead=50)
+        self.assertEqual(len(compact["historical_data"]["dates"]), 2)
+        # a batched prompt for two insights gets twice the budget
+        compact = compact_inputs(self.data, ["debt_management", "debt_management"], budget=full + 40, count=count, overhead=50)
+        self.assertEqual(len(compact["historical_data"]["dates"]), 3)
+
+    def test_other_inputs_pass_through(self):
+        self.assertEqual(compact_inputs({"ticker": "TEST"}, ["debt_management"]), {"ticker": "TEST"})
+
+
+class TestLLMStub(TempEnvMixin, unittest.TestCase):
+
+    env = STUB_ENV
+
+    def test_replies_are_deterministic(self):
+        backend = StubBackend(latency_ms=0)
+        prompt = "You are tasked with generating debt_management insight about the company"
+        self.assertEqual(backend.reply(prompt), StubBackend(latency_ms=0).reply(prompt))
+        self.assertTrue(backend.reply(prompt).startswith("Debt management:"))
+        self.assertNotEqual(backend.reply(prompt), backend.reply(prompt + "."))
+
+    def test_canned_responses(self):
+        backend = StubBackend(responses=[{"pattern": r"generating (?P<name>\w+) insight", "response": "canned {name}"}])
+        self.assertEqual(backend.reply("generating revenue_health insight"), "canned revenue_health")
+
+    def test_token_accounting(self):
+        backend = StubBackend(latency_ms=0, tokens_per_second=0)
+        text, usage = backend.complete("generating revenue_health insight")
+        self.assertEqual(usage["total_tokens"], usage["prompt_tokens"] + usage["completion_tokens"])
+        self.assertEqual(backend.usage["calls"], 1)
+        self.assertEqual("".join(backend.chunks("generating revenue_health insight")), text)
+        self.assertEqual(backend.usage["calls"], 2)
+
+    def test_statement_insights_offline(self):
+        self.assertIsInstance(utils.get_model("openai"), StubChatModel)
+        for mode in ("batched", "per_field"):
+            with mock.patch.object(utils, "INSIGHT_MODE", mode):
+                ins = utils.statement_insights("income statement", {"ticker": "TEST"}, [True, False, True, False, False],
+                    inc_stat_attributes, inc_stat, IncomeStatementInsights)
+            self.assertEqual(list(ins), ["revenue_health", "r_and_d_focus"])
+            self.assertTrue(ins["r_and_d_focus"].startswith("R and d focus:"))
+
+    def test_sub_questions_and_embeddings(self):
+        prompt = "# Example 2\n<Tools>\n```json\n{\"Annual Report\": \"Provides information\"}\n```\n\n<User Question>\nWhat are the risk factors?\n\n<Output>\n"
+        self.assertIn('"tool_name": "Annual Report"', sub_questions(prompt))
+        similar = sum(a * b for a, b in zip(hashed_embedding("major events in 2023"), hashed_embedding("major events of 2023")))
+        different = sum(a * b for a, b in zip(hashed_embedding("major events in 2023"), hashed_embedding("risk mitigation plans")))
+        self.assertGreater(similar, different)
+
+
+class TestTelemetry(TempEnvMixin, unittest.TestCase):
+
+    env = STUB_ENV
+
+    def test_cost_uses_longest_prefix(self):
+        self.assertAlmostEqual(cost("gpt-3.5-turbo-0613", 1000, 1000), 0.003)
+        self.assertAlmostEqual(cost("gpt-4-1106-preview", 1000, 0), 0.01)
+        self.assertEqual(cost("unknown", 1000, 1000), 0.0)
+
+    def test_records_are_aggregated_per_field(self):
+        with tracked_run("test") as run:
+            with field_scope("revenue_health", queued=0.5):
+                record("llm", "gpt-3.5-turbo", 1.0, 1000, 500)
+                record("llm", "gpt-3.5-turbo", 1.0, 1000, 500)
+            record("embedding", "text-embedding-ada-002", 0.1, 10, 0)
+        record("llm", "gpt-3.5-turbo", 1.0, 1000, 500)
+        fields = run.by_field()
+        self.assertEqual(list(fields), ["revenue_health", None])
+        self.assertEqual(fields["revenue_health"]["calls"], 2)
+        # the executor wait is charged once
+        self.assertEqual(fields["revenue_health"]["queue_s"], 0.5)
+        self.assertEqual(run.summary()["calls"], 3)
+
+    def test_model_calls_are_recorded(self):
+        with tracked_run("test") as run:
+            ins = utils.statement_insights("income statement", {"ticker": "TEST"}, [True, False, True, False, False],
+                inc_stat_attributes, inc_stat, IncomeStatementInsights)
+            context = utils.get_service_context("openai")
+            run_ordered([("major_events", context.llm.complete, "What were the major events?"),
+                         ("risk_factors", context.embed_model.get_query_embedding, "What are the risk factors?")])
+        fields = run.by_field()
+        batched = "+".join(ins)
+        self.assertEqual(set(fields), {batched, "major_events", "risk_factors"})
+        self.assertGreater(fields[batched]["completion_tokens"], 0)
+        self.assertEqual(fields["risk_factors"]["completion_tokens"], 0)
+        self.assertGreater(fields["risk_factors"]["prompt_tokens"], 0)
+
+
+class TestCompletionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = CompletionCache(os.path.join(self.tmp.name, "llm.sqlite"), max_entries=2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key_depends_on_model_template_and_input(self):
+        model = mock.Mock(model_name="gpt-3.5-turbo")
+        other = mock.Mock(model_name="gpt-4")
+        key = completion_key(model, "template", "input")
+        self.assertEqual(key, completion_key(model, "template", "input"))
+        self.assertNotEqual(key, completion_key(other, "template", "input"))
+        self.assertNotEqual(key, completion_key(model, "template v2", "input"))
+        self.assertNotEqual(key, completion_key(model, "template", "input 2"))
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set("a", "m", "A")
+        time.sleep(0.01)
+        self.cache.set("b", "m", "B")
+        time.sleep(0.01)
+        self.assertEqual(self.cache.get("a"), "A")
+        time.sleep(0.01)
+        self.cache.set("c", "m", "C")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "A")
+        self.assertEqual(self.cache.get("c"), "C")
+
+    def test_invalidate_by_symbol(self):
+        self.cache.set("a", "m", "A", tag="aapl")
+        self.cache.set("b", "m", "B", tag="MSFT")
+        self.assertEqual(self.cache.invalidate("AAPL"), 1)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), "B")
+
+class TestSemanticCache(TempEnvMixin, unittest.TestCase):
+
+    class FakeEngine:
+
+        def __init__(self):
+            self.queries = []
+
+        def query(self, text):
+            self.queries.append(text)
+            return types.SimpleNamespace(response=f"answer to {text}")
+
+    EMBEDDINGS = {
+        "What were the major events?": [1.0, 0.0, 0.0],
+        "Which major events happened?": [0.99, 0.05, 0.0],
+        "What are the risk factors?": [0.0, 1.0, 0.0],
+    }
+
+    env = {"SEMANTIC_CACHE_PATH": os.path.join("{tmp}", "answers.sqlite"), "SEMANTIC_CACHE_THRESHOLD": "0.95"}
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.environ["SEMANTIC_CACHE_PATH"]
+        self.engine = self.FakeEngine()
+
+    def ask(self, question, doc_hash="doc", insight="major_events"):
+        return cached_query(self.engine, doc_hash, question, embed=self.EMBEDDINGS.__getitem__, insight=insight)
+
+    def test_similar_question_reuses_answer(self):
+        first = self.ask("What were the major events?")
+        self.assertEqual(self.ask("What were the major events?"), first)
+        self.assertEqual(self.ask("Which major events happened?"), first)
+        self.ask("What are the risk factors?")
+        self.assertEqual(len(self.engine.queries), 2)
+
+    def test_answers_are_per_document(self):
+        self.ask("What were the major events?", "doc-a")
+        self.ask("What were the major events?", "doc-b")
+        self.assertEqual(len(self.engine.queries), 2)
+
+    def test_stats_and_persistence(self):
+        self.ask("What were the major events?")
+        self.ask("Which major events happened?")
+        cache = SemanticCache(self.path, model=answer_model())
+        self.assertEqual(cache.nearest("doc", "major_events", [1.0, 0.0, 0.0]), "answer to What were the major events?")
+        self.assertEqual(cache.hit_stats(), {"exact_hits": 0, "semantic_hits": 1, "misses": 0, "hit_rate": 1.0})
+
+    def test_answers_are_per_model(self):
+        with mock.patch.dict(os.environ, {"LLM_BACKEND": "stub"}):
+            self.ask("What were the major events?")
+        self.ask("What were the major events?")
+        self.assertEqual(len(self.engine.queries), 2)
+        self.assertEqual(SemanticCache(self.path, model="stub").exact("doc", "major_events", "What were the major events?"),
+                         "answer to What were the major events?")
+
+    def test_fields_do_not_share_answers(self):
+        # report prompts for two fields of one section differ only in the field and its description
+        prompts = {field: get_prompts().format("report", insight_name=field, section_name="Risk Management",
+                                               output_format=str({field: risk_management[field]}))[1]
+                   for field in ["risk_factors", "risk_mitigation"]}
+        embeddings = {prompt: hashed_embedding(prompt) for prompt in prompts.values()}
+        similarity = float(np.dot(*embeddings.values()))
+        with mock.patch.dict(os.environ, {"SEMANTIC_CACHE_THRESHOLD": str(similarity - 0.01)}):
+            answers = {field: cached_query(self.engine, "doc", prompt, embed=embeddings.__getitem__, insight=field) for field, prompt in prompts.items()}
+        self.assertEqual(len(self.engine.queries), 2)
+        self.assertNotEqual(answers["risk_factors"], answers["risk_mitigation"])
+
+
+class TestLLMExecutor(unittest.TestCase):
+
+    def test_results_keep_call_order(self):
+        executor = ProviderExecutor("test", 4, 0)
+        delays = {"a": 0.2, "b": 0.0, "c": 0.1, "d": 0.05}
+        start = time.monotonic()
+        results = executor.run_ordered([(key, lambda k, d: time.sleep(d) or k.upper(), key, d) for key, d in delays.items()])
+        self.assertEqual(list(results.items()), [("a", "A"), ("b", "B"), ("c", "C"), ("d", "D")])
+        self.assertLess(time.monotonic() - start, 0.3)
+
+    def test_concurrency_cap(self):
+        executor = ProviderExecutor("test", 2, 0)
+        lock = threading.Lock()
+        active, peak = [0], [0]
+
+        def call(i):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return i
+
+        results = executor.run_ordered([(i, call, i) for i in range(8)])
+        self.assertEqual(list(results.values()), list(range(8)))
+        self.assertEqual(peak[0], 2)
+
+    def test_error_is_raised(self):
+        executor = ProviderExecutor("test", 2, 0)
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            executor.run_ordered([("ok", str, 1), ("bad", fail)])
+
+    def test_stream_yields_every_chunk(self):
+        executor = ProviderExecutor("test", 2, 0)
+
+        def words(text, delay):
+            for word in text.split():
+                time.sleep(delay)
+                yield word
+
+        chunks = list(executor.stream_ordered([("slow", words, "a b c", 0.02), ("fast", words, "x y", 0.0)]))
+        self.assertEqual([c for k, c in chunks if k == "slow"], ["a", "b", "c"])
+        self.assertEqual([c for k, c in chunks if k == "fast"], ["x", "y"])
+        # the fast call is not held back behind the slow one
+        self.assertLess(chunks.index(("fast", "y")), chunks.index(("slow", "c")))
+
+    def test_nested_calls_run_inline(self):
+        executor = ProviderExecutor("test", 1, 0)
+        outer = lambda: executor.run_ordered([("inner", str, 1)])["inner"]
+        self.assertEqual(executor.run_ordered([("outer", outer)]), {"outer": "1"})
+
+
 class TestIngestion(unittest.TestCase):
 
     def test_extract(self):